@@ -317,55 +317,102 @@ const ChatInterface = ({ projectId }) => {
 
     const storage = getStorage();
 
-    // Upload each chunk and request embeddings
-    for (let i = 0; i < chunks.length; i++) {
-      setUploadStatus(`Processing chunk ${i + 1} of ${chunks.length}`);
-
-      // Create and upload chunk to Firebase
-      const chunkId = uuidv4();
-      const chunkRef = storageRef(storage, `chunks/${chunkId}.txt`);
-      const chunkBlob = new Blob([chunks[i]], { type: "text/plain" });
-      await uploadBytes(chunkRef, chunkBlob);
-      const chunkUrl = await getDownloadURL(chunkRef);
-      console.log("chunk url");
-      console.log(chunkUrl);
-
-      // Send chunk to our backend for embedding
-      try {
-        // Remove all spaces from user.displayName
-        const safeUserName = user?.displayName
-          ? user.displayName.replace(/\s+/g, "")
-          : "UnknownUser";
-
-        const response = await fetch("http://localhost:5010/add_embedding", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({
-            chunk_url: chunkUrl,
-            chunk_text: chunks[i],
+    // Upload every chunk to Firebase, then embed them all in one request
+    setUploadStatus(`Uploading ${chunks.length} chunks`);
+    const chunkUrls = await Promise.all(
+      chunks.map(async (chunk) => {
+        const chunkId = uuidv4();
+        const chunkRef = storageRef(storage, `chunks/${chunkId}.txt`);
+        const chunkBlob = new Blob([chunk], { type: "text/plain" });
+        await uploadBytes(chunkRef, chunkBlob);
+        return getDownloadURL(chunkRef);
+      })
+    );
+
+    setUploadStatus(`Embedding ${chunks.length} chunks`);
+    try {
+      // Remove all spaces from user.displayName
+      const safeUserName = user?.displayName
+        ? user.displayName.replace(/\s+/g, "")
+        : "UnknownUser";
+
+      const response = await fetch("http://localhost:5010/add_embeddings_batch", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          user_name: safeUserName, // use the space-stripped username
+          class_id: className,
+          chunks: chunks.map((chunk, i) => ({
+            chunk_url: chunkUrls[i],
+            chunk_text: chunk,
             original_file_url: originalFileUrl,
-            user_name: safeUserName, // use the space-stripped username
             file_type: fileType,
             file_name: originalFileName,
-          }),
-        });
-
-        // Check response status
-        if (!response.ok) {
-          const errorText = await response.text();
-          console.error(
-            `Server responded with an error. Status: ${response.status} - ${errorText}`
-          );
-        } else {
-          const data = await response.json();
-          console.log("Successfully embedded chunk:", data);
-        }
-      } catch (err) {
-        console.error("Error sending chunk to backend:", err);
+          })),
+        }),
+      });
+
+      // Check response status
+      if (!response.ok) {
+        const errorText = await response.text();
+        console.error(
+          `Server responded with an error. Status: ${response.status} - ${errorText}`
+        );
+      } else {
+        const data = await response.json();
+        console.log("Successfully embedded chunks:", data.counts);
       }
+    } catch (err) {
+      console.error("Error sending chunks to backend:", err);
     }
   };
 
+  /**
+   * ingestPdf
+   * Sends a PDF to the backend, which extracts, chunks and embeds it as a
+   * background job, and polls the job until it finishes.
+   */
+  const ingestPdf = async (file, originalFileUrl, originalFileName) => {
+    const safeUserName = user?.displayName
+      ? user.displayName.replace(/\s+/g, "")
+      : "UnknownUser";
+
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append("user_name", safeUserName);
+    formData.append("original_file_url", originalFileUrl);
+    formData.append("file_name", originalFileName);
+    formData.append("class_id", className);
+
+    const response = await fetch("http://localhost:5010/ingest_pdf", {
+      method: "POST",
+      body: formData,
+    });
+    if (!response.ok) {
+      throw new Error(`PDF ingestion could not start: ${response.status}`);
+    }
+    const { job_id: jobId } = await response.json();
+
+    let job;
+    do {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      job = await (await fetch(`http://localhost:5010/jobs/${jobId}`)).json();
+      if (job.progress && job.progress.total) {
+        setUploadStatus(
+          `Embedding page ${job.progress.done} of ${job.progress.total}`
+        );
+      }
+    } while (job.status === "queued" || job.status === "running");
+
+    const data = await (
+      await fetch(`http://localhost:5010/jobs/${jobId}/result`)
+    ).json();
+    if (data.status !== "success") {
+      throw new Error(data.message);
+    }
+    console.log("Successfully embedded chunks:", data.counts);
+  };
+
   /**
    * handleFileUpload
    * Called when a file is selected (or dropped).
@@ -397,7 +444,29 @@ const ChatInterface = ({ projectId }) => {
         method: "POST",
         body: formData,
       });
-      const data = await response.json();
+      const { job_id: jobId } = await response.json();
+
+      // Transcription runs as a background job; poll until it finishes
+      let job;
+      do {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        job = await (await fetch(`http://localhost:5010/jobs/${jobId}`)).json();
+        if (job.progress && job.progress.total) {
+          const eta = job.eta_seconds ? `, ~${Math.ceil(job.eta_seconds)}s left` : "";
+          setUploadStatus(
+            `Transcribing ${job.progress.done} of ${job.progress.total} segments${eta}`
+          );
+        }
+      } while (job.status === "queued" || job.status === "running");
+
+      const data = await (
+        await fetch(`http://localhost:5010/jobs/${jobId}/result`)
+      ).json();
+      if (data.status !== "success") {
+        console.error("Video processing failed:", data.message);
+        setUploadStatus("Error processing video");
+        return;
+      }
 
       // const video_transcript_id = uuidv4();
       // const originalVideoTranscriptFile = storageRef(
@@ -483,8 +552,12 @@ const ChatInterface = ({ projectId }) => {
         await uploadBytes(originalFileRef, file);
         const originalFileUrl = await getDownloadURL(originalFileRef);
 
-        // 2. Process chunks and store embeddings
-        await processFileChunks(file, originalFileUrl, false, "text",  file["name"].split(".")[0]);
+        // 2. Process chunks and store embeddings (PDFs are extracted and chunked on the server)
+        if (fileExtension.toLowerCase() === "pdf") {
+          await ingestPdf(file, originalFileUrl, file["name"].split(".")[0]);
+        } else {
+          await processFileChunks(file, originalFileUrl, false, "text",  file["name"].split(".")[0]);
+        }
 
         // 3. Update UI with new document
         setDocuments((prev) => [
@@ -531,13 +604,16 @@ const ChatInterface = ({ projectId }) => {
 
     setIsLoading(true);
     try {
-      const response = await fetch("http://localhost:5010/search", {
+      // One request runs retrieval, identification, generation and timestamp
+      // lookup on the server and streams results back as Server-Sent Events.
+      const response = await fetch("http://localhost:5010/answer", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
-          query: message,
+          question: message,
           num_results: 3,
           user_name: user?.displayName || "UnknownUser",
+          class_id: className, // only search this class's material
         }),
       });
 
@@ -546,68 +622,47 @@ const ChatInterface = ({ projectId }) => {
         console.error(
           `Server responded with an error. Status: ${response.status} - ${errorText}`
         );
-      } else {
-        const search_data = await response.json();
-        // 1) Log the entire server response
-        console.log("Search data from server:", search_data);
-
-        if (search_data.status === "success") {
-          // 2) Also log just the results for clarity
-          console.log("Search results:", search_data.results);
-
-          //feed sanjay code
-          const response = await fetch("http://localhost:5010/run_identification", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-              question: message,
-              top_k_queries: search_data.results.map(obj => obj.chunk_text),
-              top_k_types: search_data.results.map(obj => obj.file_type)
-            }),
-          });
-          const data = await response.json();
-
-          const response2 = await fetch("http://localhost:5010/run_generation", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-              question: message,
-              top_k_ids: data['top_k_ids']
-            }),
-          });
-          const data2 = await response2.json();
-
-
-          const response3 = await fetch("http://localhost:5010/postprocess_generation", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-              generated_content: data2['answer'],
-              top_k_urls: search_data.results.map(obj => obj.original_file_url),
-              top_k_names: search_data.results.map(obj => obj.file_name),
-            }),
-          });
-          const data3 = await response3.json();
-
-
-          const response4 = await fetch("http://localhost:5010/get_video_timestamp", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-              transcript_content_chunks: search_data.results.map(obj => obj.chunk_text),
-              file_types: search_data.results.map(obj => obj.file_type),
-              file_urls: search_data.results.map(obj => obj.original_file_url),
-              file_names: search_data.results.map(obj => obj.file_name),
-              top_k_ids: data['top_k_ids'],
-            }),
-          });
-          const data4 = await response4.json();
-          setResourceInfo(data4['timestamp']);
-
-          // Update local state with the returned results
-          setSearchResults(data3['answer']);
-        } else {
-          console.error("Search error:", search_data.message);
+        return;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let answer = "";
+
+      const handleEvent = (event, data) => {
+        if (event === "sources") {
+          console.log("Search results:", data);
+        } else if (event === "token") {
+          answer += data.text;
+          setSearchResults(answer);
+        } else if (event === "timestamps") {
+          setResourceInfo(data.timestamp);
+        } else if (event === "done") {
+          console.log("Answer timings:", data.timings);
+          setSearchResults(data.answer);
+        } else if (event === "error") {
+          console.error("Answer error:", data.message);
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = "message";
+          let data = "";
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          if (data) handleEvent(event, JSON.parse(data));
         }
       }
     } catch (error) {
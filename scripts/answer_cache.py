@@ -0,0 +1,128 @@
+# answer_cache.py
+#
+# Semantic cache of generated answers, so a question that was already answered
+# over the same retrieved chunks is served without another gpt-4o completion.
+#
+# An entry is keyed by scope (a user, or one of their classes), the set of
+# context chunk ids, and the question's embedding. A lookup hits when an entry
+# with the same scope and chunk set has a question embedding at least
+# `threshold` cosine-similar to the new one. Entries are evicted LRU and by
+# TTL, and a scope's entries are dropped when material is added to it.
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def scope_key(user_name, class_id=None):
+    return user_name if class_id is None else f"{user_name}.{class_id}"
+
+
+def context_key(chunk_ids):
+    """Order-independent key for the set of chunks an answer was generated from."""
+    return hashlib.sha256("\x00".join(sorted(set(chunk_ids))).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Bounded LRU + TTL cache of answers, looked up by question similarity within
+    a (scope, context) group. Thread-safe.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=24 * 3600, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries = OrderedDict()  # entry id -> (group, unit question vector, answer, expires_at)
+        self._groups = {}  # (scope, context key) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope, chunk_ids, question_vector):
+        """The cached answer for a similar enough question over the same chunks, or None."""
+        group = (scope, context_key(chunk_ids))
+        query = self._unit(question_vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._groups.get(group, ())):
+                _, vector, _, expires_at = self._entries[entry_id]
+                if expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, scope, chunk_ids, question_vector, answer):
+        group = (scope, context_key(chunk_ids))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (group, self._unit(question_vector), answer, time.time() + self.ttl_seconds)
+            self._groups.setdefault(group, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, scope, include_classes=False):
+        """
+        Drop every answer cached for a scope (new material may change them),
+        and with include_classes the answers of every class under a user scope.
+        """
+        with self._lock:
+            for group in [group for group in self._groups
+                          if group[0] == scope or (include_classes and group[0].startswith(scope + "."))]:
+                for entry_id in list(self._groups[group]):
+                    self._remove(entry_id)
+                    self.invalidations += 1
+
+    def _remove(self, entry_id):
+        group = self._entries.pop(entry_id)[0]
+        members = self._groups[group]
+        members.discard(entry_id)
+        if not members:
+            del self._groups[group]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("OMNIS_ANSWER_CACHE_SIZE", "1000")),
+    ttl_seconds=float(os.getenv("OMNIS_ANSWER_CACHE_TTL", str(24 * 3600))),
+    threshold=float(os.getenv("OMNIS_ANSWER_CACHE_THRESHOLD", "0.95")),
+)
@@ -1,26 +1,43 @@
 # app.py
 
-from flask import Flask, request, jsonify
+import time
+# How long importing this module takes is exported as omnis_startup_seconds{phase="import"}
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from backend_database import add_embeddings, search_files
-import os
-from video_to_transcript import AudioHandler
-import pandas as pd 
-import numpy as np
+from backend_database import add_embeddings, add_embeddings_batch, search_files
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from typing import List 
-from tqdm import tqdm
-import re
-from difflib import SequenceMatcher
-from identification_generation import setup_openai_key, parse_text_from_timestamps, parse_text_from_timestamps_original, parse_timestamps, chunk_str, get_timestamp_from_answer
-from backend_database import setup_database_connection
+from video_to_transcript import AudioHandler, get_whisper_client
+import json
+import threading
+from identification_generation import setup_openai_key
+from backend_database import db_connection, ensure_class_table_exists, normalize_class_id, embed_query, content_fingerprint, get_embeddings_model
+from embedding_cache import query_embedding_cache
+from answer_cache import answer_cache, scope_key
+from concurrent.futures import ThreadPoolExecutor
+from jobs import job_manager, QueueFullError, SUCCEEDED, FAILED, CANCELLED
+from transcript_index import get_transcript_index
+from pdf_ingestion import ingest_pdf
+from identification import get_tokenizer, identify_documents, IDENTIFICATION_CONCURRENCY, LLM_CALL_TIMEOUT, ID_TOKEN_BUDGET, IDENTIFICATION_MODE, IDENTIFICATION_MODES
+import shutil
+import uuid
+import contextvars
+import metrics
+from metrics import span, record_stage
 
 
 app = Flask(__name__)
 CORS(app)
+metrics.install(app)
+
+
+def index_video_chunks(chunks):
+    """Build the timestamp lookup index for video transcripts at ingest rather than on first question."""
+    for chunk in chunks:
+        if chunk.get("file_type") == "video":
+            get_transcript_index(chunk["chunk_text"])
+
 
 @app.route('/add_embedding', methods=['POST'])
 def create_embedding():
@@ -45,8 +62,11 @@ def create_embedding():
             original_file_url=data['original_file_url'],
             user_name=data['user_name'],
             file_type=data['file_type'],
-            file_name=data['file_name']
+            file_name=data['file_name'],
+            class_id=data.get('class_id'),
         )
+        if result.get("status") == "success":
+            index_video_chunks([data])
 
         # Return 200 status regardless of whether chunk was new or existing
         return jsonify(result), 200
@@ -57,16 +77,74 @@ def create_embedding():
             "message": str(e)
         }), 500
     
-@app.route('/process_video', methods=['POST'])
-def process_video():
-    
-    video_file = request.files['video']
+@app.route('/add_embeddings_batch', methods=['POST'])
+def create_embeddings_batch():
+    """
+    Add embeddings for many chunks of text in one request. A top-level
+    class_id applies to every chunk that doesn't set its own.
+    """
+    try:
+        data = request.json
 
-    file_path = 'temp/video.mp4'
-    video_file.save(file_path)
+        if not data or not data.get("user_name") or not data.get("chunks"):
+            return jsonify({
+                "status": "error",
+                "message": "Missing required fields: user_name, chunks"
+            }), 400
+        try:
+            normalize_class_id(data.get("class_id"))
+            for chunk in data['chunks']:
+                normalize_class_id(chunk.get("class_id"))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        # Validate each chunk on its own so one bad chunk doesn't reject the batch
+        required_fields = ["chunk_url", "chunk_text", "original_file_url", "file_type", "file_name"]
+        valid_chunks = []
+        invalid_results = {}
+        for idx, chunk in enumerate(data['chunks']):
+            missing_fields = [f for f in required_fields if f not in chunk or not chunk[f]]
+            if missing_fields:
+                invalid_results[idx] = {
+                    "chunk_url": chunk.get("chunk_url"),
+                    "status": "error",
+                    "message": f"Missing required fields: {', '.join(missing_fields)}"
+                }
+            else:
+                valid_chunks.append(dict(chunk, class_id=chunk.get("class_id") or data.get("class_id")))
+
+        result = add_embeddings_batch(valid_chunks, user_name=data['user_name']) if valid_chunks \
+            else {"status": "success", "counts": {}, "results": []}
+        if result["status"] != "success":
+            return jsonify(result), 500
+        index_video_chunks(valid_chunks)
+
+        # Merge validation failures back in at their original positions
+        valid_results = iter(result["results"])
+        results = [invalid_results[idx] if idx in invalid_results else next(valid_results)
+                   for idx in range(len(data['chunks']))]
+        counts = dict(result["counts"])
+        if invalid_results:
+            counts["error"] = counts.get("error", 0) + len(invalid_results)
 
+        return jsonify({"status": "success", "counts": counts, "results": results}), 200
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+UPLOAD_DIR = os.getenv("OMNIS_UPLOAD_DIR", "temp")
+
+
+def transcribe_video_job(job, file_path):
+    """Job body for /process_video: transcribe the upload and return the transcripts."""
     ah = AudioHandler(file_path)
-    transcript_paths = ah.process_audio()
+    transcript_paths = ah.process_audio(
+        progress_callback=job.update_progress,
+        check_cancelled=job.check_cancelled,
+    )
     print("transcript(s) saved to: ", transcript_paths)
 
     #convert the posix paths to file paths
@@ -78,17 +156,145 @@ def process_video():
             content = file.read()
             transcript_content.append(content)
 
-    return jsonify({
-        "status": "success",
-        "message": "Video processed successfully",
+    with open(ah.transcript_json_path, 'r', encoding="utf-8") as file:
+        transcript = json.load(file)
+
+    return {
         "transcript_paths": transcript_paths,
-        "transcript_content": transcript_content
-    })
+        "transcript_content": transcript_content,
+        "transcript": transcript,
+    }
+
+
+def cleanup_video_upload(job, file_path):
+    """
+    The upload directory (the video and its transcript files) is
+    only needed while transcribing: the transcripts are kept in the job result.
+    """
+    shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+
+@app.route('/process_video', methods=['POST'])
+def process_video():
+    """
+    Queue a video for transcription and return its job id right away (202).
+    Poll /jobs/<job_id> for progress and fetch /jobs/<job_id>/result when done.
+    """
+    video_file = request.files['video']
+
+    # Every upload gets its own directory so concurrent uploads can't overwrite each other
+    upload_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOAD_DIR, upload_id, 'video.mp4')
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    video_file.save(file_path)
+
+    try:
+        job = job_manager.submit(
+            "process_video", transcribe_video_job, file_path,
+            on_finish=lambda job: cleanup_video_upload(job, file_path),
+        )
+    except QueueFullError as e:
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        return jsonify({"status": "error", "message": f"Server busy, try again later: {e}"}), 503
+
+    return jsonify({
+        "status": "queued",
+        "message": "Video queued for processing",
+        "job_id": job.id
+    }), 202
+
+
+def ingest_pdf_job(job, file_path, user_name, original_file_url, file_name, class_id):
+    """Job body for /ingest_pdf: extract, chunk, embed and store the PDF."""
+    return ingest_pdf(
+        file_path, user_name, original_file_url, file_name, class_id=class_id,
+        progress_callback=job.update_progress,
+        check_cancelled=job.check_cancelled,
+    )
+
+
+@app.route('/ingest_pdf', methods=['POST'])
+def ingest_pdf_route():
+    """
+    Queue a PDF for server-side ingestion and return its job id right away (202).
+    Progress is reported in pages; the result has the per-status chunk counts.
+    class_id (optional) files the chunks under one of the user's classes.
+    """
+    missing = [field for field in ('user_name', 'original_file_url', 'file_name') if not request.form.get(field)]
+    if 'file' not in request.files or missing:
+        return jsonify({"status": "error", "message": f"Missing fields: {['file'] if 'file' not in request.files else missing}"}), 400
+    try:
+        class_id = normalize_class_id(request.form.get('class_id'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    upload_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOAD_DIR, upload_id, 'document.pdf')
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    request.files['file'].save(file_path)
+
+    try:
+        job = job_manager.submit(
+            "ingest_pdf", ingest_pdf_job, file_path,
+            request.form['user_name'], request.form['original_file_url'], request.form['file_name'], class_id,
+            # The stored chunks hold the text; the upload itself is never needed again
+            on_finish=lambda job: shutil.rmtree(os.path.dirname(file_path), ignore_errors=True),
+        )
+    except QueueFullError as e:
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        return jsonify({"status": "error", "message": f"Server busy, try again later: {e}"}), 503
+
+    return jsonify({
+        "status": "queued",
+        "message": "PDF queued for ingestion",
+        "job_id": job.id
+    }), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, progress (segments done / total) and ETA of a background job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    if job.status == SUCCEEDED:
+        return jsonify({
+            "status": "success",
+            "message": "PDF ingested successfully" if job.kind == "ingest_pdf" else "Video processed successfully",
+            **job.result
+        })
+    if job.status in (FAILED, CANCELLED):
+        return jsonify({"status": "error", "message": job.error or f"Job {job.status}"}), 409
+    # Not finished yet
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route('/search', methods=['POST'])
 def search():
-    """Search for similar content in the user's chunk database."""
+    """
+    Search for similar content in the user's chunk database.
+
+    search_mode (optional): "exact", "ann" or "hybrid"
+    lexical_weight, vector_weight (optional): how much the keyword and vector
+        rankings count in hybrid mode (default 1.0 each)
+    class_id, file_type, file_name (optional): only search matching chunks
+    """
     try:
         data = request.json
 
@@ -107,7 +313,14 @@ def search():
         result = search_files(
             search_phrase=data['query'],
             user_name=user_name,
-            num_results=num_results
+            num_results=num_results,
+            search_mode=data.get('search_mode'),
+            nprobe=data.get('nprobe'),
+            lexical_weight=float(data.get('lexical_weight', 1.0)),
+            vector_weight=float(data.get('vector_weight', 1.0)),
+            class_id=data.get('class_id'),
+            file_type=data.get('file_type'),
+            file_name=data.get('file_name'),
         )
 
         return jsonify(result)
@@ -118,54 +331,68 @@ def search():
             "message": str(e)
         }), 500
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the server-side caches."""
+    return jsonify({
+        "status": "success",
+        "query_embeddings": query_embedding_cache.stats(),
+        "answers": answer_cache.stats(),
+    })
+
 @app.route('/run_identification', methods=['POST'])
 def run_identification():
     """
     top_k_queries: text over either video transcript or documents (notes, slides, etc.)
     top_k_types: either video, text, or image
+    max_concurrency (optional): number of model calls in flight
+    token_budget (optional): most context tokens sent across all chunks
+    mode (optional): "llm", "local" (rank the chunk's sentences locally, no
+        model call) or "auto" (local, with the model as fallback when unsure)
+
+    Long chunks are split into sub-chunks and only the relevant ones are sent,
+    concurrently (see identification.py). top_k_ids keeps the input order; a
+    chunk whose calls all fail gets an empty string and an entry in errors.
     """
     data = request.json
     top_k_queries = data['top_k_queries']
     top_k_types = data['top_k_types']
     question = data['question']
-
-    client = setup_openai_key()
-
-    print(data)
+    max_concurrency = int(data.get('max_concurrency', IDENTIFICATION_CONCURRENCY))
+    token_budget = int(data.get('token_budget', ID_TOKEN_BUDGET))
+    mode = data.get('mode', IDENTIFICATION_MODE)
+    if mode not in IDENTIFICATION_MODES:
+        return jsonify({
+            "status": "error",
+            "message": f"mode must be one of {', '.join(IDENTIFICATION_MODES)}"
+        }), 400
+
+    # Local mode never calls the model, so don't require a key for it
+    client = setup_openai_key() if mode != "local" else None
+
+    results, stats = identify_documents(
+        client,
+        question,
+        list(zip(top_k_queries, top_k_types)),
+        max_workers=max_concurrency,
+        token_budget=token_budget,
+        mode=mode,
+    )
 
     top_k_ids = []
-    for idx, (chunk_text, chunk_type) in tqdm(enumerate(zip(top_k_queries, top_k_types))):
-        if chunk_type == "video":
-            # Remove whitespace after joining
-            chunk_text = "\n".join(parse_text_from_timestamps_original(chunk_text)).strip()
-        context_artifact_chunks = chunk_str(chunk_text)
-
-        ID_MODEL_SYSTEM_PROMPT = """
-        You are a helpful assistant specializing in identifying parts of text documents that best correspond to the answer for a query.
-        You specialize in thinking deeply about the answer to a given question and then returning the exact sentences word for word that 
-        best contain the answer to the question from the given context. The context is preceded by a section header called CONTEXT.
-        """
-
-        # Add context - hacky way of just adding the first chunk if context is too long
-        context = f"CONTEXT:\n {context_artifact_chunks[0]}"
-        INPUT_MSG = question + context
-
-        # Make the API call to o1-mini
-        id_response = client.chat.completions.create(
-            model="gpt-4o",
-            messages = [
-            {"role": "user", "content": f"instructions {ID_MODEL_SYSTEM_PROMPT}\n, question: {INPUT_MSG}"}],
-        )
-
-        id_response_content = id_response.choices[0].message.content
-        # Post-processing
-        id_response_content = id_response_content.replace("\n", " ").replace('`', "")
+    errors = []
+    for idx, (id_response_content, error) in enumerate(results):
+        if error is not None:
+            print(f"Attribution failed for top {idx} query: {error}")
+            errors.append({"index": idx, "message": str(error)})
+            id_response_content = ""
         top_k_ids.append(id_response_content)
-        print(f"Finished attribution for top {idx} query")
 
     return jsonify({
         "status": "success",
-        "top_k_ids": top_k_ids
+        "top_k_ids": top_k_ids,
+        "errors": errors,
+        "stats": stats
     })
 
 
@@ -175,6 +402,8 @@ def create_class():
     """
     Creates a new schema for the user: user_name.class_name
     Optionally create a table as well for chunk embeddings.
+    The table registers the class for /list_classes; its chunks are stored in
+    {user}.classes under class_id = class_name (see search_files).
     """
     try:
         data = request.json
@@ -190,30 +419,14 @@ def create_class():
         # But let's store it as a single schema + table naming approach:
         # e.g., create a SCHEMA named safe_user_name, then a table "class_name"
         # OR directly do safe_user_name.safe_class_name
-        conn = setup_database_connection()
-        cursor = conn.cursor()
-
-        # 1) Attempt to create the schema if it doesn't exist
-        # IRIS may or may not support "CREATE SCHEMA IF NOT EXISTS"
-        try:
-            cursor.execute(f'CREATE SCHEMA {safe_user_name}')
-        except Exception as e:
-            # If it already exists or IRIS doesn't support this exact syntax,
-            # you can ignore or handle specifically.
-            print("Schema creation info:", str(e))
-
-        # 2) Create a table inside that schema for chunk embeddings
-        # e.g. {schema}.{classname}_embeddings
-        table_ddl = f"""
-        CREATE TABLE IF NOT EXISTS {safe_user_name}.{safe_class_name}(
-            chunk_url VARCHAR(1000),
-            chunk_text VARCHAR(10000),
-            embedding VECTOR(DOUBLE, 1536),
-            original_file_url VARCHAR(1000)
-        )
-        """
-        cursor.execute(table_ddl)
-        conn.commit()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Creates schema and table once per process; later calls are served from the registry
+                ensure_class_table_exists(cursor, safe_user_name, safe_class_name)
+                conn.commit()
+            finally:
+                cursor.close()
 
         # Return some success response
         return jsonify({
@@ -238,9 +451,6 @@ def list_classes():
         user_name = request.args.get('user_name', 'UnknownUser')
         safe_user_name = user_name.replace(" ", "")  # or any other sanitization
 
-        conn = setup_database_connection()
-        cursor = conn.cursor()
-
         # IRIS typically stores table info in INFORMATION_SCHEMA or a dictionary table.
         # Example query using INFORMATION_SCHEMA:
         sql = """
@@ -248,15 +458,20 @@ def list_classes():
         FROM INFORMATION_SCHEMA.TABLES
         WHERE table_schema = ?
         """
-        cursor.execute(sql, [safe_user_name])
-        rows = cursor.fetchall()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, [safe_user_name])
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
 
         class_list = []
         for (table_name,) in rows:
             # e.g. table_name might be 'CS194W_embeddings'
             # We'll remove '_embeddings' suffix to get 'CS194W'.
             print(table_name)
-            if "classes" in table_name:
+            if "classes" in table_name or table_name == "vectors":
                 continue
             if table_name.endswith("_embeddings"):
                 raw_class_name = table_name.replace("_embeddings", "")
@@ -272,25 +487,9 @@ def list_classes():
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 
-@app.route('/run_generation', methods=['POST'])
-def run_generation():
-    """
-    top_k_ids: represent context for each of the top k resources 
-    """
-    client = setup_openai_key()
-
-    data = request.json
-    top_k_ids = data['top_k_ids']
-    question = data['question']
-
-    ID_GENERATION_SYSTEM_PROMPT = """
+ID_GENERATION_SYSTEM_PROMPT = """
     You are a helpful teaching assistant who generates answers to students questions with a kind and helpful tone.
     The way you answer questions is as follows:
     You should first provide any necessary background on the student's question at the level of a high school or college student.
@@ -298,31 +497,186 @@ def run_generation():
     The context is preceded by a section header called CONTEXT.
     """
 
-    #To correctly reference the document context, you will add an HTML hyperlinks in correspondence of the key concepts discussed. 
-    #For example, if you have a document describing XYZ and URL to the document, you would discuss XYZ and you will write important words or expressions of the discussion in the form of HTML hyperlink. 
-    #In other words, if WORD is an important word of the summary that describes a document having link URL, you will write <a href=URL>WORD</a> instead of WORD in the summary.
+#To correctly reference the document context, you will add an HTML hyperlinks in correspondence of the key concepts discussed. 
+#For example, if you have a document describing XYZ and URL to the document, you would discuss XYZ and you will write important words or expressions of the discussion in the form of HTML hyperlink. 
+#In other words, if WORD is an important word of the summary that describes a document having link URL, you will write <a href=URL>WORD</a> instead of WORD in the summary.
 
+
+def generation_messages(question, top_k_ids):
+    """Build the chat messages for answer generation from the identified context."""
     # Add context
     context = "CONTEXT:\n"
     for id_context in top_k_ids:
         context += f"{id_context}\n"
     INPUT_MSG = question + context
+    return [{"role": "user", "content": f"instructions {ID_GENERATION_SYSTEM_PROMPT}\n, question: {INPUT_MSG}"}]
 
-    # Make the API call to o3-mini
-    generated_response = client.chat.completions.create(
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def generate_answer_tokens(client, question, top_k_ids):
+    """
+    Stream a gpt-4o answer. Yields ("token", text) per delta, then ("done", info)
+    with the full answer, usage counts and time to first token.
+    """
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
         model="gpt-4o",
-        messages = [
-        {"role": "user", "content": f"instructions {ID_GENERATION_SYSTEM_PROMPT}\n, question: {INPUT_MSG}"}],
+        messages=generation_messages(question, top_k_ids),
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=LLM_CALL_TIMEOUT,
     )
+    parts = []
+    usage = None
+    time_to_first_token = None
+    error = None
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens,
+                }
+            if chunk.choices and chunk.choices[0].delta.content:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start
+                parts.append(chunk.choices[0].delta.content)
+                yield "token", chunk.choices[0].delta.content
+        yield "done", {
+            "answer": "".join(parts),
+            "usage": usage,
+            "time_to_first_token": time_to_first_token,
+            "total_time": time.perf_counter() - start,
+        }
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        # Runs on GeneratorExit too: if the client disconnected, stop the upstream completion
+        stream.close()
+        # The completion is consumed lazily, so it is timed here rather than with span()
+        record_stage("llm_generation", time.perf_counter() - start, start, error)
+
+
+def stream_generation(client, question, top_k_ids, scope, chunk_ids):
+    """
+    SSE events for a streamed answer: "token" {text} per delta, then "done".
+    A cached answer is sent as a single token.
+    """
+    start = time.perf_counter()
+    question_vector, cached = lookup_cached_answer(question, scope, chunk_ids)
+    if cached is not None:
+        yield sse_event("token", {"text": cached["answer"]})
+        elapsed = time.perf_counter() - start
+        yield sse_event("done", {"answer": cached["answer"], "usage": None, "cached": True,
+                                 "time_to_first_token": elapsed, "total_time": elapsed})
+        return
+    for kind, payload in generate_answer_tokens(client, question, top_k_ids):
+        if kind == "token":
+            yield sse_event("token", {"text": payload})
+        else:
+            if question_vector is not None:
+                answer_cache.put(scope, chunk_ids, question_vector,
+                                 {"answer": payload["answer"], "top_k_ids": top_k_ids})
+            yield sse_event("done", dict(payload, cached=False))
+
+
+def lookup_cached_answer(question, scope, chunk_ids):
+    """
+    Returns (question_vector, cached entry or None); an entry holds the
+    "answer" and the "top_k_ids" it was generated from. If the question can't
+    be embedded the vector is None and the cache is skipped.
+    """
+    try:
+        question_vector = embed_query(question)
+    except Exception as e:
+        print(f"Answer cache skipped, could not embed question: {e}")
+        return None, None
+    return question_vector, answer_cache.get(scope, chunk_ids, question_vector)
+
+
+@app.route('/run_generation', methods=['POST'])
+def run_generation():
+    """
+    top_k_ids: represent context for each of the top k resources 
+
+    Answers are cached per user (or class_id) and context: chunk_urls, if
+    given, identifies the chunks the context came from; otherwise the context
+    texts themselves do. "cached" tells whether the answer came from the cache.
+    """
+    client = setup_openai_key()
+
+    data = request.json
+    top_k_ids = data['top_k_ids']
+    question = data['question']
+    try:
+        class_id = normalize_class_id(data.get('class_id'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    scope = scope_key(data.get('user_name', 'UnknownUser').strip().replace(" ", ""), class_id)
+    chunk_ids = data.get('chunk_urls') or [content_fingerprint(text) for text in top_k_ids]
+
+    question_vector, cached = lookup_cached_answer(question, scope, chunk_ids)
+    if cached is not None:
+        return jsonify({"status": "success", "answer": cached["answer"], "cached": True})
+
+    # Make the API call to o3-mini
+    with span("llm_generation"):
+        generated_response = client.chat.completions.create(
+            model="gpt-4o",
+            messages = generation_messages(question, top_k_ids),
+        )
 
     generated_response_content = generated_response.choices[0].message.content
+    if question_vector is not None:
+        answer_cache.put(scope, chunk_ids, question_vector,
+                         {"answer": generated_response_content, "top_k_ids": top_k_ids})
 
     return jsonify({
         "status": "success",
-        "answer": generated_response_content
+        "answer": generated_response_content,
+        "cached": False,
     })
 
 
+@app.route('/run_generation_stream', methods=['POST'])
+def run_generation_stream():
+    """
+    Streaming variant of /run_generation (text/event-stream), sharing its
+    answer cache. Events: "token" {text} as tokens arrive, then "done" {answer,
+    usage, cached, time_to_first_token, total_time}, or "error" {message}.
+    """
+    client = setup_openai_key()
+
+    data = request.json
+    top_k_ids = data['top_k_ids']
+    question = data['question']
+    try:
+        class_id = normalize_class_id(data.get('class_id'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    scope = scope_key(data.get('user_name', 'UnknownUser').strip().replace(" ", ""), class_id)
+    chunk_ids = data.get('chunk_urls') or [content_fingerprint(text) for text in top_k_ids]
+
+    def generate():
+        try:
+            yield from stream_generation(client, question, top_k_ids, scope, chunk_ids)
+        except Exception as e:
+            yield sse_event("error", {"message": str(e)})
+
+    return Response(
+        stream_with_context(metrics.stream(generate())),
+        mimetype="text/event-stream",
+        # Ask proxies not to buffer, or tokens arrive all at once
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 
 @app.route('/postprocess_generation', methods=['POST'])
 def postprocess_generation():
@@ -346,29 +700,221 @@ def postprocess_generation():
         "answer": final_output
     })
 
-@app.route('/get_video_timestamp', methods=['POST'])
-def get_video_timestamp():
-    data = request.json
-
-    file_types = data['file_types']
+def find_video_timestamps(transcript_content_chunks, file_types, file_urls, file_names, top_k_ids, top_k=None):
+    """
+    For each video chunk, find where in the video the identified answer was said.
+    With top_k, also return that many candidate segments per chunk.
+    """
     ans_timestamps = []
-
+    candidates = []
     for idx, file_type in enumerate(file_types):
         if file_type == "video":
-            parsed_text = parse_text_from_timestamps(data['transcript_content_chunks'][idx])
-            timestamps = parse_timestamps(parsed_text)
-            clean_text_list = [chunk["text"] for chunk in parsed_text]
-            ans_timestamps.append((data['file_urls'][idx], data['file_names'][idx], get_timestamp_from_answer(data["top_k_ids"][idx], dict(zip(clean_text_list, timestamps)))))
+            index = get_transcript_index(transcript_content_chunks[idx])
+            ans_timestamps.append((file_urls[idx], file_names[idx], index.best_timestamp(top_k_ids[idx])))
+            if top_k:
+                candidates.append(index.top_k(top_k_ids[idx], top_k))
+    if top_k:
+        return ans_timestamps, candidates
+    return ans_timestamps
+
+
+@app.route('/get_video_timestamp', methods=['POST'])
+def get_video_timestamp():
+    data = request.json
+    top_k = data.get('top_k')
+
+    found = find_video_timestamps(
+        data['transcript_content_chunks'],
+        data['file_types'],
+        data['file_urls'],
+        data['file_names'],
+        data['top_k_ids'],
+        top_k=top_k,
+    )
+    ans_timestamps, candidates = found if top_k else (found, None)
         
     if ans_timestamps:
-        return jsonify({
+        response = {
             "status": "success",
             "timestamp": ans_timestamps,
-        })
+        }
+        if top_k:
+            response["candidates"] = candidates
+        return jsonify(response)
     else:
         return jsonify({
             "status": "success",
             "timestamp": 0
         })
+
+
+def answer_pipeline(client, question, user_name, num_results=3, search_mode=None, identification_mode=None,
+                    class_id=None):
+    """
+    Retrieval -> identification -> generation, streamed as SSE events:
+
+        sources         retrieved chunks (metadata only, no chunk text)
+        identification  top_k_ids, plus errors for chunks that failed
+        token           answer tokens as they arrive
+        timestamps      video timestamps (same shape as /get_video_timestamp)
+        done            final answer, whether it came from the answer cache,
+                        and per-stage timings in seconds
+
+    Timestamp resolution only needs the identified sentences, so it runs on a
+    worker thread while the answer is being generated.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    search_result = search_files(question, user_name, num_results=num_results, search_mode=search_mode,
+                                 class_id=class_id)
+    timings["retrieval"] = time.perf_counter() - start
+    if search_result["status"] != "success":
+        yield sse_event("error", {"stage": "retrieval", "message": search_result["message"]})
+        return
+    results = search_result["results"]
+    yield sse_event("sources", [{k: v for k, v in result.items() if k != "chunk_text"} for result in results])
+
+    # Checked before identification: a hit skips both LLM stages, and the
+    # identified content it was generated from still drives the timestamps
+    scope = scope_key(user_name.strip().replace(" ", ""), normalize_class_id(class_id))
+    chunk_ids = [result["chunk_url"] for result in results]
+    question_vector, cached_entry = lookup_cached_answer(question, scope, chunk_ids)
+    cached = cached_entry is not None
+
+    stage_start = time.perf_counter()
+    if cached:
+        top_k_ids = cached_entry["top_k_ids"]
+        errors = []
+    else:
+        identified, _ = identify_documents(
+            client, question, [(result["chunk_text"], result["file_type"]) for result in results],
+            mode=identification_mode)
+        top_k_ids = [content if error is None else "" for content, error in identified]
+        errors = [{"index": idx, "message": str(error)} for idx, (_, error) in enumerate(identified) if error]
+    timings["identification"] = time.perf_counter() - stage_start
+    yield sse_event("identification", {"top_k_ids": top_k_ids, "errors": errors})
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def timed_timestamps():
+            stage_start = time.perf_counter()
+            found = find_video_timestamps(
+                [result["chunk_text"] for result in results],
+                [result["file_type"] for result in results],
+                [result["original_file_url"] for result in results],
+                [result["file_name"] for result in results],
+                top_k_ids,
+            )
+            timings["timestamps"] = time.perf_counter() - stage_start
+            return found
+        timestamps_future = executor.submit(contextvars.copy_context().run, timed_timestamps)
+
+        stage_start = time.perf_counter()
+        usage = None
+        if cached:
+            answer = cached_entry["answer"]
+            yield sse_event("token", {"text": answer})
+            timings["time_to_first_token"] = time.perf_counter() - stage_start
+        else:
+            for kind, payload in generate_answer_tokens(client, question, top_k_ids):
+                if kind == "token":
+                    yield sse_event("token", {"text": payload})
+                else:
+                    answer = payload["answer"]
+                    usage = payload["usage"]
+                    timings["time_to_first_token"] = payload["time_to_first_token"]
+            if question_vector is not None:
+                answer_cache.put(scope, chunk_ids, question_vector, {"answer": answer, "top_k_ids": top_k_ids})
+        timings["generation"] = time.perf_counter() - stage_start
+
+        yield sse_event("timestamps", {"timestamp": timestamps_future.result() or 0})
+
+    timings["total"] = time.perf_counter() - start
+    yield sse_event("done", {
+        "answer": answer + "\n\n\n",
+        "usage": usage,
+        "cached": cached,
+        "timings": timings,
+    })
+
+
+@app.route('/answer', methods=['POST'])
+def answer():
+    """
+    Answer a question end to end in one request (replaces calling /search,
+    /run_identification, /run_generation, /postprocess_generation and
+    /get_video_timestamp from the browser). Streams SSE; see answer_pipeline.
+    """
+    data = request.json
+    if not data or 'question' not in data:
+        return jsonify({
+            "status": "error",
+            "message": "Missing required field: question"
+        }), 400
+
+    client = setup_openai_key()
+
+    def generate():
+        try:
+            yield from answer_pipeline(
+                client,
+                data['question'],
+                data.get('user_name', 'UnknownUser'),
+                num_results=data.get('num_results', 3),
+                search_mode=data.get('search_mode'),
+                identification_mode=data.get('identification_mode'),
+                class_id=data.get('class_id'),
+            )
+        except Exception as e:
+            yield sse_event("error", {"message": str(e)})
+
+    return Response(
+        stream_with_context(metrics.stream(generate())),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def warm_up():
+    """
+    Create the process-wide clients (OpenAI, embeddings, Whisper), load the
+    identification tokenizer and open a pooled IRIS connection, so the first
+    requests don't pay for them. Each step is independent; failures are logged.
+    """
+    def open_iris_connection():
+        # Returned to the pool idle, ready for the first query
+        with db_connection():
+            pass
+
+    start = time.perf_counter()
+    steps = (
+        ("OpenAI client", setup_openai_key),
+        ("embeddings client", get_embeddings_model),
+        ("Whisper client", get_whisper_client),
+        ("tokenizer", get_tokenizer),
+        ("IRIS connection", open_iris_connection),
+    )
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up: could not prepare {name}: {e}")
+    elapsed = time.perf_counter() - start
+    metrics.STARTUP_SECONDS.set(elapsed, "warm_up")
+    print(f"Warm-up finished in {elapsed:.2f}s")
+
+
+def start_warm_up():
+    """Warm up in the background, so the process can take requests right away."""
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+metrics.STARTUP_SECONDS.set(time.perf_counter() - _import_started, "import")
+# Workers started by a WSGI server import this module but never run __main__
+if os.getenv("OMNIS_WARM_UP", "0") == "1":
+    start_warm_up()
+
+
 if __name__ == '__main__':
+    start_warm_up()
     app.run(debug=True, host='0.0.0.0', port=5010)
\ No newline at end of file
@@ -1,16 +1,30 @@
 # backend_database.py
 
-import iris
 import time
 import os
+import re
+import hashlib
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from langchain.embeddings.openai import OpenAIEmbeddings
+import vector_index
+import lexical_index
+from metrics import span
+from embedding_cache import query_embedding_cache
+from answer_cache import answer_cache, scope_key
+from vector_codec import VECTOR_TYPE, RESCORE_FACTOR, as_float32, vector_literal
+
+_env_loaded = False
+
 
 def setup_openai_key():
-    """Load environment variables and set up OpenAI API key if not present."""
-    load_dotenv(override=True)
-    if not os.environ.get("OPENAI_API_KEY"):
-        raise ValueError("OpenAI API key not found in environment variables")
+    """Load environment variables (once per process) and check the OpenAI API key is set."""
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv(override=True)
+        if not os.environ.get("OPENAI_API_KEY"):
+            raise ValueError("OpenAI API key not found in environment variables")
+        _env_loaded = True
 
 def setup_database_connection():
     """Setup and return IRIS database connection."""
@@ -20,32 +34,336 @@ def setup_database_connection():
     port = '1972'
     namespace = 'USER'
     connection_string = f"{hostname}:{port}/{namespace}"
+    import iris
     return iris.connect(connection_string, username, password)
 
+class PoolTimeoutError(TimeoutError):
+    """Raised when no connection could be checked out of the pool in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived IRIS connections.
+
+    Connections are opened lazily up to max_size. A connection that has been
+    idle for longer than health_check_after seconds is pinged before it is
+    handed out, and replaced if the ping fails.
+    """
+
+    def __init__(self, connect, max_size=8, checkout_timeout=10.0, health_check_after=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._idle = []  # (connection, last released at)
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._open >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No IRIS connection available after {timeout:.1f}s (pool size {self.max_size})")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._open += 1
+
+        if conn is not None:
+            if time.monotonic() - released_at < self.health_check_after or self._is_healthy(conn):
+                return conn
+            self._close_quietly(conn)
+
+        # Open a new connection outside the lock; give the slot back if it fails
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._close_quietly(conn)
+        with self._cond:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection; roll back on error and drop it if it is broken."""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    lambda: setup_database_connection(),
+                    max_size=int(os.getenv("IRIS_POOL_SIZE", "8")),
+                    checkout_timeout=float(os.getenv("IRIS_POOL_TIMEOUT", "10")),
+                )
+    return _pool
+
+
+class TimedCursor:
+    """Cursor wrapper that records execute/fetch calls as the "iris_query" stage."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        with span("iris_query"):
+            return self._cursor.execute(sql) if params is None else self._cursor.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with span("iris_query"):
+            return self._cursor.executemany(sql, seq_of_params)
+
+    def fetchall(self):
+        with span("iris_query"):
+            return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Connection wrapper whose cursors are TimedCursors."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@contextmanager
+def db_connection(timeout=None):
+    """Context manager yielding a pooled IRIS connection, with its queries timed."""
+    with get_connection_pool().connection(timeout) as conn:
+        yield TimedConnection(conn)
+
+
+# Schemas and tables this process has already created or seen, so the hot path
+# doesn't reissue CREATE ... IF NOT EXISTS on every request.
+_known_schemas = set()
+_known_tables = set()
+_known_lock = threading.Lock()
+
+
+def forget_schema_state(schema_name=None):
+    """Drop cached schema state (all of it, or for one schema) after out-of-band DDL."""
+    with _known_lock:
+        if schema_name is None:
+            _known_schemas.clear()
+            _known_tables.clear()
+        else:
+            _known_schemas.discard(schema_name)
+            _known_tables.difference_update({t for t in _known_tables if t[0] == schema_name})
+
+
 def ensure_schema_exists(cursor, schema_name):
+    if schema_name in _known_schemas:
+        return
     # Attempt to create the schema. IRIS supports CREATE SCHEMA in some versions:
     cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+    with _known_lock:
+        _known_schemas.add(schema_name)
 
 def ensure_table_exists(cursor, user_name):
     safe_user_name = user_name.strip().replace(" ", "")
-    
+    if (safe_user_name, "classes") in _known_tables:
+        return True
+
     # 1) Create the schema (if IRIS allows CREATE SCHEMA)
     ensure_schema_exists(cursor, safe_user_name)
 
-    # 2) Then create the table inside that schema
+    # 2) Then create the tables inside that schema. Chunk rows reference their
+    #    embedding by content hash; each distinct text is embedded and stored once.
     cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS {safe_user_name}.classes (
             chunk_url VARCHAR(1000),
             chunk_text VARCHAR(10000),
-            embedding VECTOR(DOUBLE, 1536),
+            embedding VECTOR({VECTOR_TYPE}, 1536),
             original_file_url VARCHAR(1000),
             file_type VARCHAR(1000),
-            file_name VARCHAR(1000)
+            file_name VARCHAR(1000),
+            content_hash VARCHAR(64),
+            class_id VARCHAR(255)
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {safe_user_name}.vectors (
+            content_hash VARCHAR(64) PRIMARY KEY,
+            embedding VECTOR({VECTOR_TYPE}, 1536),
+            ref_count INTEGER
         )
     """)
+    migrate_legacy_chunks(cursor, safe_user_name)
+    ensure_filter_indexes(cursor, safe_user_name)
+    with _known_lock:
+        _known_tables.add((safe_user_name, "classes"))
     return True
 
 
+def migrate_legacy_chunks(cursor, user_name):
+    """
+    Move embeddings stored inline on older chunk rows into the shared vectors
+    table. Runs once per user per process; a no-op for up-to-date tables.
+    """
+    try:
+        cursor.execute(f"ALTER TABLE {user_name}.classes ADD COLUMN content_hash VARCHAR(64)")
+    except Exception:
+        pass  # column already exists
+
+    cursor.execute(f"""
+        SELECT chunk_url, chunk_text, embedding FROM {user_name}.classes
+         WHERE content_hash IS NULL
+    """)
+    legacy_rows = cursor.fetchall()
+    if not legacy_rows:
+        return
+
+    refs = {}
+    embeddings = {}
+    for chunk_url, chunk_text, embedding in legacy_rows:
+        content_hash = content_fingerprint(chunk_text)
+        refs.setdefault(content_hash, []).append(chunk_url)
+        embeddings.setdefault(content_hash, embedding)
+
+    existing = find_existing_vectors(cursor, user_name, list(refs))
+    cursor.executemany(f"""
+        INSERT INTO {user_name}.vectors (content_hash, embedding, ref_count)
+        VALUES (?, TO_VECTOR(?, {VECTOR_TYPE}), 0)
+    """, [[h, embeddings[h]] for h in refs if h not in existing])
+    cursor.executemany(f"""
+        UPDATE {user_name}.vectors SET ref_count = ref_count + ? WHERE content_hash = ?
+    """, [[len(urls), h] for h, urls in refs.items()])
+    cursor.executemany(f"""
+        UPDATE {user_name}.classes SET content_hash = ?, embedding = NULL WHERE chunk_url = ?
+    """, [[h, url] for h, urls in refs.items() for url in urls])
+    print(f"Moved {len(legacy_rows)} legacy chunks for {user_name} into {len(refs)} shared vectors")
+
+
+def ensure_filter_indexes(cursor, user_name):
+    """
+    Chunks are partitioned by class_id within {user}.classes. Indexing the
+    filter columns lets IRIS read only the matching rows instead of scanning
+    the user's whole library before scoring.
+    """
+    try:
+        cursor.execute(f"ALTER TABLE {user_name}.classes ADD COLUMN class_id VARCHAR(255)")
+    except Exception:
+        pass  # column already exists
+    for index_name, columns in (("ClassIdIdx", "class_id, file_type"), ("FileNameIdx", "file_name")):
+        try:
+            cursor.execute(f"CREATE INDEX {index_name} ON {user_name}.classes ({columns})")
+        except Exception:
+            pass  # index already exists
+
+
+def normalize_class_id(class_id):
+    """
+    Accept a class name as listed by /list_classes, or the "user.class" id
+    returned by /create_class. None means the user's whole library.
+    """
+    if not class_id:
+        return None
+    class_id = class_id.replace(" ", "").split(".")[-1]
+    if not re.fullmatch(r"\w+", class_id):
+        raise ValueError(f"Invalid class_id {class_id!r}")
+    return class_id
+
+
+def ensure_class_table_exists(cursor, user_name, class_name):
+    """Create the {user}.{class} table made by /create_class, once per process."""
+    if (user_name, class_name) in _known_tables:
+        return True
+
+    ensure_schema_exists(cursor, user_name)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {user_name}.{class_name}(
+            chunk_url VARCHAR(1000),
+            chunk_text VARCHAR(10000),
+            embedding VECTOR({VECTOR_TYPE}, 1536),
+            original_file_url VARCHAR(1000)
+        )
+    """)
+    with _known_lock:
+        _known_tables.add((user_name, class_name))
+    return True
+
+
+def user_table_exists(cursor, user_name):
+    """Whether a user's classes table exists, checked without creating anything (for read paths)."""
+    if (user_name, "classes") in _known_tables:
+        return True
+    cursor.execute("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+         WHERE UPPER(TABLE_SCHEMA) = UPPER(?) AND UPPER(TABLE_NAME) = 'CLASSES'
+    """, [user_name])
+    return cursor.fetchone()[0] > 0
+
 
 def check_chunk_exists(cursor, user_name, chunk_url):
     safe_user_name = user_name.strip().replace(" ", "")
@@ -56,71 +374,516 @@ def check_chunk_exists(cursor, user_name, chunk_url):
     return cursor.fetchone()[0] > 0
 
 
-def add_embeddings(chunk_url, chunk_text, original_file_url, user_name, file_type, file_name):
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+_embeddings_model = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings_model():
+    """
+    The process-wide embeddings client, created on first use. langchain is
+    imported here rather than at module load, since it is most of the import time.
+    """
+    global _embeddings_model
+    if _embeddings_model is None:
+        with _embeddings_lock:
+            if _embeddings_model is None:
+                setup_openai_key()
+                from langchain.embeddings.openai import OpenAIEmbeddings
+                _embeddings_model = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    return _embeddings_model
+
+# OpenAI accepts up to 2048 inputs and ~300k tokens per embeddings request.
+# We stay well under both so a single oversized chunk can't fail a whole batch.
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_BATCH_MAX_TOKENS = 250_000
+# Upper bound on bind parameters in a single IN (...) lookup
+EXISTS_LOOKUP_SIZE = 500
+# Writes retried when a concurrent batch inserted one of the same vectors first
+VECTOR_WRITE_ATTEMPTS = 2
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def batch_for_embedding(texts, max_items=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_MAX_TOKENS):
+    """
+    Group texts into batches that respect the embedding API limits.
+    Yields lists of indices into texts.
+    """
+    batch, batch_tokens = [], 0
+    for idx, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(idx)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def find_existing_chunks(cursor, user_name, chunk_urls):
+    """Return the subset of chunk_urls already stored for this user."""
+    safe_user_name = user_name.strip().replace(" ", "")
+    existing = set()
+    for i in range(0, len(chunk_urls), EXISTS_LOOKUP_SIZE):
+        group = chunk_urls[i:i + EXISTS_LOOKUP_SIZE]
+        placeholders = ", ".join("?" for _ in group)
+        cursor.execute(f"""
+            SELECT chunk_url FROM {safe_user_name}.classes
+            WHERE chunk_url IN ({placeholders})
+        """, list(group))
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def content_fingerprint(text):
+    """Hash of the whitespace-normalized chunk text; identical text shares one embedding."""
+    return hashlib.sha256(re.sub(r"\s+", " ", text).strip().encode("utf-8")).hexdigest()
+
+
+def find_existing_vectors(cursor, user_name, content_hashes):
+    """Return the subset of content_hashes that already have a stored embedding."""
+    existing = set()
+    for i in range(0, len(content_hashes), EXISTS_LOOKUP_SIZE):
+        group = content_hashes[i:i + EXISTS_LOOKUP_SIZE]
+        placeholders = ", ".join("?" for _ in group)
+        cursor.execute(f"""
+            SELECT content_hash FROM {user_name}.vectors
+            WHERE content_hash IN ({placeholders})
+        """, list(group))
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def update_class_indexes(user_name, rows, new_vectors):
+    """
+    Add newly stored rows to the per-class indexes that are already built.
+    rows: [(class_id, content_hash, chunk_text)]. A class that received text
+    embedded earlier for another class has its vector index dropped instead
+    (the vector isn't in hand), and the next search rebuilds it. Rows without
+    a class drop every class index of the user instead.
+    """
+    if any(class_id is None for class_id, _, _ in rows):
+        # Library-wide chunks belong in every class index
+        try:
+            vector_index.discard_class_indexes(user_name)
+            lexical_index.discard_class_indexes(user_name)
+        except Exception as e:
+            print(f"Could not drop class indexes for {user_name}: {e}")
+        return
+    by_class = {}
+    for class_id, content_hash, chunk_text in rows:
+        by_class.setdefault(class_id, {})[content_hash] = chunk_text
+    for class_id, texts in by_class.items():
+        try:
+            if all(h in new_vectors for h in texts):
+                vector_index.add_to_user_index(user_name, list(texts), [new_vectors[h] for h in texts], class_id)
+            else:
+                vector_index.discard_user_index(user_name, class_id)
+            lexical_index.add_to_user_index(user_name, list(texts), list(texts.values()), class_id)
+        except Exception as e:
+            print(f"Could not update indexes for {user_name}.{class_id}: {e}")
+
+
+def add_embeddings_batch(chunks, user_name):
+    """
+    Embed and store many chunks at once.
+
+    chunks: list of dicts with chunk_url, chunk_text, original_file_url, file_type, file_name
+            and optionally class_id (the class partition the chunk belongs to)
+    Returns a status for every chunk, in input order:
+        "created"   - embedded and stored
+        "reused"    - stored, sharing the embedding of identical text already stored
+        "exists"    - chunk_url was already stored
+        "duplicate" - chunk_url appeared earlier in this same batch
+        "error"     - embedding or insert failed (see "message")
+    """
+    statuses = [{"chunk_url": chunk["chunk_url"], "status": None} for chunk in chunks]
     try:
         setup_openai_key()
-        conn = setup_database_connection()
-        cursor = conn.cursor()
-
-        table_name = user_name  # Use user's name for the table
-        ensure_table_exists(cursor, table_name)
-
-        if check_chunk_exists(cursor, table_name, chunk_url):
-            return {"status": "success", "message": "Chunk already processed", "already_exists": True}
-
-        embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
-        embedding = embeddings_model.embed_documents([chunk_text])[0]
-
-        sql = f"""
-            INSERT INTO {table_name}.classes
-            (chunk_url, chunk_text, embedding, original_file_url, file_type, file_name)
-            VALUES (?, ?, TO_VECTOR(?), ?, ?, ?)
-        """
-        
-        cursor.execute(sql, [chunk_url, chunk_text, str(embedding), original_file_url, file_type, file_name])
-        conn.commit()
-        
-        return {"status": "success", "message": "New embeddings created and stored", "already_exists": False}
-        
+        table_name = user_name.strip().replace(" ", "")
+        class_ids = [normalize_class_id(chunk.get("class_id")) for chunk in chunks]
+
+        seen = set()
+        pending = []
+        pending_hashes = {}
+        for idx, chunk in enumerate(chunks):
+            if chunk["chunk_url"] not in seen:
+                seen.add(chunk["chunk_url"])
+                pending.append(idx)
+                pending_hashes[idx] = content_fingerprint(chunk["chunk_text"])
+            else:
+                statuses[idx]["status"] = "duplicate"
+
+        # 1) One lookup each for known chunk_urls and known content hashes
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                ensure_table_exists(cursor, table_name)
+                conn.commit()
+                existing = find_existing_chunks(cursor, table_name, [chunks[idx]["chunk_url"] for idx in pending])
+                for idx in pending:
+                    if chunks[idx]["chunk_url"] in existing:
+                        statuses[idx]["status"] = "exists"
+                pending = [idx for idx in pending if statuses[idx]["status"] is None]
+                known_hashes = find_existing_vectors(
+                    cursor, table_name, list({pending_hashes[idx] for idx in pending}))
+            finally:
+                cursor.close()
+
+        # 2) Embed each distinct new text once, in API-sized batches
+        #    (without holding a pooled connection)
+        to_embed = {}
+        for idx in pending:
+            content_hash = pending_hashes[idx]
+            if content_hash not in known_hashes and content_hash not in to_embed:
+                to_embed[content_hash] = chunks[idx]["chunk_text"]
+        embed_hashes = list(to_embed)
+        embed_texts = list(to_embed.values())
+
+        new_vectors = {}
+        failed_hashes = {}
+        embeddings_model = get_embeddings_model()
+        for batch in batch_for_embedding(embed_texts):
+            try:
+                with span("embedding"):
+                    vectors = as_float32(embeddings_model.embed_documents([embed_texts[i] for i in batch]))
+            except Exception as e:
+                for i in batch:
+                    failed_hashes[embed_hashes[i]] = str(e)
+                continue
+            for i, vector in zip(batch, vectors):
+                new_vectors[embed_hashes[i]] = vector
+
+        row_indices = []
+        for idx in pending:
+            content_hash = pending_hashes[idx]
+            if content_hash in failed_hashes:
+                statuses[idx].update(status="error", message=failed_hashes[content_hash])
+            else:
+                row_indices.append(idx)
+
+        # 3) Write vectors, reference counts and chunk rows in one transaction
+        if row_indices:
+            ref_counts = {}
+            for idx in row_indices:
+                ref_counts[pending_hashes[idx]] = ref_counts.get(pending_hashes[idx], 0) + 1
+            # Until the indexes are updated they trail IRIS; searches must not take that as staleness
+            with vector_index.ingesting(table_name):
+                for attempt in range(VECTOR_WRITE_ATTEMPTS):
+                    try:
+                        with db_connection() as conn:
+                            cursor = conn.cursor()
+                            try:
+                                # A concurrent batch may have stored some of these texts since step 1;
+                                # insert only the vectors that are still missing and reference the rest
+                                stored_meanwhile = find_existing_vectors(cursor, table_name, list(new_vectors)) \
+                                    if new_vectors else set()
+                                to_insert = {h: v for h, v in new_vectors.items() if h not in stored_meanwhile}
+                                if to_insert:
+                                    cursor.executemany(f"""
+                                        INSERT INTO {table_name}.vectors (content_hash, embedding, ref_count)
+                                        VALUES (?, TO_VECTOR(?, {VECTOR_TYPE}), 0)
+                                    """, [[h, vector_literal(vector)] for h, vector in to_insert.items()])
+                                cursor.executemany(f"""
+                                    UPDATE {table_name}.vectors SET ref_count = ref_count + ?
+                                     WHERE content_hash = ?
+                                """, [[count, h] for h, count in ref_counts.items()])
+                                cursor.executemany(f"""
+                                    INSERT INTO {table_name}.classes
+                                    (chunk_url, chunk_text, original_file_url, file_type, file_name,
+                                     content_hash, class_id)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                                """, [[chunks[idx]["chunk_url"], chunks[idx]["chunk_text"],
+                                       chunks[idx]["original_file_url"], chunks[idx]["file_type"],
+                                       chunks[idx]["file_name"], pending_hashes[idx], class_ids[idx]]
+                                      for idx in row_indices])
+                                conn.commit()
+                            finally:
+                                cursor.close()
+                        new_vectors = to_insert
+                        break
+                    except Exception as e:
+                        # The transaction was rolled back. If the failure was a concurrent insert of
+                        # the same hash, the next attempt sees that vector and only references it.
+                        if new_vectors and attempt + 1 < VECTOR_WRITE_ATTEMPTS:
+                            continue
+                        for idx in row_indices:
+                            statuses[idx].update(status="error", message=str(e))
+                        row_indices = []
+                        new_vectors = {}
+
+                embedded_here = set()
+                for idx in row_indices:
+                    content_hash = pending_hashes[idx]
+                    if content_hash in new_vectors and content_hash not in embedded_here:
+                        embedded_here.add(content_hash)
+                        statuses[idx]["status"] = "created"
+                    else:
+                        statuses[idx]["status"] = "reused"
+                if new_vectors:
+                    try:
+                        vector_index.add_to_user_index(table_name, list(new_vectors), list(new_vectors.values()))
+                    except Exception as e:
+                        print(f"Could not update vector index for {table_name}: {e}")
+                    try:
+                        lexical_index.add_to_user_index(table_name, list(new_vectors),
+                                                        [to_embed[h] for h in new_vectors])
+                    except Exception as e:
+                        print(f"Could not update lexical index for {table_name}: {e}")
+                update_class_indexes(table_name, [(class_ids[idx], pending_hashes[idx], chunks[idx]["chunk_text"])
+                                                  for idx in row_indices], new_vectors)
+            # Cached answers for the user and the classes that got new material may now be
+            # stale; library-wide material reaches every class
+            stored_classes = {class_ids[idx] for idx in row_indices}
+            for class_id in {None} | stored_classes:
+                answer_cache.invalidate(scope_key(table_name, class_id), include_classes=None in stored_classes)
+
+        counts = {}
+        for status in statuses:
+            counts[status["status"]] = counts.get(status["status"], 0) + 1
+        return {"status": "success", "counts": counts, "results": statuses}
+
     except Exception as e:
         return {"status": "error", "message": str(e)}
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
-def search_files(search_phrase, user_name, num_results=3):
+
+def add_embeddings(chunk_url, chunk_text, original_file_url, user_name, file_type, file_name, class_id=None):
+    result = add_embeddings_batch([{
+        "chunk_url": chunk_url,
+        "chunk_text": chunk_text,
+        "original_file_url": original_file_url,
+        "file_type": file_type,
+        "file_name": file_name,
+        "class_id": class_id,
+    }], user_name)
+    if result["status"] != "success":
+        return result
+
+    chunk_result = result["results"][0]
+    if chunk_result["status"] == "exists":
+        return {"status": "success", "message": "Chunk already processed", "already_exists": True}
+    if chunk_result["status"] == "error":
+        return {"status": "error", "message": chunk_result["message"]}
+    return {"status": "success", "message": "New embeddings created and stored", "already_exists": False}
+
+SEARCH_MODE = os.getenv("OMNIS_SEARCH_MODE", "exact")
+SEARCH_MODES = ("exact", "ann", "hybrid")
+# Hybrid search fuses this many candidates from each ranking, using
+# reciprocal rank fusion: score = sum of weight / (RRF_K + rank)
+HYBRID_CANDIDATES = 50
+RRF_K = 60
+# Which vector search hybrid mode uses for its vector ranking
+HYBRID_VECTOR_MODE = os.getenv("OMNIS_HYBRID_VECTOR_MODE", "exact")
+
+
+# Chunk metadata /search and ingestion can filter on
+FILTER_COLUMNS = ("class_id", "file_type", "file_name")
+# ANN with a file_type/file_name filter fetches this many times more candidates,
+# then falls back to exact search if too few of them match
+ANN_FILTER_OVERFETCH = 10
+
+
+def filter_clause(filters, alias=""):
+    """
+    SQL conditions (joined with AND, no leading keyword) and parameters for the
+    set filters. Chunks without a class (uploaded before classes existed, or
+    outside any class) are library-wide and match every class.
+    """
+    prefix = f"{alias}." if alias else ""
+    columns = [column for column in FILTER_COLUMNS if filters and filters.get(column) is not None]
+    conditions = [f"({prefix}{column} = ? OR {prefix}{column} IS NULL)" if column == "class_id"
+                  else f"{prefix}{column} = ?" for column in columns]
+    return " AND ".join(conditions), [filters[column] for column in columns]
+
+
+def fetch_chunks(cursor, user_name, content_hashes, filters=None):
+    """Fetch stored chunk rows for the given content hashes, grouped by hash."""
+    if not content_hashes:
+        return {}
+    placeholders = ", ".join("?" for _ in content_hashes)
+    conditions, params = filter_clause(filters)
+    cursor.execute(f"""
+        SELECT chunk_url, chunk_text, original_file_url, file_type, file_name, content_hash
+          FROM {user_name}.classes
+         WHERE content_hash IN ({placeholders}){" AND " + conditions if conditions else ""}
+    """, list(content_hashes) + params)
+    rows = {}
+    for row in cursor.fetchall():
+        rows.setdefault(row[-1], []).append(row[:-1])
+    return rows
+
+
+def exact_search(cursor, user_name, search_vector, num_results, filters=None):
+    """Score the user's stored vectors in IRIS, only for chunks that pass the filters."""
+    conditions, params = filter_clause(filters, alias="c")
+    sql = f"""
+        SELECT TOP ? c.chunk_url,
+                     c.chunk_text,
+                     c.original_file_url,
+                     c.file_type,
+                     c.file_name,
+                     VECTOR_DOT_PRODUCT(v.embedding, TO_VECTOR(?, {VECTOR_TYPE})) as similarity_score
+          FROM {user_name}.classes c
+          JOIN {user_name}.vectors v ON v.content_hash = c.content_hash
+         {"WHERE " + conditions if conditions else ""}
+         ORDER BY similarity_score DESC
+    """
+    cursor.execute(sql, [num_results, vector_literal(search_vector)] + params)
+    return cursor.fetchall()
+
+
+def ann_search(cursor, user_name, search_vector, num_results, nprobe=None, filters=None):
+    """
+    Search the IVF index of the user's class (or whole library) and fetch the
+    matching rows from IRIS. Returns None when no index can be used, or too
+    few candidates pass the file filters, so the caller can fall back to exact search.
+    """
+    filters = filters or {}
+    index = vector_index.get_user_index(user_name, cursor, class_id=filters.get("class_id"))
+    if index is None or len(index) == 0:
+        return None
+    narrowed = any(filters.get(column) is not None for column in ("file_type", "file_name"))
+    depth = num_results * ANN_FILTER_OVERFETCH if narrowed else num_results
+    if index.quantized:
+        hits = rescore(cursor, user_name, search_vector,
+                       index.search(search_vector, k=depth * RESCORE_FACTOR, nprobe=nprobe))[:depth]
+    else:
+        hits = index.search(search_vector, k=depth, nprobe=nprobe)
+    rows = fetch_chunks(cursor, user_name, [content_hash for content_hash, _ in hits], filters)
+    results = [row + (score,) for content_hash, score in hits for row in rows.get(content_hash, [])]
+    if narrowed and len(results) < num_results:
+        return None
+    return results[:num_results]
+
+
+def rescore(cursor, user_name, search_vector, hits):
+    """Replace a quantized index's approximate scores with exact ones from IRIS, best first."""
+    if not hits:
+        return []
+    placeholders = ", ".join("?" for _ in hits)
+    cursor.execute(f"""
+        SELECT content_hash, VECTOR_DOT_PRODUCT(embedding, TO_VECTOR(?, {VECTOR_TYPE}))
+          FROM {user_name}.vectors
+         WHERE content_hash IN ({placeholders})
+    """, [vector_literal(search_vector)] + [content_hash for content_hash, _ in hits])
+    scores = {content_hash: float(score) for content_hash, score in cursor.fetchall()}
+    return sorted(((content_hash, scores[content_hash]) for content_hash, _ in hits if content_hash in scores),
+                  key=lambda hit: -hit[1])
+
+
+def vector_search(cursor, user_name, search_vector, num_results, search_mode="exact", nprobe=None, filters=None):
+    """Top matches by embedding similarity, using ANN when asked and available."""
+    results = None
+    if search_mode == "ann":
+        try:
+            results = ann_search(cursor, user_name, search_vector, num_results, nprobe, filters)
+        except Exception as e:
+            print(f"ANN search failed for {user_name}, falling back to exact: {e}")
+    if results is None:
+        results = exact_search(cursor, user_name, search_vector, num_results, filters)
+    return results
+
+
+def hybrid_search(cursor, user_name, search_phrase, search_vector, num_results,
+                  lexical_weight=1.0, vector_weight=1.0, nprobe=None, filters=None):
+    """
+    Fuse the BM25 ranking and the vector ranking with weighted reciprocal rank
+    fusion. Rows are returned with their fused score.
+    """
+    depth = max(HYBRID_CANDIDATES, num_results)
+    fused = {}
+    rows = {}
+
+    if vector_weight > 0:
+        for rank, row in enumerate(vector_search(cursor, user_name, search_vector, depth,
+                                                 HYBRID_VECTOR_MODE, nprobe, filters)):
+            fused[row[0]] = fused.get(row[0], 0.0) + vector_weight / (RRF_K + rank + 1)
+            rows[row[0]] = tuple(row[:5])
+
+    if lexical_weight > 0:
+        index = lexical_index.get_user_index(user_name, cursor, class_id=(filters or {}).get("class_id"))
+        hits = index.search(search_phrase, k=depth) if index is not None else []
+        chunk_rows = fetch_chunks(cursor, user_name, [content_hash for content_hash, _ in hits], filters)
+        # Hits whose rows all fail the file filters drop out, so ranks count only rows that pass
+        hits = [hit for hit in hits if hit[0] in chunk_rows]
+        for rank, (content_hash, _) in enumerate(hits):
+            for row in chunk_rows[content_hash]:
+                fused[row[0]] = fused.get(row[0], 0.0) + lexical_weight / (RRF_K + rank + 1)
+                rows.setdefault(row[0], tuple(row))
+
+    best = sorted(fused, key=lambda chunk_url: -fused[chunk_url])[:num_results]
+    return [rows[chunk_url] + (fused[chunk_url],) for chunk_url in best]
+
+
+def embed_query(text):
+    """Embedding of a question, served from the query embedding cache when possible."""
+    def compute():
+        with span("embedding"):
+            return get_embeddings_model().embed_query(text)
+
+    return query_embedding_cache.get_or_compute(EMBEDDING_MODEL, text, compute)
+
+
+def search_files(search_phrase, user_name, num_results=3, search_mode=None, nprobe=None,
+                 lexical_weight=1.0, vector_weight=1.0, class_id=None, file_type=None, file_name=None):
     """
     Search across the user's {user_name}_underscored.classes table,
     retrieving the top K most similar chunks.
+
+    search_mode: "exact" scans every row in IRIS; "ann" uses the user's IVF
+    index (nprobe trades recall for latency) and falls back to exact search
+    if the index is unavailable; "hybrid" fuses a BM25 keyword ranking with the
+    vector ranking, weighted by lexical_weight and vector_weight.
+
+    class_id, file_type, file_name restrict the search to matching chunks
+    before anything is scored. A class_id search uses that class's own
+    indexes, so its cost follows the size of the class, not of the library.
+    Chunks without a class are library-wide and found by every class search.
     """
     try:
-        # 1) Setup keys + DB
+        # 1) Setup keys
         setup_openai_key()
-        conn = setup_database_connection()
-        cursor = conn.cursor()
 
         safe_user_name = user_name.strip().replace(" ", "")
 
-        # 3) Embed the query
-        embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
-        search_vector = embeddings_model.embed_query(search_phrase)
+        search_mode = search_mode or SEARCH_MODE
+        if search_mode not in SEARCH_MODES:
+            return {"status": "error", "message": f"Unknown search mode {search_mode!r}"}
+        filters = {"class_id": normalize_class_id(class_id), "file_type": file_type or None,
+                   "file_name": file_name or None}
+
+        # 3) Embed the query (not needed for keyword-only hybrid search)
+        # Repeated questions are served from the cache and skip the OpenAI round trip
+        search_vector = None
+        if search_mode != "hybrid" or vector_weight > 0:
+            search_vector = embed_query(search_phrase)
 
         # 4) Perform a top-K search in that user’s classes table only
-        sql = f"""
-            SELECT TOP ? chunk_url,
-                         chunk_text,
-                         original_file_url,
-                         file_type,
-                         file_name,
-                         VECTOR_DOT_PRODUCT(embedding, TO_VECTOR(?)) as similarity_score
-              FROM {safe_user_name}.classes
-             ORDER BY VECTOR_DOT_PRODUCT(embedding, TO_VECTOR(?)) DESC
-        """
-
-        cursor.execute(sql, [num_results, str(search_vector), str(search_vector)])
-        results = cursor.fetchall()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # A user with no library has nothing to find; don't create tables for them.
+                # Existing tables from before the shared vectors table are migrated on first
+                # use, not only on upload (cached, so a no-op after the first call)
+                if not user_table_exists(cursor, safe_user_name):
+                    results = []
+                else:
+                    ensure_table_exists(cursor, safe_user_name)
+                    conn.commit()
+                    if search_mode == "hybrid":
+                        results = hybrid_search(cursor, safe_user_name, search_phrase, search_vector, num_results,
+                                                lexical_weight, vector_weight, nprobe, filters)
+                    else:
+                        results = vector_search(cursor, safe_user_name, search_vector, num_results, search_mode,
+                                                nprobe, filters)
+            finally:
+                cursor.close()
 
         # 5) Format results
         formatted_results = []
@@ -139,9 +902,3 @@ def search_files(search_phrase, user_name, num_results=3):
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
-
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
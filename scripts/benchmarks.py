@@ -0,0 +1,961 @@
+# benchmarks.py
+#
+# Offline micro-benchmarks. Nothing here talks to OpenAI or IRIS: the network
+# services are replaced by local stand-ins that sleep for a configurable
+# round-trip time, so the numbers show how many round trips each code path makes.
+#
+# Usage: python benchmarks.py <name> [<name> ...]    (no name = run everything)
+
+import os
+import sys
+import time
+import hashlib
+from unittest import mock
+
+
+# ---------------------------------------------------------------------------
+# Local stand-ins
+# ---------------------------------------------------------------------------
+
+EMBEDDING_DIM = 1536
+
+
+def fake_vector(text, dim=EMBEDDING_DIM):
+    """Deterministic pseudo-embedding derived from the text hash."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [((seed[i % len(seed)] + i) % 255) / 255.0 for i in range(dim)]
+
+
+class FakeEmbedder:
+    """Mimics OpenAIEmbeddings: fixed latency per request plus a small per-input cost."""
+
+    request_latency = 0.150
+    per_input_latency = 0.002
+
+    def __init__(self, model=None, **kwargs):
+        self.model = model
+
+    def embed_documents(self, texts):
+        time.sleep(self.request_latency + self.per_input_latency * len(texts))
+        return [fake_vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeCursor:
+    """Mimics an IRIS DB-API cursor: every execute is one network round trip."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        time.sleep(self.conn.round_trip)
+        self.conn.executes += 1
+        if sql.lstrip().upper().startswith("SELECT COUNT"):
+            self._rows = [(0,)]
+        else:
+            self._rows = []
+
+    def executemany(self, sql, rows):
+        time.sleep(self.conn.round_trip + self.conn.per_row * len(rows))
+        self.conn.executes += 1
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    connect_latency = 0.020
+
+    def __init__(self, round_trip=0.002, per_row=0.0002):
+        time.sleep(self.connect_latency)
+        self.round_trip = round_trip
+        self.per_row = per_row
+        self.executes = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        time.sleep(self.round_trip)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeChatClient:
+    """
+    Mimics openai.OpenAI().chat.completions: the first token arrives after
+    `latency` seconds, then one token every `token_interval` seconds.
+    """
+
+    def __init__(self, latency=0.8, token_interval=0.01, num_tokens=200):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.num_tokens = num_tokens
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, timeout=None, stream=False, **kwargs):
+        content = messages[-1]["content"][-200:]
+        if stream:
+            return FakeStream(self, content)
+        time.sleep(self.latency + self.token_interval * self.num_tokens)
+        message = mock.Mock(content=content)
+        return mock.Mock(choices=[mock.Mock(message=message)])
+
+
+class FakeTokenizer:
+    """Stands in for tiktoken (which downloads its vocabulary): one token per word."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class FakeStream:
+    def __init__(self, client, content):
+        self.client = client
+        self.content = content
+        self.closed = False
+
+    def __iter__(self):
+        time.sleep(self.client.latency)
+        for i in range(self.client.num_tokens):
+            if self.closed:
+                return
+            delta = mock.Mock(content=f"tok{i} ")
+            yield mock.Mock(choices=[mock.Mock(delta=delta)], usage=None)
+            time.sleep(self.client.token_interval)
+        usage = mock.Mock(prompt_tokens=len(self.content) // 4, completion_tokens=self.client.num_tokens,
+                          total_tokens=len(self.content) // 4 + self.client.num_tokens)
+        yield mock.Mock(choices=[], usage=usage)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWhisperClient:
+    """Mimics openai.OpenAI().audio.transcriptions with a fixed latency per call."""
+
+    latency = 0.3
+
+    def __init__(self, **kwargs):
+        self.audio = self
+        self.transcriptions = self
+
+    def create(self, model, file, **kwargs):
+        time.sleep(self.latency)
+        return mock.Mock(text=f"text for {file[0]}")
+
+
+def fake_transcribe_in_process(args):
+    """The old per-process path: a fresh client for every segment."""
+    chunk_index, chunk_start, chunk_end, chunk_audio = args
+    transcription = FakeWhisperClient().create(model="whisper-1", file=(f"chunk_{chunk_index}.mp3", chunk_audio))
+    return chunk_index, chunk_start, chunk_end, transcription.text
+
+
+def make_chunks(n, words_per_chunk=1000):
+    return [{
+        "chunk_url": f"chunks/{i}.txt",
+        "chunk_text": " ".join(f"word{(i * 7 + j) % 5000}" for j in range(words_per_chunk)),
+        "original_file_url": "documents/coursepack.pdf",
+        "file_type": "text",
+        "file_name": "coursepack",
+    } for i in range(n)]
+
+
+def synthetic_pdf(path, num_pages=200, words_per_page=400, seed=0):
+    """Write a plain-text PDF (one Helvetica text block per page) without any PDF library."""
+    import random
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for _ in range(num_pages):
+        lines = [" ".join(rng.choice(vocabulary) for _ in range(10)) for _ in range(words_per_page // 10)]
+        stream = ("BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), num_pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as file:
+        file.write(out)
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_ingestion(num_chunks=100):
+    """Per-chunk /add_embedding vs. /add_embeddings_batch."""
+    import backend_database
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    chunks = make_chunks(num_chunks)
+
+    with mock.patch.object(backend_database, "_embeddings_model", FakeEmbedder()), \
+         mock.patch.object(backend_database, "setup_database_connection", FakeConnection), \
+         mock.patch.object(backend_database, "load_dotenv", lambda **kwargs: None):
+        start = time.perf_counter()
+        for chunk in chunks:
+            backend_database.add_embeddings(user_name="bench", **chunk)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = backend_database.add_embeddings_batch(chunks, user_name="bench")
+        batch = time.perf_counter() - start
+
+    assert result["counts"] == {"created": num_chunks}, result.get("counts")
+    print(f"ingestion ({num_chunks} chunks)")
+    print(f"  per-chunk : {single:7.2f}s  {num_chunks / single:8.1f} chunks/s")
+    print(f"  batch     : {batch:7.2f}s  {num_chunks / batch:8.1f} chunks/s  ({single / batch:.1f}x)")
+
+
+def bench_connections(num_requests=200):
+    """Connect + DDL on every request vs. pooled connections and the schema registry."""
+    import backend_database
+
+    def unpooled():
+        conn = FakeConnection()
+        cursor = conn.cursor()
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS bench")
+        cursor.execute("CREATE TABLE IF NOT EXISTS bench.classes (...)")
+        cursor.execute("SELECT TOP 3 ...")
+        cursor.close()
+        conn.close()
+
+    def pooled():
+        with backend_database.db_connection() as conn:
+            cursor = conn.cursor()
+            backend_database.ensure_table_exists(cursor, "bench")
+            cursor.execute("SELECT TOP 3 ...")
+            cursor.close()
+
+    with mock.patch.object(backend_database, "setup_database_connection", FakeConnection):
+        backend_database.forget_schema_state()
+        print(f"connections ({num_requests} requests)")
+        for name, fn in (("connect per request", unpooled), ("pooled", pooled)):
+            latencies = []
+            for _ in range(num_requests):
+                start = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f"  {name:20s} p50 {latencies[len(latencies) // 2] * 1000:6.2f}ms"
+                  f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f}ms")
+        backend_database.get_connection_pool().close_all()
+
+
+def synthetic_embeddings(n, dim=EMBEDDING_DIM, clusters=200, seed=0):
+    """Unit vectors drawn around random topic centres, like a real course corpus."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_ann(num_vectors=20000, num_queries=200, k=10):
+    """Recall@k and latency of the IVF index at different nprobe settings."""
+    import numpy as np
+    import vector_index
+
+    vectors = synthetic_embeddings(num_vectors + num_queries)
+    corpus, queries = vectors[:num_vectors], vectors[num_vectors:]
+    index = vector_index.IVFIndex()
+    start = time.perf_counter()
+    index.add([str(i) for i in range(num_vectors)], corpus)
+    print(f"ann ({num_vectors} x {EMBEDDING_DIM}d, {len(index.centroids)} lists, "
+          f"built in {time.perf_counter() - start:.1f}s), recall@{k}")
+
+    truth = [set(str(i) for i in np.argsort(-(corpus @ q))[:k]) for q in queries]
+    for nprobe in (1, 2, 4, 8, 16, 32, len(index.centroids)):
+        start = time.perf_counter()
+        hits = [index.search(q, k=k, nprobe=nprobe) for q in queries]
+        elapsed = (time.perf_counter() - start) / num_queries
+        recall = np.mean([len(truth_ids & {hit_id for hit_id, _ in hit}) / k
+                          for truth_ids, hit in zip(truth, hits)])
+        label = "exact" if nprobe == len(index.centroids) else f"nprobe={nprobe}"
+        print(f"  {label:12s} recall {recall:5.3f}  {elapsed * 1000:7.3f}ms/query")
+
+
+def bench_class_search(num_classes=10, vectors_per_class=2500, num_queries=100, k=10):
+    """
+    One class's questions against the whole library vs. against that class's
+    own partition: latency, and how many of the top-k come from the right class.
+    """
+    import numpy as np
+    import vector_index
+
+    n = num_classes * vectors_per_class
+    vectors = synthetic_embeddings(n + num_queries)
+    corpus, queries = vectors[:n], vectors[n:]
+    classes = np.arange(n) % num_classes
+    library = vector_index.IVFIndex()
+    library.add([str(i) for i in range(n)], corpus)
+    partition = vector_index.IVFIndex()
+    members = np.flatnonzero(classes == 0)
+    partition.add([str(i) for i in members], corpus[members])
+
+    print(f"class search ({num_classes} classes x {vectors_per_class} vectors, top-{k} for class 0)")
+    for label, index, nprobe in (("library, exact ", library, len(library.centroids)),
+                                 ("library, ANN   ", library, None),
+                                 ("partition, ANN ", partition, None)):
+        start = time.perf_counter()
+        hits = [index.search(q, k=k, nprobe=nprobe) for q in queries]
+        elapsed = (time.perf_counter() - start) / num_queries
+        in_class = np.mean([np.mean([classes[int(hit_id)] == 0 for hit_id, _ in hit]) for hit in hits])
+        print(f"  {label} : {elapsed * 1000:7.3f}ms/query  {in_class * 100:5.1f}% of results from the class")
+
+
+def bench_vector_storage(num_vectors=20000, num_queries=100, k=10):
+    """
+    Vector serialization (str(list) vs. vector_literal) and, per index
+    quantization, bytes per vector, latency and recall@k after rescoring.
+    """
+    import numpy as np
+    import vector_index
+    from vector_codec import RESCORE_FACTOR, vector_literal
+
+    vectors = synthetic_embeddings(num_vectors + num_queries)
+    corpus, queries = vectors[:num_vectors], vectors[num_vectors:]
+    as_list = corpus[0].astype(np.float64).tolist()
+    repeats = 500
+    start = time.perf_counter()
+    for _ in range(repeats):
+        text = str(as_list)
+    old = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        literal = vector_literal(corpus[0])
+    new = (time.perf_counter() - start) / repeats
+    print(f"vector storage ({num_vectors} x {EMBEDDING_DIM}d)")
+    print(f"  str(list)      : {old * 1000:6.3f}ms  {len(text):6d} chars")
+    print(f"  vector_literal : {new * 1000:6.3f}ms  {len(literal):6d} chars")
+    print(f"  IRIS column    : DOUBLE {EMBEDDING_DIM * 8} bytes, FLOAT {EMBEDDING_DIM * 4} bytes per vector")
+
+    truth = [set(np.argsort(-(corpus @ q))[:k]) for q in queries]
+    for quantization in ("none", "int8", "binary"):
+        index = vector_index.IVFIndex(quantization=quantization)
+        index.add(list(range(num_vectors)), corpus)
+        depth = k * RESCORE_FACTOR if index.quantized else k
+        start = time.perf_counter()
+        hits = [index.search(q, k=depth) for q in queries]
+        elapsed = (time.perf_counter() - start) / num_queries
+        # Rescoring (done by IRIS in ann_search) with the exact vectors
+        found = [sorted((row for row, _ in hit), key=lambda row: -(corpus[row] @ q))[:k] for hit, q in zip(hits, queries)]
+        recall = np.mean([len(t & set(f)) / k for t, f in zip(truth, found)])
+        print(f"  index {quantization:6s} : {index.nbytes / num_vectors:6.0f} bytes/vector  "
+              f"{elapsed * 1000:6.3f}ms/query  recall@{k} {recall:5.3f}")
+
+
+def bench_lexical(num_chunks=100000, words_per_chunk=150, num_queries=200):
+    """BM25 index build time and per-query latency at lecture-library scale."""
+    import numpy as np
+    from lexical_index import BM25Index
+
+    rng = np.random.default_rng(0)
+    # Zipf-distributed vocabulary, so common words have very long postings lists
+    vocabulary = np.array([f"w{i}" for i in range(50000)])
+    ranks = np.minimum(rng.zipf(1.2, size=(num_chunks, words_per_chunk)), len(vocabulary)) - 1
+    texts = [" ".join(vocabulary[row]) for row in ranks]
+
+    index = BM25Index()
+    start = time.perf_counter()
+    index.add([str(i) for i in range(num_chunks)], texts)
+    build = time.perf_counter() - start
+
+    query_ranks = np.minimum(rng.zipf(1.2, size=(num_queries, 4)), len(vocabulary)) - 1
+    latencies = []
+    for row in query_ranks:
+        start = time.perf_counter()
+        index.search(" ".join(vocabulary[row]), k=50)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"lexical ({num_chunks} chunks x {words_per_chunk} words, built in {build:.1f}s)")
+    print(f"  search top-50: p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f} ms")
+
+
+def bench_identification(top_k=5):
+    """Serial vs. concurrent per-chunk identification calls."""
+    import identification
+    from concurrency import bounded_map
+
+    client = FakeChatClient()
+    chunks = [(chunk["chunk_text"], "text") for chunk in make_chunks(top_k, words_per_chunk=200)]
+
+    with mock.patch.object(identification, "_tokenizer", FakeTokenizer()):
+        start = time.perf_counter()
+        for chunk_text, chunk_type in chunks:
+            identification.identify_chunk(client, "What is a cartoon deck?", chunk_text, chunk_type)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bounded_map(lambda item: identification.identify_chunk(client, "What is a cartoon deck?", *item), chunks,
+                    max_workers=top_k)
+        concurrent = time.perf_counter() - start
+
+    print(f"identification (top {top_k}, {client.latency + client.token_interval * client.num_tokens:.1f}s per call)")
+    print(f"  serial     : {serial:5.2f}s")
+    print(f"  concurrent : {concurrent:5.2f}s")
+
+
+def bench_long_context_identification(hours=3):
+    """
+    Identification on one long transcript with the answer near the end: the old
+    first-16k-words slice vs. map-reduce over relevance-selected sub-chunks.
+    """
+    import identification
+    from identification_generation import chunk_str
+    from transcript_format import load_transcript
+
+    question = "What does the blue elephant symbolise?"
+    answer = "The blue elephant symbolises memory."
+    lines = synthetic_transcript(hours).split("\n")
+    lines[int(len(lines) * 0.9)] += " " + answer
+    transcript = "\n".join(lines)
+
+    client = FakeChatClient()
+    with mock.patch.object(identification, "_tokenizer", FakeTokenizer()):
+        plain = load_transcript(transcript).plain_text()
+        first_slice = chunk_str(plain)[0]
+        start = time.perf_counter()
+        identification.extract_sentences(client, question, first_slice)
+        old_time = time.perf_counter() - start
+
+        sent = []
+        original = identification.extract_sentences
+
+        def recording(client, question, context, timeout=None):
+            sent.append(context)
+            return original(client, question, context, timeout)
+
+        with mock.patch.object(identification, "extract_sentences", recording):
+            start = time.perf_counter()
+            _, stats = identification.identify_documents(client, question, [(transcript, "video")])
+            new_time = time.perf_counter() - start
+
+    print(f"long-context identification ({hours} h transcript, {len(plain.split())} words)")
+    print(f"  first slice : 1 call  {len(first_slice.split()):6d} words sent  "
+          f"answer sent: {answer in first_slice!s:5s}  {old_time:5.2f}s")
+    print(f"  map-reduce  : {stats['subchunks_sent']} calls {stats['context_tokens']:6d} words sent  "
+          f"answer sent: {any(answer in context for context in sent)!s:5s}  {new_time:5.2f}s")
+
+
+def identification_quality_cases(num_cases=20, sentences_per_chunk=150, seed=0):
+    """
+    Synthetic (question, chunk_text, chunk_type, reference) cases: filler
+    sentences with one planted answer, where the reference is what a perfect
+    extractor would return. Recorded cases can be supplied instead as JSON lines
+    with the same keys (reference = the LLM's top_k_ids entry) via
+    OMNIS_ID_QUALITY_CASES.
+    """
+    import json
+    import random
+
+    path = os.getenv("OMNIS_ID_QUALITY_CASES")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(3000)]
+    cases = []
+    for case in range(num_cases):
+        subject, verb, obj = rng.sample(vocabulary, 3)
+        sentences = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 20))).capitalize() + "."
+                     for _ in range(sentences_per_chunk)]
+        reference = f"The {subject} {verb} the {obj} during the lecture."
+        sentences.insert(rng.randrange(len(sentences)), reference)
+        cases.append({
+            "question": f"What does the {subject} {verb}?",
+            "chunk_text": " ".join(sentences),
+            "chunk_type": "text",
+            "reference": reference,
+        })
+    return cases
+
+
+def token_f1(predicted, reference):
+    from collections import Counter
+    from identification import words
+
+    predicted, reference = Counter(words(predicted)), Counter(words(reference))
+    overlap = sum((predicted & reference).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(predicted.values())
+    recall = overlap / sum(reference.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def bench_identification_quality():
+    """Local extractive identification vs. the LLM path: latency and agreement with the reference."""
+    import identification
+
+    cases = identification_quality_cases()
+    client = FakeChatClient()
+    print(f"identification quality ({len(cases)} cases)")
+    with mock.patch.object(identification, "_tokenizer", FakeTokenizer()):
+        for mode in ("local", "auto", "llm"):
+            f1s, contains, latencies, local = [], 0, [], 0
+            for case in cases:
+                start = time.perf_counter()
+                [(output, error)], stats = identification.identify_documents(
+                    client, case["question"], [(case["chunk_text"], case["chunk_type"])], mode=mode)
+                latencies.append(time.perf_counter() - start)
+                output = output or ""
+                local += stats["answered_locally"]
+                # The stand-in model just echoes its prompt, so only time the llm path
+                if mode != "llm":
+                    f1s.append(token_f1(output, case["reference"]))
+                    contains += case["reference"] in output
+            latencies.sort()
+            quality = (f"F1 {sum(f1s) / len(f1s):.2f}  reference found {contains}/{len(cases)}"
+                       if f1s else "(latency only)")
+            print(f"  {mode:5s}: p50 {latencies[len(latencies) // 2] * 1000:8.2f} ms  "
+                  f"{local}/{len(cases)} answered locally  {quality}")
+
+
+def bench_generation():
+    """Time to first byte of /run_generation vs. /run_generation_stream."""
+    import app
+    from answer_cache import AnswerCache
+
+    client = FakeChatClient()
+    body = {"question": "What is a cartoon deck?", "top_k_ids": ["Bob is a magician."]}
+    with mock.patch.object(app, "setup_openai_key", lambda: client), \
+         mock.patch.object(app, "embed_query", fake_vector), \
+         mock.patch.object(app, "answer_cache", AnswerCache(max_entries=0)):
+        test_client = app.app.test_client()
+
+        start = time.perf_counter()
+        test_client.post("/run_generation", json=body).get_json()
+        blocking = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = test_client.post("/run_generation_stream", json=body, buffered=False)
+        stream = response.response
+        first_event = next(iter(stream))
+        first_token = time.perf_counter() - start
+        for _ in stream:
+            pass
+        streamed_total = time.perf_counter() - start
+        response.close()
+
+    assert first_event.startswith(b"event: token"), first_event
+    print("generation (first token after 0.8s, 200 tokens)")
+    print(f"  /run_generation        first byte {blocking:5.2f}s")
+    print(f"  /run_generation_stream first byte {first_token:5.2f}s  (complete {streamed_total:5.2f}s)")
+
+
+def bag_of_words_vector(text, dim=256):
+    """Pseudo-embedding in which rephrasings that share most words stay close."""
+    import numpy as np
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().replace("?", "").split():
+        vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % dim] += 1
+    return vector
+
+
+def bench_answer_cache():
+    """
+    /run_generation latency for cache misses vs. hits, and invalidation on
+    upload. Questions are embedded as bags of words, which rate rephrasings
+    less similar than a real embedding model does, so the threshold is lower.
+    """
+    import app
+    import backend_database
+    from answer_cache import AnswerCache
+
+    client = FakeChatClient(latency=0.3, num_tokens=50)
+    questions = ["What is a cartoon deck?", "How does backpropagation work?", "What is the chain rule?",
+                 "Why do we normalize embeddings?", "What is a residual connection?"]
+    rephrased = ["what is a cartoon deck", "How does backpropagation work exactly?", "What's the chain rule?",
+                 "Why do we normalize the embeddings?", "What is a residual connection in a network?"]
+    context = ["Bob is a magician.", "He uses a cartoon deck."]
+
+    def ask(question, chunk_urls):
+        start = time.perf_counter()
+        response = test_client.post("/run_generation", json={
+            "question": question, "top_k_ids": context, "user_name": "bench", "class_id": "CS224N",
+            "chunk_urls": chunk_urls}).get_json()
+        return time.perf_counter() - start, response["cached"]
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    cache = AnswerCache(threshold=0.85)
+    with mock.patch.object(app, "setup_openai_key", lambda: client), \
+         mock.patch.object(app, "embed_query", bag_of_words_vector), \
+         mock.patch.object(app, "answer_cache", cache), \
+         mock.patch.object(backend_database, "answer_cache", cache), \
+         mock.patch.object(backend_database, "_embeddings_model", FakeEmbedder()), \
+         mock.patch.object(backend_database, "setup_database_connection", FakeConnection), \
+         mock.patch.object(backend_database, "load_dotenv", lambda **kwargs: None):
+        test_client = app.app.test_client()
+        rounds = {
+            "first ask        ": [ask(q, ["a", "b"]) for q in questions],
+            "same question    ": [ask(q, ["b", "a"]) for q in questions],
+            "rephrased        ": [ask(q, ["a", "b"]) for q in rephrased],
+            "other chunks     ": [ask(q, ["a", "c"]) for q in questions[:2]],
+        }
+        chunk = dict(make_chunks(1)[0], class_id="CS224N")
+        backend_database.add_embeddings_batch([chunk], user_name="bench")
+        rounds["after an upload  "] = [ask(q, ["a", "b"]) for q in questions[:2]]
+
+    print(f"answer cache (threshold {cache.threshold})")
+    for label, results in rounds.items():
+        hits = sum(cached for _, cached in results)
+        latency = sum(elapsed for elapsed, _ in results) / len(results)
+        print(f"  {label}: {hits}/{len(results)} hits  {latency * 1000:8.1f}ms/request")
+    print(f"  stats: {cache.stats()}")
+
+
+def bench_transcription(num_segments=100):
+    """Process pool (cpu_count - 1 workers) vs. the threaded transcription scheduler."""
+    import multiprocessing as mp
+    import resource
+    import video_to_transcript
+
+    segments = [(i, i * 6000, (i + 1) * 6000, bytes(24000)) for i in range(num_segments)]
+
+    start = time.perf_counter()
+    num_processes = max(1, mp.cpu_count() - 1)
+    with mp.Pool(num_processes) as pool:
+        list(pool.imap(fake_transcribe_in_process, segments))
+    pool_time = time.perf_counter() - start
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    handler = video_to_transcript.AudioHandler("unused.mp4")
+    with mock.patch.object(video_to_transcript, "_client", FakeWhisperClient()):
+        start = time.perf_counter()
+        results = handler._transcribe_segments(iter(segments))
+        thread_time = time.perf_counter() - start
+
+    assert len(results) == num_segments
+    print(f"transcription ({num_segments} segments, {FakeWhisperClient.latency:.1f}s per call)")
+    print(f"  process pool : {pool_time:6.2f}s  {num_segments / pool_time:6.1f} segments/s"
+          f"  ({num_processes} extra processes, ~{child_rss:.0f} MB RSS each)")
+    print(f"  threads      : {thread_time:6.2f}s  {num_segments / thread_time:6.1f} segments/s"
+          f"  ({handler.max_in_flight} in flight, no extra processes)")
+
+
+def synthetic_lecture_pcm(minutes=60, seed=0):
+    """
+    16 kHz mono PCM blocks that sound (to a level detector) like a lecture:
+    2-10 s utterances separated by short pauses, with an occasional long break.
+    """
+    import numpy as np
+    import video_to_transcript
+
+    rng = np.random.default_rng(seed)
+    rate = video_to_transcript.SAMPLE_RATE
+    total = minutes * 60 * rate
+    produced = 0
+    while produced < total:
+        speech = (rng.standard_normal(int(rng.uniform(2, 10) * rate)) * 3000).astype(np.int16)
+        pause_s = rng.uniform(5, 20) if rng.random() < 0.03 else rng.uniform(0.15, 1.2)
+        pause = (rng.standard_normal(int(pause_s * rate)) * 20).astype(np.int16)
+        for part in (speech, pause):
+            yield part.tobytes()
+            produced += len(part)
+
+
+def bench_segmentation(minutes=60):
+    """Whisper calls per hour of lecture: fixed 6 s chunks vs. silence-aware segments."""
+    import video_to_transcript
+
+    print(f"segmentation ({minutes} min synthetic lecture)")
+    for name, segmenter in (("fixed 6s", video_to_transcript.fixed_segments),
+                            ("silence", video_to_transcript.silence_segments)):
+        start = time.perf_counter()
+        segments = [(start_ms, end_ms) for start_ms, end_ms, _ in segmenter(synthetic_lecture_pcm(minutes))]
+        elapsed = time.perf_counter() - start
+        audio_ms = sum(end_ms - start_ms for start_ms, end_ms in segments)
+        print(f"  {name:9s} {len(segments):5d} calls  {audio_ms / 60000:5.1f} min sent  "
+              f"longest {max(end - begin for begin, end in segments) / 1000:4.1f}s  ({elapsed:.2f}s to segment)")
+
+
+def synthetic_transcript(hours=3.0, segment_s=6, seed=0):
+    """A timestamped transcript in the AudioHandler output format, one line per segment."""
+    import random
+    from transcript_format import format_timestamp
+
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    lines = []
+    for start in range(0, int(hours * 3600), segment_s):
+        text = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(10, 20)))
+        lines.append(f"{format_timestamp(start * 1000)} - {format_timestamp((start + segment_s) * 1000)}: {text}")
+    return "\n".join(lines)
+
+
+def bench_timestamps(hours=3, num_queries=50):
+    """Answer -> timestamp lookup: re-parse and scan per request vs. a prebuilt inverted index."""
+    import random
+    import identification_generation
+    from transcript_index import TranscriptIndex
+
+    transcript = synthetic_transcript(hours)
+    lines = transcript.split("\n")
+    rng = random.Random(1)
+    # Identified answers are sentences lifted from the transcript
+    queries = [lines[rng.randrange(len(lines))].split(": ", 1)[1] for _ in range(num_queries)]
+
+    start = time.perf_counter()
+    for query in queries:
+        parsed_text = identification_generation.parse_text_from_timestamps(transcript)
+        timestamps = identification_generation.parse_timestamps(parsed_text)
+        chunks = dict(zip([chunk["text"] for chunk in parsed_text], timestamps))
+        identification_generation.get_timestamp_from_answer(query, chunks)
+    scan_time = (time.perf_counter() - start) / num_queries
+
+    start = time.perf_counter()
+    index = TranscriptIndex.from_transcript(transcript)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        index.best_timestamp(query)
+    lookup_time = (time.perf_counter() - start) / num_queries
+
+    start = time.perf_counter()
+    for query in queries:
+        index.top_k(query, 5)
+    top_k_time = (time.perf_counter() - start) / num_queries
+
+    print(f"timestamps ({hours} h transcript, {len(index)} segments, {num_queries} queries)")
+    print(f"  parse + scan per request : {scan_time * 1000:8.2f} ms/query")
+    print(f"  index build (once)       : {build_time * 1000:8.2f} ms")
+    print(f"  indexed best match       : {lookup_time * 1000:8.3f} ms/query  ({scan_time / lookup_time:.0f}x)")
+    print(f"  indexed top-5            : {top_k_time * 1000:8.3f} ms/query")
+
+
+def bench_transcript_parsing(minutes=99, segment_s=2, repeats=5):
+    """Legacy transcript string -> segments: the old regexes vs. the single-pass parser."""
+    import re
+    from transcript_format import parse_legacy, Transcript
+
+    # The old parsers only understand two-digit minutes, so stay under 100 minutes
+    transcript = synthetic_transcript(minutes / 60, segment_s)
+    lazy_lookahead = r'(\d{2}:\d{2}\s*-\s*\d{2}:\d{2}):\s*(.*?)\s*(?=\d{2}:\d{2}\s*-\s*\d{2}:\d{2}:|$)'
+
+    def old_lookahead():
+        return re.findall(lazy_lookahead, transcript, flags=re.DOTALL)
+
+    def old_original():
+        return re.sub(r'\d{2}:\d{2} - \d{2}:\d{2}: ', '', transcript).strip().split(": ")
+
+    def single_pass():
+        return parse_legacy(transcript)
+
+    as_json = parse_legacy(transcript).to_json()
+
+    def from_json():
+        return Transcript.from_json(as_json)
+
+    size_mb = len(transcript.encode("utf-8")) / 1e6
+    print(f"transcript parsing ({minutes} min, {len(transcript.splitlines())} segments, {size_mb:.2f} MB)")
+    for name, parse in (("lazy-lookahead regex", old_lookahead), ("substitute + split", old_original),
+                        ("single-pass parser", single_pass), ("structured JSON load", from_json)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            parse()
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {name:21s}: {elapsed * 1000:8.2f} ms  {size_mb / elapsed:7.1f} MB/s")
+    print(f"  structured JSON is {len(as_json) / len(transcript):.2f}x the size of the legacy string")
+
+
+def bench_metrics(calls=100000, endpoints=20):
+    """Cost of instrumentation: one span() outside and inside a request, and rendering /metrics."""
+    import metrics
+
+    def per_call(fn):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        return (time.perf_counter() - start) / calls
+
+    def empty():
+        pass
+
+    def timed_block():
+        with metrics.span("bench"):
+            pass
+
+    baseline = per_call(empty)
+    print(f"metrics ({calls} calls)")
+    print(f"  span, no request      : {(per_call(timed_block) - baseline) * 1e6:6.2f} us/span")
+    token = metrics._current.set(metrics.RequestContext("/bench", metrics.DEFAULT_TIER))
+    try:
+        print(f"  span, in a request    : {(per_call(timed_block) - baseline) * 1e6:6.2f} us/span")
+    finally:
+        metrics._current.reset(token)
+
+    for i in range(endpoints):
+        for stage in ("embedding", "iris_query", "llm_generation", "whisper", "transcript_parsing"):
+            metrics.STAGE_LATENCY.observe(0.01 * i, f"/endpoint_{i}", metrics.DEFAULT_TIER, stage)
+    start = time.perf_counter()
+    text = metrics.render()
+    elapsed = time.perf_counter() - start
+    print(f"  render /metrics       : {elapsed * 1000:6.2f} ms  ({len(text.splitlines())} lines)")
+
+
+def bench_startup(runs=5, constructions=20):
+    """
+    Cold start: time to import the app in a fresh interpreter, and what each
+    request used to spend building its own OpenAI and embeddings clients.
+    """
+    import statistics
+    import subprocess
+
+    def fresh(code):
+        times = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                    env=dict(os.environ, OPENAI_API_KEY="sk-benchmark")).stdout
+            times.append(float(output.strip().splitlines()[-1]))
+        return statistics.median(times)
+
+    import_app = fresh("import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)")
+    import_langchain = fresh("import time; start = time.perf_counter(); "
+                             "from langchain.embeddings.openai import OpenAIEmbeddings; "
+                             "print(time.perf_counter() - start)")
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    import backend_database
+    import identification_generation
+
+    def per_call(fn):
+        start = time.perf_counter()
+        for _ in range(constructions):
+            fn()
+        return (time.perf_counter() - start) / constructions
+
+    # What setup_openai_key() and the embedding calls used to do on every request
+    per_request = per_call(lambda: (load_dotenv(override=True), OpenAI(),
+                                    OpenAIEmbeddings(model=backend_database.EMBEDDING_MODEL)))
+    identification_generation.setup_openai_key()
+    backend_database.get_embeddings_model()
+    shared = per_call(lambda: (identification_generation.setup_openai_key(), backend_database.get_embeddings_model()))
+
+    print(f"startup (median of {runs} fresh interpreters)")
+    print(f"  import app                 : {import_app * 1000:7.1f} ms")
+    print(f"  import langchain (deferred): {import_langchain * 1000:7.1f} ms")
+    print(f"  clients per request, built : {per_request * 1000:7.2f} ms")
+    print(f"  clients per request, shared: {shared * 1000:7.4f} ms")
+
+
+def bench_pdf_ingestion(num_pages=300, words_per_page=400, batch_size=32):
+    """
+    Whole-document PDF ingestion (pdf_to_string, chunk everything, one batch)
+    vs. the streaming pipeline: time to the first stored chunks, total time and
+    peak Python memory.
+    """
+    import tempfile
+    import tracemalloc
+    import backend_database
+    import pdf_ingestion
+    from identification_generation import pdf_to_string
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    pdf_path = os.path.join(tempfile.mkdtemp(), "coursepack.pdf")
+    synthetic_pdf(pdf_path, num_pages, words_per_page)
+
+    def whole_document(on_batch):
+        words = pdf_to_string(pdf_path).split()
+        chunks = [{
+            "chunk_url": f"documents/coursepack.pdf#chunk={i}",
+            "chunk_text": " ".join(words[start:start + 1000]),
+            "original_file_url": "documents/coursepack.pdf",
+            "file_type": "text",
+            "file_name": "coursepack",
+        } for i, start in enumerate(range(0, len(words), 1000))]
+        result = backend_database.add_embeddings_batch(chunks, user_name="bench")
+        on_batch()
+        return result["counts"]
+
+    def pipeline(on_batch):
+        return pdf_ingestion.ingest_pdf(
+            pdf_path, "bench", "documents/coursepack.pdf", "coursepack",
+            progress_callback=lambda done, total: on_batch(), batch_size=batch_size)["counts"]
+
+    print(f"pdf ingestion ({num_pages} pages, {words_per_page} words/page, {os.cpu_count()} CPUs)")
+    with mock.patch.object(backend_database, "_embeddings_model", FakeEmbedder()), \
+         mock.patch.object(backend_database, "setup_database_connection", FakeConnection), \
+         mock.patch.object(backend_database, "load_dotenv", lambda **kwargs: None), \
+         mock.patch.object(pdf_ingestion, "_tokenizer", FakeTokenizer()):
+        for label, run in (("whole doc", whole_document), ("pipeline ", pipeline)):
+            first = []
+            start = time.perf_counter()
+            counts = run(lambda: first or first.append(time.perf_counter() - start))
+            total = time.perf_counter() - start
+            # Measured in a second run: tracing allocations slows everything down
+            tracemalloc.start()
+            run(lambda: None)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label} : first stored {first[0]:6.2f}s  total {total:6.2f}s  "
+                  f"peak {peak / 2 ** 20:6.1f} MB  {counts}")
+
+
+BENCHMARKS = {
+    "ingestion": bench_ingestion,
+    "connections": bench_connections,
+    "ann": bench_ann,
+    "lexical": bench_lexical,
+    "class_search": bench_class_search,
+    "vector_storage": bench_vector_storage,
+    "identification": bench_identification,
+    "long_context_identification": bench_long_context_identification,
+    "identification_quality": bench_identification_quality,
+    "generation": bench_generation,
+    "answer_cache": bench_answer_cache,
+    "transcription": bench_transcription,
+    "segmentation": bench_segmentation,
+    "timestamps": bench_timestamps,
+    "transcript_parsing": bench_transcript_parsing,
+    "pdf_ingestion": bench_pdf_ingestion,
+    "metrics": bench_metrics,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"Unknown benchmark {name!r}; choose from: {', '.join(BENCHMARKS)}")
+        BENCHMARKS[name]()
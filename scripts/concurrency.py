@@ -0,0 +1,75 @@
+# concurrency.py
+#
+# Helpers for fanning out blocking network calls (OpenAI, Whisper) on threads.
+
+import time
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+def bounded_map(fn, items, max_workers=4, timeout=None):
+    """
+    Call fn(item) for every item with at most max_workers calls in flight.
+
+    Returns a list of (result, error) pairs in input order. A call that raises,
+    or has not finished timeout seconds after the map started, gets
+    (None, exception) and does not affect the others. Per-call limits belong
+    in fn itself (e.g. the OpenAI client's timeout argument).
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        # Each call runs in a copy of the caller's context, so metrics spans keep the request's labels
+        futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = []
+        for future in futures:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                results.append((future.result(timeout=remaining), None))
+            except FutureTimeoutError:
+                future.cancel()
+                results.append((None, TimeoutError(f"call did not finish within {timeout}s")))
+            except Exception as e:
+                results.append((None, e))
+        return results
+    finally:
+        # Don't block the caller on calls that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def is_retryable_error(error):
+    """Rate limits, server errors and dropped connections are worth retrying."""
+    import openai  # already loaded by the client that raised
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+
+def retry_with_backoff(fn, retries=5, base_delay=1.0, max_delay=30.0, retryable=is_retryable_error):
+    """
+    Call fn(), retrying retryable errors with exponential backoff and full
+    jitter (a random sleep in [0, base_delay * 2**attempt]) so that many
+    workers hitting the same rate limit don't retry in lockstep.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+            # Honour the server's Retry-After hint when it gives one
+            retry_after = None
+            response = getattr(e, "response", None)
+            if response is not None:
+                try:
+                    retry_after = float(response.headers.get("retry-after"))
+                except (TypeError, ValueError):
+                    retry_after = None
+            delay = min(retry_after, max_delay) if retry_after is not None else random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            time.sleep(delay)
@@ -0,0 +1,134 @@
+# embedding_cache.py
+#
+# Bounded cache for query embeddings so repeated /search questions skip the
+# OpenAI round trip. In-memory LRU with a TTL, optionally backed by a SQLite
+# file that survives restarts.
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Case-fold and collapse whitespace so trivially different queries share an entry."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    LRU + TTL cache of embedding vectors keyed by model name and normalized text.
+
+    max_entries bounds the in-memory tier. If disk_path is set, entries are also
+    written to a SQLite file and looked up there on an in-memory miss.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=7 * 24 * 3600, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (vector, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB,
+                    expires_at REAL
+                )
+            """)
+            self._db.execute("DELETE FROM embeddings WHERE expires_at < ?", [time.time()])
+            self._db.commit()
+
+    def get(self, model, text):
+        key = cache_key(model, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector, expires_at FROM embeddings WHERE key = ?", [key]).fetchone()
+                if row is not None and row[1] > now:
+                    vector = np.frombuffer(row[0], dtype=np.float32).copy()
+                    self._remember(key, vector, row[1])
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model, text, vector):
+        """Cache a vector; it is kept (and returned by get) as a float32 array."""
+        key = cache_key(model, text)
+        expires_at = time.time() + self.ttl_seconds
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, expires_at) VALUES (?, ?, ?)",
+                    [key, vector.tobytes(), expires_at])
+                self._db.commit()
+        return vector
+
+    def get_or_compute(self, model, text, compute):
+        """Return the cached vector, or call compute() and cache its result."""
+        vector = self.get(model, text)
+        if vector is None:
+            vector = self.put(model, text, compute())
+        return vector
+
+    def _remember(self, key, vector, expires_at):
+        self._entries[key] = (vector, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+query_embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("OMNIS_EMBED_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("OMNIS_EMBED_CACHE_TTL", str(7 * 24 * 3600))),
+    disk_path=os.getenv("OMNIS_EMBED_CACHE_PATH") or None,
+)
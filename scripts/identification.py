@@ -0,0 +1,277 @@
+# identification.py
+#
+# Finds the sentences of the retrieved chunks that answer a question.
+#
+# Map-reduce over token-sized sub-chunks: each retrieved chunk is split with
+# the model's tokenizer, a cheap local BM25 score picks the sub-chunks worth
+# sending (within a per-request token budget), the model extracts sentences
+# from each selected sub-chunk in parallel, and the extracts are merged back
+# per chunk in document order.
+#
+# Modes: "llm" does the above; "local" ranks the chunk's own sentences against
+# the question without any model call; "auto" goes local and falls back to the
+# model for chunks where the local answer covers too little of the question.
+
+import os
+import re
+import math
+import threading
+from collections import Counter
+
+from concurrency import bounded_map
+from metrics import span
+from transcript_format import load_transcript
+from lexical_index import STOPWORDS, words
+
+ID_MODEL = "gpt-4o"
+ID_MODEL_SYSTEM_PROMPT = """
+        You are a helpful assistant specializing in identifying parts of text documents that best correspond to the answer for a query.
+        You specialize in thinking deeply about the answer to a given question and then returning the exact sentences word for word that
+        best contain the answer to the question from the given context. The context is preceded by a section header called CONTEXT.
+        If nothing in the context helps answer the question, reply with exactly NONE.
+        """
+NO_ANSWER = "NONE"
+
+# How many identification calls run at once, and how long each may take
+IDENTIFICATION_CONCURRENCY = int(os.getenv("OMNIS_ID_CONCURRENCY", "5"))
+LLM_CALL_TIMEOUT = float(os.getenv("OMNIS_LLM_TIMEOUT", "60"))
+# Size of each sub-chunk sent to the model, and how much consecutive sub-chunks
+# overlap so a sentence cut at a boundary still appears whole in one of them
+SUBCHUNK_TOKENS = int(os.getenv("OMNIS_ID_SUBCHUNK_TOKENS", "2000"))
+SUBCHUNK_OVERLAP_TOKENS = 100
+# Most sub-chunks sent per retrieved chunk, and most context tokens per request
+MAX_SUBCHUNKS_PER_CHUNK = int(os.getenv("OMNIS_ID_MAX_SUBCHUNKS", "4"))
+ID_TOKEN_BUDGET = int(os.getenv("OMNIS_ID_TOKEN_BUDGET", "24000"))
+
+IDENTIFICATION_MODES = ("llm", "local", "auto")
+IDENTIFICATION_MODE = os.getenv("OMNIS_ID_MODE", "llm")
+# Sentences returned per chunk in local mode, and how close to the best
+# sentence's score another one must be to be included
+LOCAL_TOP_SENTENCES = 3
+LOCAL_RELATIVE_SCORE = 0.5
+# In auto mode, chunks whose local answer covers less than this fraction of
+# the question's content words go to the model instead
+LOCAL_MIN_CONFIDENCE = float(os.getenv("OMNIS_ID_LOCAL_MIN_CONFIDENCE", "0.6"))
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                import tiktoken
+                _tokenizer = tiktoken.encoding_for_model(ID_MODEL)
+    return _tokenizer
+
+
+def split_by_tokens(text, max_tokens=SUBCHUNK_TOKENS, overlap=SUBCHUNK_OVERLAP_TOKENS):
+    """Split text into pieces of at most max_tokens tokens. Returns [(text, num_tokens)]."""
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+    step = max_tokens - overlap
+    pieces = []
+    for start in range(0, len(tokens), step):
+        window = tokens[start:start + max_tokens]
+        pieces.append((tokenizer.decode(window), len(window)))
+        if start + max_tokens >= len(tokens):
+            break
+    return pieces
+
+
+def relevance_scores(question, texts, k1=1.2, b=0.75):
+    """BM25 score of each text against the question's content words."""
+    terms = set(words(question)) - STOPWORDS
+    if not terms or not texts:
+        return [0.0] * len(texts)
+    counts = [Counter(words(text)) for text in texts]
+    lengths = [sum(count.values()) for count in counts]
+    average_length = sum(lengths) / len(lengths) or 1
+    idf = {}
+    for term in terms:
+        df = sum(1 for count in counts if term in count)
+        idf[term] = math.log(1 + (len(counts) - df + 0.5) / (df + 0.5))
+    scores = []
+    for count, length in zip(counts, lengths):
+        score = 0.0
+        for term in terms:
+            tf = count.get(term, 0)
+            if tf:
+                score += idf[term] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+
+def select_subchunks(question, documents, token_budget=ID_TOKEN_BUDGET, max_per_document=MAX_SUBCHUNKS_PER_CHUNK):
+    """
+    Split each document into sub-chunks and choose which ones to send.
+
+    Each document first gets its most relevant sub-chunk that still fits in
+    token_budget (best documents first), so every retrieved chunk is identified
+    if the budget allows; a document with nothing that fits is identified as
+    empty. Further sub-chunks are then added best-first while they fit in
+    token_budget, skipping ones that share no content words with the question.
+    The single best sub-chunk is always sent, even if it alone exceeds the budget.
+    Returns (doc_idx, piece_idx, text, num_tokens) tuples in document order.
+    """
+    candidates = []
+    for doc_idx, text in enumerate(documents):
+        for piece_idx, (piece, num_tokens) in enumerate(split_by_tokens(text)):
+            candidates.append((doc_idx, piece_idx, piece, num_tokens))
+    scores = relevance_scores(question, [candidate[2] for candidate in candidates])
+    ranked = sorted(range(len(candidates)), key=lambda i: -scores[i])
+
+    selected = set()
+    per_document = Counter()
+    used = 0
+    for i in ranked:
+        doc_idx, _, _, num_tokens = candidates[i]
+        if per_document[doc_idx] or (selected and used + num_tokens > token_budget):
+            continue
+        selected.add(i)
+        per_document[doc_idx] += 1
+        used += num_tokens
+    for i in ranked:
+        doc_idx, _, _, num_tokens = candidates[i]
+        if i in selected or scores[i] <= 0 or per_document[doc_idx] >= max_per_document:
+            continue
+        if used + num_tokens > token_budget:
+            continue
+        selected.add(i)
+        per_document[doc_idx] += 1
+        used += num_tokens
+    return [candidates[i] for i in sorted(selected)]
+
+
+def extract_sentences(client, question, context, timeout=LLM_CALL_TIMEOUT):
+    """Map step: ask the model for the sentences of one sub-chunk that answer the question."""
+    INPUT_MSG = question + f"CONTEXT:\n {context}"
+    with span("llm_identification"):
+        id_response = client.chat.completions.create(
+            model=ID_MODEL,
+            messages = [
+            {"role": "user", "content": f"instructions {ID_MODEL_SYSTEM_PROMPT}\n, question: {INPUT_MSG}"}],
+            timeout=timeout,
+        )
+    id_response_content = id_response.choices[0].message.content
+    # Post-processing
+    return id_response_content.replace("\n", " ").replace('`', "").strip()
+
+
+def merge_extracts(extracts):
+    """Reduce step: join one document's extracts in order, dropping NONE replies and repeated sentences."""
+    seen = set()
+    sentences = []
+    for extract in extracts:
+        if extract.strip().rstrip(".").upper() == NO_ANSWER:
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+', extract):
+            key = " ".join(words(sentence))
+            if key and key not in seen:
+                seen.add(key)
+                sentences.append(sentence.strip())
+    return " ".join(sentences)
+
+
+def identify_with_llm(client, question, texts, max_workers=IDENTIFICATION_CONCURRENCY,
+                      token_budget=ID_TOKEN_BUDGET, timeout=LLM_CALL_TIMEOUT):
+    """Map-reduce identification of plain texts. Returns ([(sentences, error)], stats)."""
+    selected = select_subchunks(question, texts, token_budget=token_budget)
+
+    mapped = bounded_map(
+        lambda candidate: extract_sentences(client, question, candidate[2], timeout),
+        selected,
+        max_workers=max_workers,
+    )
+
+    extracts = [[] for _ in texts]
+    errors = [None] * len(texts)
+    for (doc_idx, _, _, _), (extract, error) in zip(selected, mapped):
+        if error is not None:
+            errors[doc_idx] = error
+        else:
+            extracts[doc_idx].append(extract)
+
+    results = []
+    for doc_extracts, error in zip(extracts, errors):
+        if not doc_extracts and error is not None:
+            results.append((None, error))
+        else:
+            results.append((merge_extracts(doc_extracts), None))
+
+    stats = {
+        "subchunks_sent": len(selected),
+        "context_tokens": sum(candidate[3] for candidate in selected),
+    }
+    return results, stats
+
+
+def split_sentences(text):
+    # Transcript segments break lines mid-sentence, so newlines are not boundaries
+    return [sentence.strip() for sentence in re.split(r'(?<=[.!?])\s+', text) if sentence.strip()]
+
+
+def identify_locally(question, text, top_n=LOCAL_TOP_SENTENCES):
+    """
+    Pick the sentences of text that best match the question by BM25, without
+    a model call. Returns (sentences in document order, confidence), where
+    confidence is the fraction of the question's content words they contain.
+    """
+    sentences = split_sentences(text)
+    scores = relevance_scores(question, sentences)
+    ranked = sorted((i for i in range(len(sentences)) if scores[i] > 0), key=lambda i: -scores[i])[:top_n]
+    if not ranked:
+        return "", 0.0
+    ranked = [i for i in ranked if scores[i] >= LOCAL_RELATIVE_SCORE * scores[ranked[0]]]
+    chosen = [sentences[i] for i in sorted(ranked)]
+    terms = set(words(question)) - STOPWORDS
+    covered = terms.intersection(words(" ".join(chosen)))
+    return " ".join(chosen), len(covered) / len(terms)
+
+
+def identify_documents(client, question, documents, max_workers=IDENTIFICATION_CONCURRENCY,
+                       token_budget=ID_TOKEN_BUDGET, timeout=LLM_CALL_TIMEOUT, mode=None):
+    """
+    documents: [(chunk_text, chunk_type)] as retrieved. mode is one of
+    IDENTIFICATION_MODES (default IDENTIFICATION_MODE).
+
+    Returns (results, stats). results has one (sentences, error) pair per
+    document in input order; a document whose every call failed gets
+    (None, error). stats counts the sub-chunks and context tokens sent and how
+    many documents were answered locally.
+    """
+    mode = mode or IDENTIFICATION_MODE
+    if mode not in IDENTIFICATION_MODES:
+        raise ValueError(f"Unknown identification mode {mode!r}; expected one of {IDENTIFICATION_MODES}")
+    texts = [load_transcript(text).plain_text().strip() if chunk_type == "video" else text
+             for text, chunk_type in documents]
+
+    results = [None] * len(texts)
+    if mode != "llm":
+        for idx, text in enumerate(texts):
+            sentences, confidence = identify_locally(question, text)
+            if mode == "local" or confidence >= LOCAL_MIN_CONFIDENCE:
+                results[idx] = (sentences, None)
+
+    remaining = [idx for idx, result in enumerate(results) if result is None]
+    stats = {"subchunks_sent": 0, "context_tokens": 0}
+    if remaining:
+        llm_results, stats = identify_with_llm(
+            client, question, [texts[idx] for idx in remaining],
+            max_workers=max_workers, token_budget=token_budget, timeout=timeout)
+        for idx, result in zip(remaining, llm_results):
+            results[idx] = result
+    stats["answered_locally"] = len(texts) - len(remaining)
+    return results, stats
+
+
+def identify_chunk(client, question, chunk_text, chunk_type, timeout=LLM_CALL_TIMEOUT, mode=None):
+    """Identify a single retrieved chunk; raises if every call for it failed."""
+    [(content, error)], _ = identify_documents(client, question, [(chunk_text, chunk_type)], timeout=timeout, mode=mode)
+    if error is not None:
+        raise error
+    return content
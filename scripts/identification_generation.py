@@ -1,50 +1,53 @@
-import pandas as pd 
-import numpy as np
 import os
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
 from typing import List 
-from tqdm import tqdm
 import re
-from difflib import SequenceMatcher
+from transcript_format import parse_legacy, format_timestamp, parse_timestamp
 
 
 
+_client = None
+_client_lock = threading.Lock()
+
+
 def setup_openai_key():
     """
     Load environment variables and set up OpenAI API key if not present.
-    Return client object with key    
+    Return the process-wide client object with key (created on first call;
+    it is thread-safe and keeps its connection pool between requests)
     """
-    load_dotenv(override=True)
-    if not os.environ.get("OPENAI_API_KEY"):
-        raise ValueError("OpenAI API key not found in environment variables")
-    open_ai_key = os.getenv("OPENAI_APIKEY")
-    client = OpenAI(
-        api_key=open_ai_key,
-    )
-    return client 
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                load_dotenv(override=True)
+                if not os.environ.get("OPENAI_API_KEY"):
+                    raise ValueError("OpenAI API key not found in environment variables")
+                from openai import OpenAI
+                open_ai_key = os.getenv("OPENAI_APIKEY")
+                _client = OpenAI(
+                    api_key=open_ai_key,
+                )
+    return _client
+
+
+def clean_text(text):
+    """Heuristics to fix PDF text extraction"""
+    processed_text = text.strip().replace("\n", " ").replace("\t", " ").replace(" ", " ")
+    processed_text = processed_text.replace("●", "")
+    return processed_text.strip()
 
 
 def pdf_to_string(pdf_path):
     """
     Parse pdfs: all text documents will be in pdf format
     """
-    # Create a PDF reader object
+    from PyPDF2 import PdfReader
     pdf_reader = PdfReader(pdf_path)
-    
-    # Initialize an empty string to store the text
-    text = ""
-    
-    # Iterate through all pages and extract text
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    
-    # Heuristics to fix processing
-    processed_text = text.strip()
-    processed_text = processed_text.strip().replace("\n", " ").replace("\t", " ").replace(" ", " ")
-    processed_text = processed_text.replace("●", "")
-    return processed_text.strip()
+    # Join once instead of growing a string page by page
+    text = "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+    return clean_text(text)
 
 
 def read_mp3_transcript(transcript_path):
@@ -70,60 +73,42 @@ def chunk_str(input_str, chunk_size=16384):
 
 # Video transcript parsing
 
-def parse_text_from_timestamps_original(data: str) -> str:
-    return re.sub(r'\d{2}:\d{2} - \d{2}:\d{2}: ', '', data).strip().split(": ")
+def parse_text_from_timestamps_original(data: str) -> list:
+    """The spoken text of each segment, without timestamps."""
+    return parse_legacy(data).texts()
 
 
-def parse_text_from_timestamps(data: str) -> str:
+def parse_text_from_timestamps(data: str) -> list:
     """
-    Removes timestamps from a given formatted text.
+    Splits a timestamped transcript into its segments.
     
     Parameters:
     data (str): The input text with timestamps.
     
     Returns:
-    List: The cleaned text without timestamps as a list 
+    List: dicts with start_time, end_time (as written, e.g. "00:06") and text
     """
-
-    # This regular expression will capture:
-    #   Group 1: the timestamp range, e.g. "HH:MM - HH:MM"
-    #   Group 2: all text that follows until the next timestamp or the end of the string
-    pattern = r'(\d{2}:\d{2}\s*-\s*\d{2}:\d{2}):\s*(.*?)\s*(?=\d{2}:\d{2}\s*-\s*\d{2}:\d{2}:|$)'
-
-    matches = re.findall(pattern, data, flags=re.DOTALL)
-
-    results = []
-    for match in matches:
-        timestamp_range = match[0]  # e.g. "00:00 - 00:06"
-        text_block = match[1]
-
-        # Split into start and end times
-        start_time, end_time = timestamp_range.split('-')
-        start_time = start_time.strip()       # e.g. "00:00"
-        end_time = end_time.strip()           # e.g. "00:06"
-
-        # Create a dictionary with your desired fields
-        results.append({
-            "start_time": start_time,
-            "end_time": end_time,
-            "text": text_block.strip()
-        })
-
-    # results is now a list of dicts, each with start_time, end_time, and text.
-    return results
+    transcript = parse_legacy(data)
+    return [
+        {
+            "start_time": format_timestamp(start),
+            "end_time": format_timestamp(end),
+            "text": text,
+        }
+        for start, end, text in transcript.segments()
+    ]
 
 def parse_timestamps(chunks: list ) -> list:
     """
-    Extracts timestamps from a given formatted text.
+    Extracts timestamps from parsed transcript segments.
     
     Parameters:
-    data (str): The input text with timestamps.
+    chunks (list): segments as returned by parse_text_from_timestamps.
     
     Returns:
     list: A list of extracted timestamps in the form of seconds since the start of the video
     """
-    timestamps = [chunk["start_time"] for chunk in chunks]
-    return [int(mm) * 60 + int(ss) for mm, ss in (ts.split(":") for ts in timestamps)]
+    return [parse_timestamp(chunk["start_time"]) // 1000 for chunk in chunks]
 
 
 def tokenize(text):
@@ -178,12 +163,13 @@ def run_identification(top_k_queries: List[str], top_k_types: List[str], questio
     top_k_queries: text over either video transcript or documents (notes, slides, etc.)
     top_k_types: either video, text, or image
     """
+    from tqdm import tqdm
     client = setup_openai_key()
     top_k_ids = []
-    for idx, chunk_text, chunk_type in tqdm(enumerate(zip(top_k_queries, top_k_types))):
+    for idx, (chunk_text, chunk_type) in tqdm(enumerate(zip(top_k_queries, top_k_types))):
         if chunk_type == "video":
             # Remove whitespace after joining
-            chunk_text = "\n".join(parse_text_from_timestamps(chunk_text)).strip()
+            chunk_text = parse_legacy(chunk_text).plain_text().strip()
         context_artifact_chunks = chunk_str(chunk_text)
 
         ID_MODEL_SYSTEM_PROMPT = """
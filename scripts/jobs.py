@@ -0,0 +1,162 @@
+# jobs.py
+#
+# Background job queue for long-running work (video transcription) so request
+# threads return immediately. Jobs report progress, can be cancelled, and keep
+# their result around for a while after finishing.
+
+import os
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work function when it notices it was cancelled."""
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def update_progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def eta_seconds(self):
+        """Remaining time extrapolated from the rate so far; None until there is a rate."""
+        if self.status != RUNNING or not self.done or not self.total:
+            return None
+        elapsed = time.time() - self.started_at
+        return max(0.0, elapsed / self.done * (self.total - self.done))
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "eta_seconds": self.eta_seconds(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a fixed pool of worker threads.
+
+    At most max_workers jobs run at once and at most max_queue more wait;
+    further submissions raise QueueFullError. Finished jobs are forgotten
+    after retention_seconds.
+    """
+
+    def __init__(self, max_workers=2, max_queue=16, retention_seconds=3600):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, on_finish=None):
+        """
+        Queue fn(job, *args). Its return value becomes job.result. on_finish(job),
+        if given, runs after the job ends however it ended (e.g. to clean up files).
+        """
+        with self._lock:
+            self._forget_expired()
+            active = sum(1 for job in self._jobs.values() if job.status not in FINISHED_STATES)
+            if active >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"{active} jobs already queued or running")
+            job = Job(kind)
+            self._jobs[job.id] = job
+        # The job's metrics inherit the submitting request's labels
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, on_finish)
+        return job
+
+    def _run(self, job, fn, args, on_finish):
+        with metrics.background(f"job:{job.kind}") as work:
+            self._execute(job, fn, args, on_finish)
+            work.status = job.status
+
+    def _execute(self, job, fn, args, on_finish):
+        try:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.result = fn(job, *args)
+            job.status = SUCCEEDED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            if on_finish is not None:
+                try:
+                    on_finish(job)
+                except Exception as e:
+                    print(f"Cleanup for job {job.id} failed: {e}")
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation. Queued jobs never start; running jobs stop at their next check."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status not in FINISHED_STATES:
+            job.cancel_event.set()
+        return job
+
+    def queue_depth(self):
+        return sum(1 for job in list(self._jobs.values()) if job.status == QUEUED)
+
+    def _forget_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager(
+    max_workers=int(os.getenv("OMNIS_JOB_WORKERS", "2")),
+    max_queue=int(os.getenv("OMNIS_JOB_QUEUE", "16")),
+)
@@ -0,0 +1,301 @@
+# lexical_index.py
+#
+# BM25 keyword search over a user's chunk texts, for the exact-term queries
+# (formula names, course codes, speaker names) that embeddings tend to miss.
+#
+# An inverted index from term to (document, term frequency) postings, kept per
+# user and per class and updated incrementally as chunks are added. Documents
+# are keyed by content hash, like the vector index, so identical chunks are
+# indexed once.
+
+import os
+import re
+import json
+import atexit
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from vector_index import INDEX_DIR, SAVE_INTERVAL_SECONDS, CHECK_INTERVAL_SECONDS, partition_key, ingesting_users
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+# Terms in more than this fraction of documents carry almost no BM25 weight but
+# have the longest postings lists. They are skipped; if every query term is that
+# common, only the rarest one is scored.
+MAX_DF_FRACTION = 0.5
+
+# Words that say nothing about which document is relevant; also skipped at
+# query time because their postings lists are the longest
+STOPWORDS = frozenset("""
+    a an and are as at be but by can could did do does for from had has have how i if in into is it
+    its me my of on or should so than that the their them then there these they this to was we were
+    what when where which who whom why will with would you your about explain describe tell
+""".split())
+
+
+def words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring. Thread-safe; documents can be added incrementally."""
+
+    def __init__(self):
+        self.ids = []
+        self._positions = {}
+        self._lengths = array("i")
+        self._total_length = 0
+        # term -> (document numbers, term frequencies)
+        self._postings = {}
+        self._lock = threading.RLock()
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._positions
+
+    def add(self, doc_ids, texts):
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                if doc_id in self._positions:
+                    continue
+                number = len(self.ids)
+                self.ids.append(doc_id)
+                self._positions[doc_id] = number
+                terms = words(text)
+                self._lengths.append(len(terms))
+                self._total_length += len(terms)
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, count in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("i"), array("i"))
+                    postings[0].append(number)
+                    postings[1].append(count)
+                self.dirty = True
+
+    def search(self, query, k=10):
+        """Return [(doc_id, score)] for the k best matches, best first."""
+        terms = set(words(query)) - STOPWORDS or set(words(query))
+        with self._lock:
+            count = len(self.ids)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            lengths = np.frombuffer(self._lengths, dtype=np.int32)
+            found = [self._postings[term] for term in terms if term in self._postings]
+            selective = [postings for postings in found if len(postings[0]) <= MAX_DF_FRACTION * count]
+            if found and not selective:
+                selective = [min(found, key=lambda postings: len(postings[0]))]
+            matched = []
+            for postings in selective:
+                # Copies, so appends after we release the lock can't affect us
+                docs = np.frombuffer(postings[0], dtype=np.int32).copy()
+                tf = np.frombuffer(postings[1], dtype=np.int32).copy()
+                matched.append((docs, tf, lengths[docs]))
+            # The array can't grow while a numpy view of it exists
+            del lengths
+            ids = self.ids
+
+        if not matched:
+            return []
+        scores = np.zeros(count)
+        for docs, tf, doc_lengths in matched:
+            idf = np.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = K1 * (1 - B + B * doc_lengths / average_length)
+            scores[docs] += idf * tf * (K1 + 1) / (tf + norm)
+        candidates = np.flatnonzero(scores)
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def save(self, path):
+        with self._lock:
+            terms = list(self._postings)
+            offsets = np.cumsum([0] + [len(self._postings[term][0]) for term in terms])
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                docs=np.concatenate([np.frombuffer(self._postings[term][0], dtype=np.int32) for term in terms])
+                if terms else np.empty(0, np.int32),
+                tfs=np.concatenate([np.frombuffer(self._postings[term][1], dtype=np.int32) for term in terms])
+                if terms else np.empty(0, np.int32),
+                offsets=offsets,
+                lengths=np.frombuffer(self._lengths, dtype=np.int32),
+                meta=np.frombuffer(json.dumps({"ids": self.ids, "terms": terms}).encode("utf-8"), dtype=np.uint8),
+            )
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            docs, tfs, offsets = data["docs"], data["tfs"], data["offsets"]
+            index.ids = meta["ids"]
+            index._positions = {doc_id: number for number, doc_id in enumerate(index.ids)}
+            index._lengths = array("i", data["lengths"].tolist())
+            index._total_length = int(data["lengths"].sum())
+            for i, term in enumerate(meta["terms"]):
+                start, end = offsets[i], offsets[i + 1]
+                index._postings[term] = (array("i", docs[start:end].tolist()), array("i", tfs[start:end].tolist()))
+        return index
+
+
+# ---------------------------------------------------------------------------
+# Per-user indexes
+# ---------------------------------------------------------------------------
+
+_indexes = {}
+_last_saved = {}
+_last_checked = {}
+# Guards the dicts above; loading and building happen under the partition's own lock
+_indexes_lock = threading.Lock()
+_partition_locks = {}
+
+
+def index_path(key):
+    return os.path.join(INDEX_DIR, f"{key}.bm25.npz")
+
+
+def build_user_index(cursor, user_name, class_id=None):
+    """
+    Build a user's (or one class's) index from the chunk texts stored in IRIS.
+    Chunks without a class belong to the whole library, so every class index has them.
+    """
+    if class_id is None:
+        cursor.execute(f"SELECT content_hash, chunk_text FROM {user_name}.classes")
+    else:
+        cursor.execute(f"""
+            SELECT content_hash, chunk_text FROM {user_name}.classes WHERE class_id = ? OR class_id IS NULL
+        """, [class_id])
+    index = BM25Index()
+    rows = cursor.fetchall()
+    index.add([row[0] for row in rows], [row[1] for row in rows])
+    return index
+
+
+def source_size(cursor, user_name, class_id=None):
+    """How many distinct chunk texts IRIS holds for a user's (or one class's) index."""
+    if class_id is None:
+        cursor.execute(f"SELECT COUNT(DISTINCT content_hash) FROM {user_name}.classes")
+    else:
+        cursor.execute(f"""
+            SELECT COUNT(DISTINCT content_hash) FROM {user_name}.classes WHERE class_id = ? OR class_id IS NULL
+        """, [class_id])
+    return cursor.fetchone()[0]
+
+
+def partition_lock(key):
+    with _indexes_lock:
+        return _partition_locks.setdefault(key, threading.Lock())
+
+
+def check_due(key, user_name):
+    # vector_index.ingesting marks ingests for both kinds of index
+    return (time.monotonic() - _last_checked.get(key, float("-inf")) >= CHECK_INTERVAL_SECONDS
+            and user_name not in ingesting_users())
+
+
+def get_user_index(user_name, cursor=None, class_id=None):
+    """
+    Return the in-memory index for a user or one of their classes, loading it
+    from disk or building it from IRIS (when a cursor is given) the first
+    time. None if unavailable.
+
+    With a cursor, an index whose size no longer matches IRIS (at most every
+    CHECK_INTERVAL_SECONDS, and not while this process is ingesting for the
+    user) is rebuilt outside the shared lock and swapped in.
+    """
+    key = partition_key(user_name, class_id)
+    index = _indexes.get(key)
+    if index is not None and (cursor is None or not check_due(key, user_name)):
+        return index
+
+    built = False
+    with partition_lock(key):
+        index = _indexes.get(key)
+        if index is None:
+            path = index_path(key)
+            if os.path.exists(path):
+                index = BM25Index.load(path)
+            elif cursor is not None:
+                index = build_user_index(cursor, user_name, class_id)
+                built = True
+            else:
+                return None
+        if cursor is not None and not built and check_due(key, user_name):
+            _last_checked[key] = time.monotonic()
+            if len(index) != source_size(cursor, user_name, class_id):
+                print(f"Lexical index for {key} is out of date, rebuilding it from IRIS")
+                index = build_user_index(cursor, user_name, class_id)
+                built = True
+        with _indexes_lock:
+            if _indexes.get(key) is not index:
+                _indexes[key] = index
+                _last_saved[key] = time.monotonic()
+            if built:
+                _last_checked[key] = time.monotonic()
+    if built:
+        # Only a fresh build is written right away; incremental adds are saved on the throttled path
+        index.dirty = True
+        save_user_index(key, force=True)
+    return index
+
+
+def add_to_user_index(user_name, doc_ids, texts, class_id=None):
+    """
+    Incremental insert from the ingestion path. Only touches indexes that have
+    already been built; a partition's first hybrid search builds it from IRIS.
+    """
+    index = get_user_index(user_name, class_id=class_id)
+    if index is None:
+        return
+    index.add(doc_ids, texts)
+    save_user_index(partition_key(user_name, class_id))
+
+
+def discard_class_indexes(user_name):
+    """Drop every class index of a user, e.g. after library-wide chunks were added."""
+    prefix = partition_key(user_name, "")
+    with _indexes_lock:
+        keys = {key for key in _indexes if key.startswith(prefix)}
+        if os.path.isdir(INDEX_DIR):
+            keys |= {name[:-len(".bm25.npz")] for name in os.listdir(INDEX_DIR)
+                     if name.startswith(prefix) and name.endswith(".bm25.npz")}
+        for key in keys:
+            _indexes.pop(key, None)
+            _last_saved.pop(key, None)
+            _last_checked.pop(key, None)
+            if os.path.exists(index_path(key)):
+                os.remove(index_path(key))
+
+
+def save_user_index(key, force=False):
+    index = _indexes.get(key)
+    if index is None or not index.dirty:
+        return
+    if not force and time.monotonic() - _last_saved.get(key, 0) < SAVE_INTERVAL_SECONDS:
+        return
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    index.save(index_path(key))
+    _last_saved[key] = time.monotonic()
+
+
+@atexit.register
+def save_all_indexes():
+    for key in list(_indexes):
+        try:
+            save_user_index(key, force=True)
+        except Exception as e:
+            print(f"Could not save lexical index for {key}: {e}")
@@ -0,0 +1,793 @@
+# load_test.py
+#
+# Offline load test of the Flask API. The app runs in-process on a real
+# threaded HTTP server and is driven over HTTP at a configurable concurrency;
+# nothing talks to OpenAI or IRIS:
+#
+# - FakeOpenAIServer is a local HTTP server speaking the subset of the OpenAI
+#   API the app uses (embeddings, chat completions with and without streaming,
+#   audio transcriptions). The app's own OpenAI / langchain clients are pointed
+#   at it with OPENAI_BASE_URL, so client code and HTTP round trips are part of
+#   what is measured. Responses are deterministic; latencies are configurable.
+# - InMemoryStore replaces the IRIS-backed add_embeddings, add_embeddings_batch
+#   and search_files of backend_database with the same signatures and results.
+#
+# Each scenario reports throughput and p50/p95/p99 latency. --json writes the
+# report (with the commit it was run on) and --compare prints the change
+# against an earlier report, so runs can be compared across commits.
+#
+# Usage: python load_test.py [<scenario> ...] [--concurrency 8] [--requests 200]
+#        [--corpus 2000] [--json report.json] [--compare baseline.json]
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import wave
+import zlib
+import base64
+import shutil
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+from benchmarks import EMBEDDING_DIM, synthetic_lecture_pcm, synthetic_transcript
+
+LOAD_TEST_USER = "loadtest"
+VOCABULARY = [f"word{i}" for i in range(5000)]
+
+
+# ---------------------------------------------------------------------------
+# Fake OpenAI API
+# ---------------------------------------------------------------------------
+
+def hashed_embedding(tokens, dim=EMBEDDING_DIM):
+    """
+    Deterministic unit-length embedding of a word (or token id) sequence: a
+    hashed bag of words, so texts that share words score as similar.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokens:
+        vector[zlib.crc32(str(token).encode("utf-8")) % dim] += 1
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def text_embedding(text):
+    return hashed_embedding(text.lower().replace("?", "").split())
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for api.openai.com/v1. Embeddings cost embedding_latency
+    plus per_input_latency per input; a completion's first token arrives after
+    chat_latency and then one every token_interval; a transcription takes
+    whisper_latency. Runs on a background thread; use as a context manager.
+    """
+
+    def __init__(self, embedding_latency=0.15, per_input_latency=0.002, chat_latency=0.8,
+                 token_interval=0.01, num_tokens=200, whisper_latency=0.3):
+        self.embedding_latency = embedding_latency
+        self.per_input_latency = per_input_latency
+        self.chat_latency = chat_latency
+        self.token_interval = token_interval
+        self.num_tokens = num_tokens
+        self.whisper_latency = whisper_latency
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, endpoint):
+        with self._calls_lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def completion_text(self, messages):
+        """Echo words of the prompt's context (or question), so identification returns real sentences."""
+        prompt = messages[-1]["content"] if messages else ""
+        _, _, context = prompt.rpartition("CONTEXT:")
+        words = (context or prompt).split()
+        return " ".join(words[:self.num_tokens]) or "No answer."
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?")[0]
+                server.count(path)
+                if path.endswith("/embeddings"):
+                    self.embeddings(json.loads(body))
+                elif path.endswith("/chat/completions"):
+                    self.chat(json.loads(body))
+                elif path.endswith("/audio/transcriptions"):
+                    time.sleep(server.whisper_latency)
+                    words = [VOCABULARY[(zlib.crc32(body) + i * 7919) % len(VOCABULARY)] for i in range(20)]
+                    self.send_json({"text": " ".join(words)})
+                else:
+                    self.send_json({"error": {"message": f"Unknown endpoint {path}"}}, status=404)
+
+            def send_json(self, payload, status=200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def embeddings(self, request):
+                inputs = request["input"]
+                # A single input may be a string, a list of token ids, or a list of either
+                if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                    inputs = [inputs]
+                time.sleep(server.embedding_latency + server.per_input_latency * len(inputs))
+                data = []
+                for idx, item in enumerate(inputs):
+                    vector = text_embedding(item) if isinstance(item, str) else hashed_embedding(item)
+                    if request.get("encoding_format") == "base64":
+                        embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+                    else:
+                        embedding = vector.tolist()
+                    data.append({"object": "embedding", "index": idx, "embedding": embedding})
+                tokens = sum(len(item.split()) if isinstance(item, str) else len(item) for item in inputs)
+                self.send_json({"object": "list", "data": data, "model": request.get("model"),
+                                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+            def chat(self, request):
+                text = server.completion_text(request.get("messages", []))
+                tokens = text.split(" ")
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                         "total_tokens": prompt_tokens + len(tokens)}
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                model = request.get("model")
+                if not request.get("stream"):
+                    time.sleep(server.chat_latency + server.token_interval * len(tokens))
+                    self.send_json({
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                        "model": model, "usage": usage,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                    })
+                    return
+
+                # Server-sent events; the connection is closed to mark the end of the body
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def event(choices, **extra):
+                    payload = {"id": completion_id, "object": "chat.completion.chunk",
+                               "created": int(time.time()), "model": model, "choices": choices, **extra}
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                try:
+                    time.sleep(server.chat_latency)
+                    for i, token in enumerate(tokens):
+                        if i:
+                            time.sleep(server.token_interval)
+                        event([{"index": 0, "delta": {"content": token if i == 0 else " " + token},
+                                "finish_reason": None}])
+                    event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        event([], usage=usage)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the app closed the stream early
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# In-memory store
+# ---------------------------------------------------------------------------
+
+class UserTable:
+    """One user's chunks and their deduplicated vectors, as numpy columns."""
+
+    def __init__(self):
+        self.chunks = {}  # chunk_url -> row index
+        self.rows = []  # (chunk_url, chunk_text, original_file_url, file_type, file_name, class_id)
+        self.row_vectors = []  # row index -> vector index
+        self.vector_ids = {}  # content hash -> vector index
+        self.vectors = []
+        self._matrix = None
+
+    def matrix(self):
+        if self._matrix is None or len(self._matrix) != len(self.vectors):
+            self._matrix = np.vstack(self.vectors) if self.vectors else np.zeros((0, EMBEDDING_DIM), np.float32)
+        return self._matrix
+
+
+class InMemoryStore:
+    """
+    Stands in for IRIS behind the backend_database functions the routes call,
+    with the same signatures and result shapes. Embeddings are still requested
+    through the app's embedding client (so from the fake OpenAI server), and
+    search is an exact dot-product scan, like search_mode="exact" in IRIS.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def table(self, user_name):
+        safe_user_name = user_name.strip().replace(" ", "")
+        with self._lock:
+            return self._tables.setdefault(safe_user_name, UserTable())
+
+    def _insert(self, table, chunk, content_hash, vector, class_id):
+        if content_hash not in table.vector_ids:
+            table.vector_ids[content_hash] = len(table.vectors)
+            table.vectors.append(vector)
+        table.chunks[chunk["chunk_url"]] = len(table.rows)
+        table.rows.append((chunk["chunk_url"], chunk["chunk_text"], chunk["original_file_url"],
+                           chunk["file_type"], chunk["file_name"], class_id))
+        table.row_vectors.append(table.vector_ids[content_hash])
+
+    def seed(self, user_name, chunks):
+        """Load a corpus directly, embedding locally instead of through the API."""
+        import backend_database
+        table = self.table(user_name)
+        with self._lock:
+            for chunk in chunks:
+                self._insert(table, chunk, backend_database.content_fingerprint(chunk["chunk_text"]),
+                             text_embedding(chunk["chunk_text"]), chunk.get("class_id"))
+
+    def add_embeddings_batch(self, chunks, user_name):
+        import backend_database
+        from metrics import span
+
+        statuses = [{"chunk_url": chunk["chunk_url"], "status": None} for chunk in chunks]
+        try:
+            table = self.table(user_name)
+            class_ids = [backend_database.normalize_class_id(chunk.get("class_id")) for chunk in chunks]
+            hashes = [backend_database.content_fingerprint(chunk["chunk_text"]) for chunk in chunks]
+            seen = set()
+            pending = []
+            with self._lock:
+                for idx, chunk in enumerate(chunks):
+                    if chunk["chunk_url"] in seen:
+                        statuses[idx]["status"] = "duplicate"
+                    elif chunk["chunk_url"] in table.chunks:
+                        statuses[idx]["status"] = "exists"
+                    else:
+                        pending.append(idx)
+                    seen.add(chunk["chunk_url"])
+                to_embed = {}
+                for idx in pending:
+                    if hashes[idx] not in table.vector_ids:
+                        to_embed.setdefault(hashes[idx], chunks[idx]["chunk_text"])
+
+            embed_hashes = list(to_embed)
+            embed_texts = list(to_embed.values())
+            new_vectors = {}
+            failed = {}
+            embeddings_model = backend_database.get_embeddings_model()
+            for batch in backend_database.batch_for_embedding(embed_texts):
+                try:
+                    with span("embedding"):
+                        vectors = backend_database.as_float32(
+                            embeddings_model.embed_documents([embed_texts[i] for i in batch]))
+                except Exception as e:
+                    for i in batch:
+                        failed[embed_hashes[i]] = str(e)
+                    continue
+                new_vectors.update((embed_hashes[i], vector) for i, vector in zip(batch, vectors))
+
+            with self._lock:
+                for idx in pending:
+                    if hashes[idx] in failed:
+                        statuses[idx].update(status="error", message=failed[hashes[idx]])
+                        continue
+                    if chunks[idx]["chunk_url"] in table.chunks:
+                        statuses[idx]["status"] = "exists"  # stored by a concurrent request meanwhile
+                        continue
+                    created = hashes[idx] not in table.vector_ids
+                    vector = new_vectors.get(hashes[idx])
+                    self._insert(table, chunks[idx], hashes[idx], vector, class_ids[idx])
+                    statuses[idx]["status"] = "created" if created else "reused"
+
+            stored = {class_ids[idx] for idx in pending if statuses[idx]["status"] in ("created", "reused")}
+            if stored:
+                safe_user_name = user_name.strip().replace(" ", "")
+                for class_id in {None} | stored:
+                    backend_database.answer_cache.invalidate(backend_database.scope_key(safe_user_name, class_id),
+                                                             include_classes=None in stored)
+
+            counts = {}
+            for status in statuses:
+                counts[status["status"]] = counts.get(status["status"], 0) + 1
+            return {"status": "success", "counts": counts, "results": statuses}
+
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def add_embeddings(self, chunk_url, chunk_text, original_file_url, user_name, file_type, file_name,
+                       class_id=None):
+        result = self.add_embeddings_batch([{
+            "chunk_url": chunk_url,
+            "chunk_text": chunk_text,
+            "original_file_url": original_file_url,
+            "file_type": file_type,
+            "file_name": file_name,
+            "class_id": class_id,
+        }], user_name)
+        if result["status"] != "success":
+            return result
+        chunk_result = result["results"][0]
+        if chunk_result["status"] == "exists":
+            return {"status": "success", "message": "Chunk already processed", "already_exists": True}
+        if chunk_result["status"] == "error":
+            return {"status": "error", "message": chunk_result["message"]}
+        return {"status": "success", "message": "New embeddings created and stored", "already_exists": False}
+
+    def search_files(self, search_phrase, user_name, num_results=3, search_mode=None, nprobe=None,
+                     lexical_weight=1.0, vector_weight=1.0, class_id=None, file_type=None, file_name=None):
+        import backend_database
+        from metrics import span
+
+        try:
+            filters = {"class_id": backend_database.normalize_class_id(class_id),
+                       "file_type": file_type or None, "file_name": file_name or None}
+            search_vector = backend_database.as_float32(backend_database.embed_query(search_phrase))
+            table = self.table(user_name)
+            # Timed as the query it replaces
+            with span("iris_query"):
+                with self._lock:
+                    rows = list(table.rows)
+                    row_vectors = np.asarray(table.row_vectors, dtype=np.int64)
+                    matrix = table.matrix()
+                keep = np.ones(len(rows), dtype=bool)
+                for column, value in ((5, filters["class_id"]), (3, filters["file_type"]),
+                                      (4, filters["file_name"])):
+                    if value is not None:
+                        # Like filter_clause, chunks without a class match every class
+                        keep &= np.fromiter((row[column] == value or (column == 5 and row[column] is None)
+                                             for row in rows), dtype=bool, count=len(rows))
+                candidates = np.flatnonzero(keep)
+                scores = (matrix @ search_vector)[row_vectors[candidates]] if len(candidates) else np.zeros(0)
+                top = candidates[np.argsort(-scores, kind="stable")[:num_results]] if len(candidates) else []
+                by_row = dict(zip(candidates.tolist(), scores.tolist()))
+
+            results = []
+            for row_idx in top:
+                chunk_url, chunk_text, original_file_url, row_file_type, row_file_name, _ = rows[row_idx]
+                results.append({
+                    "chunk_url": chunk_url,
+                    "chunk_text": chunk_text,
+                    "original_file_url": original_file_url,
+                    "file_type": row_file_type,
+                    "file_name": row_file_name,
+                    "score": by_row[int(row_idx)],
+                })
+            return {"status": "success", "results": results}
+
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+def synthetic_chunk(i, words, rng, class_id=None):
+    return {
+        "chunk_url": f"loadtest/chunks/{i}.txt",
+        "chunk_text": " ".join(rng.choice(VOCABULARY) for _ in range(words)),
+        "original_file_url": "loadtest/coursepack.pdf",
+        "file_type": "text",
+        "file_name": "coursepack",
+        "class_id": class_id,
+    }
+
+
+def synthetic_wav(seconds, seed):
+    """A WAV file (bytes) of lecture-like audio; each seed gives different audio."""
+    import video_to_transcript
+
+    pcm = bytearray()
+    for block in synthetic_lecture_pcm(minutes=seconds / 60, seed=seed):
+        pcm.extend(block)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(video_to_transcript.SAMPLE_RATE)
+        out.writeframes(bytes(pcm[:int(seconds * video_to_transcript.SAMPLE_RATE) * 2]))
+    return buffer.getvalue()
+
+
+def multipart_body(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class LoadClient:
+    """Minimal HTTP client for the app under test (stdlib only, one connection per request)."""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None, body=None, content_type=None):
+        if payload is not None:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post(self, path, payload):
+        status, body = self.request("POST", path, payload)
+        if status >= 400:
+            raise RuntimeError(f"{path} returned {status}: {body[:200]!r}")
+        data = json.loads(body)
+        if data.get("status") == "error":
+            raise RuntimeError(f"{path} failed: {data.get('message')}")
+        return data
+
+
+class Scenarios:
+    """One request function per endpoint under test, over a shared synthetic corpus."""
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.corpus_texts = []
+        self.transcript = synthetic_transcript(hours=args.transcript_minutes / 60, seed=args.seed)
+        self.transcript_lines = self.transcript.splitlines()
+        self.questions = [" ".join(self.rng.choice(VOCABULARY) for _ in range(8)) + "?"
+                          for _ in range(args.distinct_questions)]
+
+    def seed(self, store):
+        chunks = [synthetic_chunk(i, self.args.chunk_words, self.rng) for i in range(self.args.corpus)]
+        store.seed(LOAD_TEST_USER, chunks)
+        self.corpus_texts = [chunk["chunk_text"] for chunk in chunks]
+
+    def question(self, i):
+        return self.questions[i % len(self.questions)]
+
+    def add_embedding(self, i):
+        rng = random.Random(f"{self.run_id}-{i}")
+        chunk = synthetic_chunk(f"{self.run_id}-{i}", self.args.chunk_words, rng)
+        self.client.post("/add_embedding", dict(chunk, user_name=LOAD_TEST_USER))
+
+    def search(self, i):
+        self.client.post("/search", {"query": self.question(i), "user_name": LOAD_TEST_USER, "num_results": 3})
+
+    def run_identification(self, i):
+        rng = random.Random(i)
+        texts = [rng.choice(self.corpus_texts) for _ in range(2)] if self.corpus_texts else []
+        self.client.post("/run_identification", {
+            "question": self.question(i),
+            "top_k_queries": texts + [self.transcript],
+            "top_k_types": ["text"] * len(texts) + ["video"],
+        })
+
+    def run_generation(self, i):
+        rng = random.Random(i % len(self.questions))
+        context = [" ".join(rng.choice(VOCABULARY) for _ in range(40)) for _ in range(3)]
+        self.client.post("/run_generation", {
+            "question": self.question(i), "top_k_ids": context, "user_name": LOAD_TEST_USER,
+            "chunk_urls": [f"loadtest/chunks/{i % len(self.questions)}-{k}.txt" for k in range(3)],
+        })
+
+    def get_video_timestamp(self, i):
+        line = self.transcript_lines[i % len(self.transcript_lines)]
+        said = line.split(": ", 1)[1]
+        self.client.post("/get_video_timestamp", {
+            "transcript_content_chunks": [self.transcript],
+            "file_types": ["video"],
+            "file_urls": ["loadtest/lecture.mp4"],
+            "file_names": ["lecture"],
+            "top_k_ids": [said],
+        })
+
+    def process_video(self, i):
+        # Different audio every time, so the transcript cache doesn't answer for the API
+        body, content_type = multipart_body(
+            {}, [("video", "lecture.wav", synthetic_wav(self.args.audio_seconds, seed=zlib.crc32(f"{self.run_id}-{i}".encode())))])
+        status, response = self.client.request("POST", "/process_video", body=body, content_type=content_type)
+        if status != 202:
+            raise RuntimeError(f"/process_video returned {status}: {response[:200]!r}")
+        job_id = json.loads(response)["job_id"]
+        while True:
+            time.sleep(0.05)
+            status, response = self.client.request("GET", f"/jobs/{job_id}")
+            job = json.loads(response)
+            if job.get("status") in ("succeeded", "failed", "cancelled"):
+                break
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"job {job_id} {job['status']}: {job.get('error')}")
+        self.client.request("GET", f"/jobs/{job_id}/result")
+
+
+SCENARIOS = ("add_embedding", "search", "run_identification", "run_generation",
+             "get_video_timestamp", "process_video")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))]
+
+
+def run_scenario(fn, num_requests, concurrency):
+    """Issue num_requests calls of fn(i) with `concurrency` in flight. Returns the scenario's report."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(num_requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None,
+    }
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:9.1f}" if seconds is not None else f"{'-':>9s}"
+
+
+def print_report(results, baseline=None):
+    print(f"{'scenario':20s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}  errors")
+    for name, result in results.items():
+        if result.get("skipped"):
+            print(f"{name:20s} skipped: {result['skipped']}")
+            continue
+        print(f"{name:20s} {result['throughput']:8.2f} {format_ms(result['p50'])} {format_ms(result['p95'])} "
+              f"{format_ms(result['p99'])} {format_ms(result['max'])}  {result['errors']}/{result['requests']}")
+        if result["first_error"]:
+            print(f"{'':20s} first error: {result['first_error'][:160]}")
+        old = (baseline or {}).get(name)
+        if old and not old.get("skipped"):
+            changes = []
+            for key in ("throughput", "p50", "p95", "p99"):
+                if old.get(key) and result.get(key) is not None:
+                    changes.append(f"{key} {100 * (result[key] / old[key] - 1):+.1f}%")
+            print(f"{'':20s} vs baseline: {', '.join(changes)}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class WordEncoding:
+    """
+    Offline stand-in for a tiktoken encoding: one token per word, with stable
+    integer ids, so token-id embedding inputs still hash like the text would.
+    """
+
+    def __init__(self):
+        self._words = {}
+
+    def encode(self, text, **kwargs):
+        tokens = []
+        for word in text.split():
+            token = zlib.crc32(word.encode("utf-8"))
+            self._words[token] = word
+            tokens.append(token)
+        return tokens
+
+    def decode(self, tokens):
+        return " ".join(self._words.get(token, "") for token in tokens)
+
+
+def tiktoken_available():
+    """tiktoken downloads its vocabularies on first use; offline they may not be cached."""
+    try:
+        import tiktoken
+        tiktoken.encoding_for_model("gpt-4o")
+        tiktoken.encoding_for_model("text-embedding-3-small")
+        return True
+    except Exception:
+        return False
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline load test of the omnis API.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"any of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--video-requests", type=int, default=4, help="requests for process_video")
+    parser.add_argument("--corpus", type=int, default=2000, help="chunks stored before the run")
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--distinct-questions", type=int, default=50,
+                        help="questions are drawn from this many, so repeats can hit the caches")
+    parser.add_argument("--transcript-minutes", type=float, default=30)
+    parser.add_argument("--audio-seconds", type=float, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.15)
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="seconds to the first token")
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--whisper-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="print changes against a report written with --json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            sys.exit(f"Unknown scenario {name!r}; choose from: {', '.join(SCENARIOS)}")
+    scenarios = args.scenarios or list(SCENARIOS)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    upload_dir = tempfile.mkdtemp(prefix="omnis-load-")
+    fake_openai = FakeOpenAIServer(
+        embedding_latency=args.embedding_latency, chat_latency=args.chat_latency,
+        token_interval=args.token_interval, num_tokens=args.completion_tokens,
+        whisper_latency=args.whisper_latency)
+    with fake_openai:
+        # Every OpenAI client the app creates (openai SDK and langchain) goes to the fake server
+        os.environ["OPENAI_BASE_URL"] = os.environ["OPENAI_API_BASE"] = fake_openai.base_url
+        os.environ["OPENAI_API_KEY"] = "sk-load-test"
+        os.environ["OMNIS_UPLOAD_DIR"] = upload_dir
+
+        import app
+        import backend_database
+        import identification_generation
+        import pdf_ingestion
+        import transcript_cache
+        import video_to_transcript
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        store = InMemoryStore()
+        patches = [
+            # A .env file must not put the real key or endpoint back
+            mock.patch.object(backend_database, "load_dotenv", lambda **kwargs: None),
+            mock.patch.object(identification_generation, "load_dotenv", lambda **kwargs: None),
+            mock.patch.object(app, "add_embeddings", store.add_embeddings),
+            mock.patch.object(app, "add_embeddings_batch", store.add_embeddings_batch),
+            mock.patch.object(app, "search_files", store.search_files),
+            mock.patch.object(pdf_ingestion, "add_embeddings_batch", store.add_embeddings_batch),
+            # Clients are created on first use, against the fake server
+            mock.patch.object(identification_generation, "_client", None),
+            mock.patch.object(backend_database, "_embeddings_model", None),
+            mock.patch.object(video_to_transcript, "_client", None),
+            mock.patch.object(transcript_cache.transcript_cache, "cache_dir", os.path.join(upload_dir, "transcripts")),
+        ]
+        if not tiktoken_available():
+            import tiktoken
+            print("tiktoken vocabularies unavailable offline: counting tokens by word")
+            encoding = WordEncoding()
+            patches += [
+                mock.patch.object(tiktoken, "encoding_for_model", lambda model_name: encoding),
+                mock.patch.object(tiktoken, "get_encoding", lambda encoding_name: encoding),
+            ]
+        if "process_video" in scenarios and shutil.which("ffmpeg") is None:
+            scenarios = [name for name in scenarios if name != "process_video"]
+            skipped = {"process_video": {"skipped": "ffmpeg not found"}}
+        else:
+            skipped = {}
+
+        for patch in patches:
+            patch.start()
+
+        class QuietRequestHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server("127.0.0.1", 0, app.app, threaded=True, request_handler=QuietRequestHandler)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            # Measure a warmed-up worker (see app.warm_up; there is no IRIS to connect to here)
+            identification_generation.setup_openai_key()
+            backend_database.get_embeddings_model()
+            video_to_transcript.get_whisper_client()
+            plan = Scenarios(LoadClient(f"http://127.0.0.1:{server.server_port}"), args)
+            start = time.perf_counter()
+            plan.seed(store)
+            print(f"load test: corpus {args.corpus} chunks x {args.chunk_words} words "
+                  f"(seeded in {time.perf_counter() - start:.1f}s), concurrency {args.concurrency}, "
+                  f"commit {git_commit() or 'unknown'}")
+            results = {}
+            for name in SCENARIOS:
+                if name in skipped:
+                    results[name] = skipped[name]
+                elif name in scenarios:
+                    num_requests = args.video_requests if name == "process_video" else args.requests
+                    results[name] = run_scenario(getattr(plan, name), num_requests, args.concurrency)
+        finally:
+            server.shutdown()
+            for patch in reversed(patches):
+                patch.stop()
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    print_report(results, baseline)
+    print(f"OpenAI calls: {dict(sorted(fake_openai.calls.items()))}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": git_commit(), "config": vars(args), "results": results}, f, indent=2)
+        print(f"report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# metrics.py
+#
+# Request and per-stage latency metrics in the Prometheus text format, with
+# optional structured logs for slow requests. No client library is needed:
+# counters and histograms are kept in process and rendered on /metrics.
+#
+# install(app) adds request middleware to a Flask app. span(stage) times a
+# block (an embedding call, an IRIS query, an LLM completion...) and labels it
+# with the endpoint and user tier of the request it runs under, which threads
+# started through concurrency.bounded_map inherit.
+
+import os
+import json
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cached lookup to a long transcription
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Requests slower than this are logged with their spans as one JSON line (unset = off)
+SLOW_REQUEST_SECONDS = float(os.getenv("OMNIS_SLOW_REQUEST_SECONDS", "0")) or None
+# Tier label values accepted from the X-User-Tier header; anything else is "default"
+USER_TIERS = frozenset(tier.strip() for tier in os.getenv("OMNIS_USER_TIERS", "free,pro").split(",") if tier.strip())
+# Label values for work that runs outside any request
+NO_ENDPOINT = "background"
+DEFAULT_TIER = "default"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = format_labels(self.labels, label_values, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "omnis_request_duration_seconds", "Time from request start to the end of the response body.",
+    ("endpoint", "method", "status", "tier"))
+REQUESTS = Counter(
+    "omnis_requests_total", "Requests served.", ("endpoint", "method", "status", "tier"))
+STAGE_LATENCY = Histogram(
+    "omnis_stage_duration_seconds", "Time spent in one stage (embedding, IRIS query, LLM call...).",
+    ("endpoint", "tier", "stage"))
+STAGE_ERRORS = Counter(
+    "omnis_stage_errors_total", "Stages that raised.", ("endpoint", "tier", "stage"))
+SLOW_REQUESTS = Counter(
+    "omnis_slow_requests_total", "Requests slower than OMNIS_SLOW_REQUEST_SECONDS.", ("endpoint", "tier"))
+STARTUP_SECONDS = Gauge(
+    "omnis_startup_seconds", "Seconds spent importing the app (phase=import) and warming it up (phase=warm_up).",
+    ("phase",))
+REGISTRY = [REQUEST_LATENCY, REQUESTS, STAGE_LATENCY, STAGE_ERRORS, SLOW_REQUESTS, STARTUP_SECONDS]
+
+
+class RequestContext:
+    """One request (or background job) being timed: its labels and, for slow-request logs, its spans."""
+
+    def __init__(self, endpoint, tier):
+        self.endpoint = endpoint
+        self.tier = tier
+        self.start = time.perf_counter()
+        self.spans = []  # (stage, start offset, duration, error), appended from any thread
+
+
+_current = contextvars.ContextVar("omnis_request", default=None)
+
+
+def current_labels():
+    context = _current.get()
+    return (context.endpoint, context.tier) if context is not None else (NO_ENDPOINT, DEFAULT_TIER)
+
+
+def record_stage(stage, duration, start=None, error=None):
+    """Record a stage of the current request; also used for work timed elsewhere (e.g. a streamed completion)."""
+    context = _current.get()
+    endpoint, tier = current_labels()
+    STAGE_LATENCY.observe(duration, endpoint, tier, stage)
+    if error is not None:
+        STAGE_ERRORS.inc(endpoint, tier, stage)
+    if context is not None and SLOW_REQUEST_SECONDS is not None:
+        start = time.perf_counter() - duration if start is None else start
+        context.spans.append((stage, start - context.start, duration, error))
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one stage of the current request (or of background work)."""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, start, error)
+
+
+@contextmanager
+def background(name):
+    """
+    Time a unit of work that outlives its request (a background job) like a
+    request of its own, labelled `name` and the submitting request's tier.
+    Set .status on the yielded context to label the outcome.
+    """
+    context = RequestContext(name, current_labels()[1])
+    context.status = "ok"
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        finish_request(context, "JOB", context.status)
+
+
+def stream(body):
+    """
+    Iterate a streamed response body as part of the request that returned it.
+    Flask tears the request down (resetting the current request here) before
+    the server pulls the body, so each step runs in the view's context.
+    """
+    context = contextvars.copy_context()
+    iterator = iter(body)
+
+    def steps():
+        try:
+            while True:
+                try:
+                    chunk = context.run(next, iterator)
+                except StopIteration:
+                    return
+                yield chunk
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                context.run(close)
+
+    return steps()
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorate
+
+
+def request_tier(headers):
+    tier = headers.get("X-User-Tier", "")
+    return tier if tier in USER_TIERS else DEFAULT_TIER
+
+
+def finish_request(context, method, status):
+    duration = time.perf_counter() - context.start
+    REQUEST_LATENCY.observe(duration, context.endpoint, method, status, context.tier)
+    REQUESTS.inc(context.endpoint, method, status, context.tier)
+    if SLOW_REQUEST_SECONDS is not None and duration >= SLOW_REQUEST_SECONDS:
+        SLOW_REQUESTS.inc(context.endpoint, context.tier)
+        print(json.dumps({
+            "event": "slow_request",
+            "endpoint": context.endpoint,
+            "method": method,
+            "status": status,
+            "tier": context.tier,
+            "duration": round(duration, 4),
+            "spans": [{"stage": stage, "start": round(offset, 4), "duration": round(length, 4), "error": error}
+                      for stage, offset, length, error in sorted(context.spans, key=lambda s: s[1])],
+        }))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def install(app):
+    """Time every request of a Flask app, including streamed bodies, and serve /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request():
+        # Unmatched URLs share one label so 404 scans can't create unbounded series
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.metrics_context = RequestContext(endpoint, request_tier(request.headers))
+        g.metrics_token = _current.set(g.metrics_context)
+
+    @app.after_request
+    def finish(response):
+        context = g.pop("metrics_context", None)
+        if context is not None:
+            # Streamed responses are still running here; count them when the body is closed
+            method, status = request.method, str(response.status_code)
+            response.call_on_close(lambda: finish_request(context, method, status))
+        return response
+
+    @app.teardown_request
+    def reset(_error=None):
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            _current.reset(token)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
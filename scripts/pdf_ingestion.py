@@ -0,0 +1,181 @@
+# pdf_ingestion.py
+#
+# Server-side PDF ingestion: pages are extracted in parallel on a process pool
+# (text extraction is CPU-bound), streamed in page order into token-bounded
+# chunks, and the chunks are embedded and stored in batches as they are
+# produced. Only a window of pages and two batches of chunks (one filling, one
+# being embedded) are held in memory at a time, however large the PDF.
+
+import os
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from backend_database import add_embeddings_batch, EMBEDDING_MODEL
+from identification_generation import clean_text
+
+# Extraction processes; pages are handed out PAGES_PER_TASK at a time
+PDF_WORKERS = int(os.getenv("OMNIS_PDF_WORKERS", str(os.cpu_count() or 2)))
+PAGES_PER_TASK = 8
+# Tasks submitted ahead of the one being consumed, per worker
+TASKS_IN_FLIGHT_PER_WORKER = 2
+# Chunk size in embedding-model tokens (the browser used 1000 words, about 1300 tokens)
+CHUNK_TOKENS = int(os.getenv("OMNIS_PDF_CHUNK_TOKENS", "1000"))
+# Chunks embedded and inserted per add_embeddings_batch call
+INGEST_BATCH_SIZE = int(os.getenv("OMNIS_PDF_BATCH_SIZE", "64"))
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                import tiktoken
+                _tokenizer = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    return _tokenizer
+
+
+def open_pdf(pdf_path):
+    from PyPDF2 import PdfReader
+    return PdfReader(pdf_path)
+
+
+def count_pages(pdf_path):
+    return len(open_pdf(pdf_path).pages)
+
+
+# The reader a worker process opened last, so its later tasks on the same file don't re-parse it
+_worker_reader = (None, None)
+
+
+def extract_page_range(args):
+    """Worker: extract pages [start, end) of the PDF. Returns [(page_number, text)], 1-based."""
+    global _worker_reader
+    pdf_path, start, end = args
+    if _worker_reader[0] != pdf_path:
+        _worker_reader = (pdf_path, open_pdf(pdf_path))
+    reader = _worker_reader[1]
+    return [(number + 1, reader.pages[number].extract_text() or "") for number in range(start, end)]
+
+
+def extract_pages(pdf_path, num_pages=None, max_workers=PDF_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """
+    Yield (page_number, text) in page order, extracting on a process pool.
+    Only a bounded number of tasks run ahead of the consumer.
+    """
+    if num_pages is None:
+        num_pages = count_pages(pdf_path)
+    tasks = [(pdf_path, start, min(start + pages_per_task, num_pages))
+             for start in range(0, num_pages, pages_per_task)]
+    if max_workers <= 1 or len(tasks) <= 1:
+        reader = open_pdf(pdf_path)
+        for number in range(num_pages):
+            yield number + 1, reader.pages[number].extract_text() or ""
+        return
+
+    window = max_workers * TASKS_IN_FLIGHT_PER_WORKER
+    # Never fork: the app is multithreaded, and a forked child can inherit locks held by other threads
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    executor = ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                                   mp_context=multiprocessing.get_context(start_method))
+    try:
+        pending = [executor.submit(extract_page_range, task) for task in tasks[:window]]
+        next_task = len(pending)
+        while pending:
+            pages = pending.pop(0).result()
+            if next_task < len(tasks):
+                pending.append(executor.submit(extract_page_range, tasks[next_task]))
+                next_task += 1
+            yield from pages
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def chunk_pages(pages, max_tokens=CHUNK_TOKENS):
+    """
+    Stream (page_number, text) pages into chunks of at most max_tokens tokens,
+    cut at word boundaries. Yields (text, first_page, last_page).
+    """
+    tokenizer = get_tokenizer()
+    buffer = ""
+    first_page = None
+    for page_number, text in pages:
+        text = clean_text(text)
+        if not text:
+            continue
+        buffer = f"{buffer} {text}" if buffer else text
+        if first_page is None:
+            first_page = page_number
+        while True:
+            tokens = tokenizer.encode(buffer)
+            if len(tokens) <= max_tokens:
+                break
+            cut = len(tokenizer.decode(tokens[:max_tokens]))
+            space = buffer.rfind(" ", 0, cut + 1)
+            if space <= 0:
+                space = cut
+            yield buffer[:space].strip(), first_page, page_number
+            buffer = buffer[space:].strip()
+            first_page = page_number
+    if buffer:
+        yield buffer, first_page, page_number
+
+
+def ingest_pdf(pdf_path, user_name, original_file_url, file_name, class_id=None,
+               progress_callback=None, check_cancelled=None,
+               batch_size=INGEST_BATCH_SIZE, max_workers=PDF_WORKERS):
+    """
+    Extract, chunk, embed and store a PDF. Each chunk's chunk_url is the
+    original file URL with a #page=<first page> fragment so it opens at the
+    right place. One batch is embedded and stored in the background while the
+    next is being extracted. progress_callback(pages_stored, total_pages) is
+    called as batches are stored. Returns the page count and per-status chunk counts.
+    """
+    total_pages = count_pages(pdf_path)
+    counts = {}
+
+    def store(batch, pages_in_batch):
+        result = add_embeddings_batch(batch, user_name)
+        if result["status"] != "success":
+            raise RuntimeError(result["message"])
+        for status, count in result["counts"].items():
+            counts[status] = counts.get(status, 0) + count
+        if progress_callback is not None:
+            progress_callback(pages_in_batch, total_pages)
+
+    pages = extract_pages(pdf_path, total_pages, max_workers=max_workers)
+    writer = ThreadPoolExecutor(max_workers=1)
+    in_flight = None
+    try:
+        batch = []
+        for idx, (text, first_page, last_page) in enumerate(chunk_pages(pages)):
+            if check_cancelled is not None:
+                check_cancelled()
+            batch.append({
+                "chunk_url": f"{original_file_url}#page={first_page}&chunk={idx}",
+                "chunk_text": text,
+                "original_file_url": original_file_url,
+                "file_type": "text",
+                "file_name": file_name,
+                "class_id": class_id,
+            })
+            if len(batch) >= batch_size:
+                # At most one batch waits on the embedding API while the next one fills
+                if in_flight is not None:
+                    in_flight.result()
+                in_flight = writer.submit(contextvars.copy_context().run, store, batch, last_page)
+                batch = []
+        if in_flight is not None:
+            in_flight.result()
+        if batch:
+            store(batch, total_pages)
+        elif progress_callback is not None:
+            progress_callback(total_pages, total_pages)
+    finally:
+        writer.shutdown(wait=True)
+        pages.close()
+    return {"pages": total_pages, "chunks": sum(counts.values()), "counts": counts}
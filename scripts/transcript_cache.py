@@ -0,0 +1,122 @@
+# transcript_cache.py
+#
+# On-disk checkpoints of per-segment transcriptions, keyed by a hash of the
+# audio file and the segmentation settings. A job that dies halfway resumes
+# from the segments already on disk, and re-uploading the same lecture is
+# answered from the cache without calling Whisper at all.
+#
+# Each key is one JSON-lines file: a line per finished segment, then a final
+# {"complete": ...} line once every segment is in.
+
+import os
+import json
+import hashlib
+import threading
+
+
+def audio_fingerprint(filepath, params):
+    """sha256 of the file contents plus the settings that determine how it is segmented."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """Per-segment transcription checkpoints, bounded to max_bytes with LRU eviction."""
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_use = set()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jsonl")
+
+    def load(self, key):
+        """
+        Return (segments, complete) for key, where segments maps segment index
+        to (start_ms, end_ms, text). Marks the entry as recently used.
+        """
+        path = self._path(key)
+        segments = {}
+        complete = False
+        if not os.path.exists(path):
+            return segments, complete
+        good_bytes = 0
+        torn = False
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    # A line without its newline was cut short too, even if it parses
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated line")
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash; everything before it is still good
+                    torn = True
+                    break
+                good_bytes += len(line)
+                if "complete" in record:
+                    complete = True
+                else:
+                    segments[record["index"]] = (record["start"], record["end"], record["text"])
+        if torn:
+            # Drop the torn tail, or the next append would continue it and every
+            # record written after it would be unreadable
+            with self._lock:
+                os.truncate(path, good_bytes)
+        os.utime(path)
+        return segments, complete
+
+    def begin(self, key):
+        """Pin key so eviction leaves it alone while a job is writing to it."""
+        with self._lock:
+            self._in_use.add(key)
+
+    def end(self, key):
+        with self._lock:
+            self._in_use.discard(key)
+        self.evict()
+
+    def append(self, key, index, start_ms, end_ms, text):
+        record = json.dumps({"index": index, "start": start_ms, "end": end_ms, "text": text})
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._path(key), "a", encoding="utf-8") as f:
+                f.write(record + "\n")
+
+    def mark_complete(self, key, num_segments):
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._path(key), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"complete": True, "segments": num_segments}) + "\n")
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".jsonl"):
+                    continue
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".jsonl")]))
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if key in self._in_use:
+                    continue
+                os.remove(self._path(key))
+                total -= size
+
+
+transcript_cache = TranscriptCache(
+    os.getenv("OMNIS_TRANSCRIPT_CACHE_DIR", "transcript_cache"),
+    max_bytes=int(os.getenv("OMNIS_TRANSCRIPT_CACHE_BYTES", str(500 * 1024 * 1024))),
+)
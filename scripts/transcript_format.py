@@ -0,0 +1,138 @@
+# transcript_format.py
+#
+# Structured transcript representation. A transcript is three parallel
+# columns (start_ms, end_ms, and offsets into one text buffer) instead of a
+# "MM:SS - MM:SS: text" string that every consumer re-parses with its own regex.
+#
+# The legacy string format is still what gets stored with video chunks, so
+# parse_legacy() reads it in a single left-to-right pass, and to_legacy()
+# writes it (with H:MM:SS for anything past the first hour).
+
+import re
+import json
+from array import array
+
+from metrics import timed
+
+# One segment header: "MM:SS - MM:SS: " (minutes may exceed 99) or "H:MM:SS - H:MM:SS: ".
+# The lookbehind keeps the scanner from trying a match inside words like "mp3".
+_HEADER = re.compile(r'(?<![\w:])(\d+(?::\d\d){1,2})\s*-\s*(\d+(?::\d\d){1,2}):\s*')
+
+
+def format_timestamp(ms):
+    """MM:SS below an hour, H:MM:SS from there on."""
+    hours, rest = divmod(int(ms) // 1000, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes:02}:{seconds:02}"
+
+
+def parse_timestamp(value):
+    """Inverse of format_timestamp; also accepts MM:SS with more than 99 minutes."""
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds * 1000
+
+
+class Transcript:
+    """
+    Timestamped transcript segments stored column-wise.
+
+    Segment i spans start_ms[i]..end_ms[i] and its text is
+    text[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, start_ms=(), end_ms=(), texts=()):
+        self.start_ms = array("q", start_ms)
+        self.end_ms = array("q", end_ms)
+        self.offsets = array("q", [0])
+        parts = []
+        position = 0
+        for text in texts:
+            parts.append(text)
+            position += len(text)
+            self.offsets.append(position)
+        self.text = "".join(parts)
+        if not len(self.start_ms) == len(self.end_ms) == len(self.offsets) - 1:
+            raise ValueError("start_ms, end_ms and texts must have the same length")
+
+    def __len__(self):
+        return len(self.start_ms)
+
+    def text_at(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+    def texts(self):
+        return [self.text_at(i) for i in range(len(self))]
+
+    def segments(self):
+        """Yield (start_ms, end_ms, text) per segment."""
+        for i in range(len(self)):
+            yield self.start_ms[i], self.end_ms[i], self.text_at(i)
+
+    def plain_text(self, separator="\n"):
+        """The spoken text without timestamps."""
+        return separator.join(self.texts())
+
+    def to_legacy(self):
+        """The "MM:SS - MM:SS: text" string format, one segment per line."""
+        return "".join(f"{format_timestamp(start)} - {format_timestamp(end)}: {text}\n"
+                       for start, end, text in self.segments())
+
+    def to_json(self):
+        return json.dumps({
+            "version": 1,
+            "start_ms": self.start_ms.tolist(),
+            "end_ms": self.end_ms.tolist(),
+            "offsets": self.offsets.tolist(),
+            "text": self.text,
+        }, separators=(",", ":"))
+
+    @classmethod
+    @timed("transcript_parsing")
+    def from_json(cls, data):
+        if isinstance(data, str):
+            data = json.loads(data)
+        transcript = cls.__new__(cls)
+        transcript.start_ms = array("q", data["start_ms"])
+        transcript.end_ms = array("q", data["end_ms"])
+        transcript.offsets = array("q", data["offsets"])
+        transcript.text = data["text"]
+        if not len(transcript.start_ms) == len(transcript.end_ms) == len(transcript.offsets) - 1:
+            raise ValueError("offsets must have one more entry than there are segments")
+        return transcript
+
+
+@timed("transcript_parsing")
+def parse_legacy(data):
+    """
+    Parse a "MM:SS - MM:SS: text" transcript in one pass. Each segment's text
+    runs from the end of its header to the start of the next header, with
+    surrounding whitespace stripped; anything before the first header is ignored.
+    """
+    start_ms = []
+    end_ms = []
+    texts = []
+    previous = None
+    for match in _HEADER.finditer(data):
+        if previous is not None:
+            texts.append(data[previous.end():match.start()].strip())
+        start_ms.append(parse_timestamp(match.group(1)))
+        end_ms.append(parse_timestamp(match.group(2)))
+        previous = match
+    if previous is not None:
+        texts.append(data[previous.end():].strip())
+    return Transcript(start_ms, end_ms, texts)
+
+
+def load_transcript(data):
+    """Accept a Transcript, its JSON form, or a legacy string."""
+    if isinstance(data, Transcript):
+        return data
+    if isinstance(data, dict):
+        return Transcript.from_json(data)
+    if data.lstrip().startswith("{"):
+        return Transcript.from_json(data)
+    return parse_legacy(data)
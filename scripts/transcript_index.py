@@ -0,0 +1,119 @@
+# transcript_index.py
+#
+# Inverted index over the segments of a timestamped transcript, used to find
+# where in a video an identified answer was said.
+#
+# Each transcript is parsed and tokenized once (when it is ingested, or on
+# first lookup) into token -> segment ids postings plus per-segment token-set
+# sizes. A lookup then only touches the segments that share a token with the
+# answer, instead of re-tokenizing every line and scoring it in Python.
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from identification_generation import tokenize
+from transcript_format import format_timestamp, load_transcript
+
+# Parsed transcripts kept in memory; a multi-hour transcript is a few hundred KB
+MAX_INDEXES = int(os.getenv("OMNIS_TRANSCRIPT_INDEX_SIZE", "256"))
+
+
+class TranscriptIndex:
+    """Token postings and token-set sizes for one transcript's segments."""
+
+    def __init__(self, transcript):
+        """transcript: a transcript_format.Transcript."""
+        self.transcript = transcript
+        self.starts = [start // 1000 for start in transcript.start_ms]
+        postings = {}
+        sizes = np.empty(len(transcript), dtype=np.int32)
+        for segment_id, text in enumerate(transcript.texts()):
+            tokens = tokenize(text)
+            sizes[segment_id] = len(tokens)
+            for token in tokens:
+                postings.setdefault(token, []).append(segment_id)
+        self.sizes = sizes
+        self.postings = {token: np.array(ids, dtype=np.int32) for token, ids in postings.items()}
+
+    @classmethod
+    def from_transcript(cls, transcript):
+        """Build from a legacy "MM:SS - MM:SS: text" string or a structured transcript."""
+        return cls(load_transcript(transcript))
+
+    def __len__(self):
+        return len(self.transcript)
+
+    def score(self, sentence):
+        """
+        Jaccard similarity between the sentence and every segment it shares a
+        token with. Returns (segment_ids, scores); other segments score 0.
+        """
+        tokens = tokenize(sentence)
+        hits = [self.postings[token] for token in tokens if token in self.postings]
+        if not hits:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        segment_ids, overlap = np.unique(np.concatenate(hits), return_counts=True)
+        # |A ∩ B| / |A ∪ B| with |A ∪ B| = |A| + |B| - |A ∩ B|
+        scores = overlap / (len(tokens) + self.sizes[segment_ids] - overlap)
+        return segment_ids, scores
+
+    def best_timestamp(self, sentence):
+        """Start (seconds) of the best-matching segment, or None if nothing overlaps."""
+        segment_ids, scores = self.score(sentence)
+        if not len(scores):
+            return None
+        # argmax takes the first maximum, i.e. the earliest segment on ties
+        return self.starts[segment_ids[np.argmax(scores)]]
+
+    def top_k(self, sentence, k=3):
+        """The k best-matching segments as [{start_time, end_time, start, start_ms, end_ms, score}], best first."""
+        segment_ids, scores = self.score(sentence)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Best score first, earlier segment first on ties
+        top = top[np.lexsort((segment_ids[top], -scores[top]))]
+        candidates = []
+        for i in top:
+            start_ms = self.transcript.start_ms[segment_ids[i]]
+            end_ms = self.transcript.end_ms[segment_ids[i]]
+            candidates.append({
+                "start_time": format_timestamp(start_ms),
+                "end_time": format_timestamp(end_ms),
+                "start": start_ms // 1000,
+                "start_ms": start_ms,
+                "end_ms": end_ms,
+                "score": float(scores[i]),
+            })
+        return candidates
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def transcript_key(transcript):
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+
+
+def get_transcript_index(transcript):
+    """Return the index for a transcript, building and caching it the first time."""
+    key = transcript_key(transcript)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    # Build outside the lock; two threads racing on the same transcript just build it twice
+    index = TranscriptIndex.from_transcript(transcript)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
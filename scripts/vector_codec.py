@@ -0,0 +1,75 @@
+# vector_codec.py
+#
+# How embeddings are represented between OpenAI, Python and IRIS.
+#
+# In Python, vectors are float32 NumPy arrays end to end (as returned by the
+# embedding cache and stored in the in-memory indexes). IRIS's DB-API can only
+# bind a VECTOR through TO_VECTOR(<text>), so the one unavoidable conversion is
+# done once per vector by vector_literal(), which writes float32 precision
+# (about half the characters of str(list_of_doubles), in a quarter of the time).
+#
+# Storage: the IRIS column type is VECTOR_TYPE (DOUBLE by default; FLOAT
+# halves it). The ANN indexes can additionally hold int8 codes (4x smaller
+# than float32) or sign bits (32x smaller), with exact rescoring of the
+# candidates in IRIS.
+
+import os
+
+import numpy as np
+
+# Element type of {user}.vectors.embedding for new tables. Existing tables keep
+# the type they were created with, so change this only for a fresh database.
+VECTOR_TYPES = ("DOUBLE", "FLOAT")
+VECTOR_TYPE = os.getenv("OMNIS_VECTOR_TYPE", "DOUBLE").upper()
+if VECTOR_TYPE not in VECTOR_TYPES:
+    raise ValueError(f"OMNIS_VECTOR_TYPE must be one of {VECTOR_TYPES}, not {VECTOR_TYPE!r}")
+
+QUANTIZATIONS = ("none", "int8", "binary")
+# Quantization of newly built ANN indexes (loaded index files keep their own)
+QUANTIZATION = os.getenv("OMNIS_VECTOR_QUANTIZATION", "none")
+# A quantized index returns this many times more candidates for rescoring
+RESCORE_FACTOR = int(os.getenv("OMNIS_RESCORE_FACTOR", "4"))
+
+
+def as_float32(vectors):
+    """A float32 array view of a vector, a list of vectors, or an array (copies only if needed)."""
+    return np.asarray(vectors, dtype=np.float32)
+
+
+_literal_formats = {}
+
+
+def vector_literal(vector):
+    """The TO_VECTOR text for one vector, at float32 precision."""
+    values = as_float32(vector).ravel().tolist()
+    # One %-format over the whole vector is faster than formatting element by element
+    fmt = _literal_formats.get(len(values))
+    if fmt is None:
+        fmt = _literal_formats[len(values)] = ",".join(["%.7g"] * len(values))
+    return fmt % tuple(values)
+
+
+def quantize(vectors, quantization):
+    """
+    Encode float32 rows. Returns (codes, scales): int8 codes with one float32
+    scale per row, or packed sign bits (scales None). "none" returns the rows.
+    """
+    vectors = as_float32(vectors)
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if quantization == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    return vectors, None
+
+
+def dequantize(codes, scales, quantization, dim):
+    """Approximate float32 rows back from quantize() output."""
+    if quantization == "int8":
+        return codes.astype(np.float32) * scales[:, None]
+    if quantization == "binary":
+        # Signs scaled to unit length, so dot products stay comparable to cosine
+        return (np.unpackbits(codes, axis=1, count=dim).astype(np.float32) * 2 - 1) / np.sqrt(dim)
+    return codes
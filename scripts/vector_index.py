@@ -0,0 +1,425 @@
+# vector_index.py
+#
+# Approximate nearest-neighbour search over a user's chunk embeddings, with one
+# index for the whole library and one per class.
+#
+# An IVF (inverted file) index: vectors are bucketed by their nearest k-means
+# centroid, and a query only scores the vectors in the `nprobe` closest
+# buckets. nprobe is the recall/latency knob: nprobe == nlist is exact search.
+# Until a user has enough vectors to train centroids, searches are exact.
+
+import os
+import json
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+
+import numpy as np
+
+from vector_codec import QUANTIZATION, QUANTIZATIONS, as_float32, quantize, dequantize
+
+INDEX_DIR = os.getenv("OMNIS_INDEX_DIR", "indexes")
+EMBEDDING_DIM = 1536
+
+# Below this many vectors a brute-force scan is already fast; don't bother training
+MIN_TRAIN_SIZE = 2048
+# Retrain centroids once the index has grown this much since the last training
+RETRAIN_GROWTH = 4
+DEFAULT_NPROBE = 8
+# Persist at most this often on the ingestion path (and always at exit)
+SAVE_INTERVAL_SECONDS = 30
+# How often a search compares an index's size with IRIS, to pick up chunks
+# stored by other worker processes or lost in a crash before the last save
+CHECK_INTERVAL_SECONDS = float(os.getenv("OMNIS_INDEX_CHECK_SECONDS", "10"))
+
+
+def kmeans(vectors, k, iterations=10, sample_size=20000, seed=0):
+    """Spherical k-means (dot-product similarity) on a sample of the vectors."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        nonempty = norms > 0
+        centroids[nonempty] = sums[nonempty] / norms[nonempty, None]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over vectors keyed by content hash.
+    Thread-safe; vectors can be added incrementally.
+
+    quantization ("none", "int8" or "binary") is how the vectors are held: as
+    float32, as int8 codes with a per-vector scale, or as sign bits. Scores
+    from a quantized index are approximate; callers rescore its candidates.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, nprobe=DEFAULT_NPROBE, quantization=None):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.quantization = quantization or QUANTIZATION
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {self.quantization!r}; expected one of {QUANTIZATIONS}")
+        self.ids = []
+        self._id_set = set()
+        codes, scales = quantize(np.empty((0, dim), dtype=np.float32), self.quantization)
+        self._codes = codes
+        self._scales = scales
+        self._count = 0
+        self.centroids = None
+        self._lists = []
+        self._trained_size = 0
+        self._lock = threading.RLock()
+        self.dirty = False
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, content_hash):
+        return content_hash in self._id_set
+
+    @property
+    def quantized(self):
+        return self.quantization != "none"
+
+    @property
+    def vectors(self):
+        """All vectors as float32 (approximate for a quantized index)."""
+        return self._rows(slice(0, self._count))
+
+    @property
+    def nbytes(self):
+        """Memory held by the stored vectors."""
+        return self._codes[:self._count].nbytes + (self._scales[:self._count].nbytes if self._scales is not None else 0)
+
+    def _rows(self, rows):
+        return dequantize(self._codes[rows], self._scales[rows] if self._scales is not None else None,
+                          self.quantization, self.dim)
+
+    def add(self, ids, vectors):
+        """Add vectors by id; ids already in the index (e.g. after a rebuild) are skipped."""
+        vectors = as_float32(vectors).reshape(-1, self.dim)
+        with self._lock:
+            keep, seen = [], set()
+            for row, content_hash in enumerate(ids):
+                if content_hash not in self._id_set and content_hash not in seen:
+                    keep.append(row)
+                    seen.add(content_hash)
+            if not keep:
+                return
+            ids = [ids[row] for row in keep]
+            codes, scales = quantize(vectors[keep], self.quantization)
+            needed = self._count + len(codes)
+            if needed > len(self._codes):
+                # Grow geometrically so incremental inserts stay amortised O(1)
+                size = max(needed, 2 * len(self._codes), 1024)
+                grown = np.empty((size,) + self._codes.shape[1:], dtype=self._codes.dtype)
+                grown[:self._count] = self._codes[:self._count]
+                self._codes = grown
+                if self._scales is not None:
+                    grown_scales = np.empty(size, dtype=np.float32)
+                    grown_scales[:self._count] = self._scales[:self._count]
+                    self._scales = grown_scales
+            start = self._count
+            self._codes[start:needed] = codes
+            if self._scales is not None:
+                self._scales[start:needed] = scales
+            self._count = needed
+            self.ids.extend(ids)
+            self._id_set.update(ids)
+            self.dirty = True
+
+            if self.centroids is None:
+                if self._count >= MIN_TRAIN_SIZE:
+                    self.train()
+            elif self._count >= RETRAIN_GROWTH * self._trained_size:
+                self.train()
+            else:
+                self._assign(start, needed)
+
+    def train(self, sample_size=20000, seed=0):
+        """(Re)build centroids and inverted lists from every vector in the index."""
+        with self._lock:
+            nlist = max(1, int(4 * np.sqrt(self._count)))
+            rows = np.arange(self._count)
+            if self._count > sample_size:
+                rows = np.sort(np.random.default_rng(seed).choice(self._count, sample_size, replace=False))
+            self.centroids = kmeans(self._rows(rows), nlist, sample_size=sample_size, seed=seed)
+            self._lists = [[] for _ in range(nlist)]
+            self._assign(0, self._count)
+            self._trained_size = self._count
+            self.dirty = True
+
+    def _assign(self, start, end, block=8192):
+        for block_start in range(start, end, block):
+            block_end = min(block_start + block, end)
+            assignment = np.argmax(self._rows(slice(block_start, block_end)) @ self.centroids.T, axis=1)
+            for row, c in enumerate(assignment, block_start):
+                self._lists[c].append(row)
+
+    def search(self, query, k=3, nprobe=None):
+        """Return [(content_hash, score)] for the k best matches, best first."""
+        query = as_float32(query)
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            if self._count == 0:
+                return []
+            if self.centroids is None or nprobe >= len(self.centroids):
+                candidates = None
+                scores = self.vectors @ query
+            else:
+                probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.fromiter(chain.from_iterable(self._lists[c] for c in probe), dtype=np.int64)
+                scores = self._rows(candidates) @ query
+            ids = self.ids
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(ids[row], float(scores[i])) for row, i in zip(rows, top)]
+
+    def save(self, path):
+        with self._lock:
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                vectors=self._codes[:self._count],
+                scales=self._scales[:self._count] if self._scales is not None else np.empty(0, np.float32),
+                centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim), np.float32),
+                meta=np.frombuffer(json.dumps({
+                    "ids": self.ids,
+                    "trained_size": self._trained_size,
+                    "nprobe": self.nprobe,
+                    "dim": self.dim,
+                    "quantization": self.quantization,
+                }).encode("utf-8"), dtype=np.uint8),
+            )
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            # Files written before quantization existed hold float32 rows
+            quantization = meta.get("quantization", "none")
+            index = cls(dim=meta.get("dim", data["vectors"].shape[1]), nprobe=meta["nprobe"],
+                        quantization=quantization)
+            index._codes = data["vectors"].copy()
+            if quantization == "int8":
+                index._scales = data["scales"].copy()
+            index._count = len(index._codes)
+            index.ids = meta["ids"]
+            index._id_set = set(index.ids)
+            if len(data["centroids"]):
+                index.centroids = data["centroids"].copy()
+                index._lists = [[] for _ in range(len(index.centroids))]
+                index._assign(0, index._count)
+                index._trained_size = meta["trained_size"]
+        return index
+
+
+# ---------------------------------------------------------------------------
+# Per-user indexes
+# ---------------------------------------------------------------------------
+
+_indexes = {}
+_last_saved = {}
+_last_checked = {}
+# Guards the dicts above; loading and building happen under the partition's own lock
+_indexes_lock = threading.Lock()
+_partition_locks = {}
+# Users with an ingest between its IRIS commit and its index update, whose
+# indexes are briefly behind IRIS without being stale
+_ingests = {}
+
+
+def partition_key(user_name, class_id=None):
+    """Each class is its own partition; the user-wide index covers every chunk."""
+    return user_name if class_id is None else f"{user_name}.{class_id}"
+
+
+def index_path(key):
+    return os.path.join(INDEX_DIR, f"{key}.ivf.npz")
+
+
+def parse_vector(value):
+    """IRIS returns VECTOR columns as comma-separated text."""
+    if isinstance(value, str):
+        return np.fromstring(value.strip("[]"), sep=",", dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def build_user_index(cursor, user_name, class_id=None):
+    """
+    Build a user's (or one class's) index from the embeddings stored in IRIS.
+    Chunks without a class belong to the whole library, so every class index has them.
+    """
+    if class_id is None:
+        cursor.execute(f"SELECT content_hash, embedding FROM {user_name}.vectors")
+    else:
+        cursor.execute(f"""
+            SELECT v.content_hash, v.embedding FROM {user_name}.vectors v
+             WHERE v.content_hash IN (SELECT c.content_hash FROM {user_name}.classes c
+                                       WHERE c.class_id = ? OR c.class_id IS NULL)
+        """, [class_id])
+    index = IVFIndex()
+    rows = cursor.fetchall()
+    if rows:
+        index.add([row[0] for row in rows], np.stack([parse_vector(row[1]) for row in rows]))
+    return index
+
+
+def source_size(cursor, user_name, class_id=None):
+    """How many vectors IRIS holds for a user's (or one class's) index."""
+    if class_id is None:
+        cursor.execute(f"SELECT COUNT(*) FROM {user_name}.vectors")
+    else:
+        cursor.execute(f"""
+            SELECT COUNT(DISTINCT content_hash) FROM {user_name}.classes WHERE class_id = ? OR class_id IS NULL
+        """, [class_id])
+    return cursor.fetchone()[0]
+
+
+def partition_lock(key):
+    with _indexes_lock:
+        return _partition_locks.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def ingesting(user_name):
+    """Mark a local ingest of user_name, from before its IRIS commit until its indexes are updated."""
+    with _indexes_lock:
+        _ingests[user_name] = _ingests.get(user_name, 0) + 1
+    try:
+        yield
+    finally:
+        with _indexes_lock:
+            _ingests[user_name] -= 1
+            if not _ingests[user_name]:
+                del _ingests[user_name]
+
+
+def ingesting_users():
+    return set(_ingests)
+
+
+def check_due(key, user_name):
+    return (time.monotonic() - _last_checked.get(key, float("-inf")) >= CHECK_INTERVAL_SECONDS
+            and user_name not in _ingests)
+
+
+def get_user_index(user_name, cursor=None, class_id=None):
+    """
+    Return the in-memory index for a user or one of their classes, loading it
+    from disk or building it from IRIS (when a cursor is given) the first
+    time. None if unavailable.
+
+    With a cursor, an index whose size no longer matches IRIS (at most every
+    CHECK_INTERVAL_SECONDS, and not while this process is ingesting for the
+    user) is rebuilt. Indexes are built outside the shared lock and swapped
+    in, so other partitions can be searched and updated meanwhile.
+    """
+    key = partition_key(user_name, class_id)
+    index = _indexes.get(key)
+    if index is not None and (cursor is None or not check_due(key, user_name)):
+        return index
+
+    built = False
+    with partition_lock(key):
+        index = _indexes.get(key)
+        if index is None:
+            path = index_path(key)
+            if os.path.exists(path):
+                index = IVFIndex.load(path)
+            elif cursor is not None:
+                index = build_user_index(cursor, user_name, class_id)
+                built = True
+            else:
+                return None
+        if cursor is not None and not built and check_due(key, user_name):
+            _last_checked[key] = time.monotonic()
+            if len(index) != source_size(cursor, user_name, class_id):
+                print(f"Vector index for {key} is out of date, rebuilding it from IRIS")
+                index = build_user_index(cursor, user_name, class_id)
+                built = True
+        with _indexes_lock:
+            if _indexes.get(key) is not index:
+                _indexes[key] = index
+                _last_saved[key] = time.monotonic()
+            if built:
+                _last_checked[key] = time.monotonic()
+    if built:
+        # Only a fresh build is written right away; incremental adds are saved on the throttled path
+        index.dirty = True
+        save_user_index(key, force=True)
+    return index
+
+
+def add_to_user_index(user_name, ids, vectors, class_id=None):
+    """
+    Incremental insert from the ingestion path. Only touches indexes that have
+    already been built; a partition's first ANN search builds it from IRIS.
+    """
+    index = get_user_index(user_name, class_id=class_id)
+    if index is None:
+        return
+    index.add(ids, vectors)
+    save_user_index(partition_key(user_name, class_id))
+
+
+def discard_user_index(user_name, class_id=None):
+    """Drop an index (in memory and on disk) so the next search rebuilds it from IRIS."""
+    key = partition_key(user_name, class_id)
+    with _indexes_lock:
+        _indexes.pop(key, None)
+        _last_saved.pop(key, None)
+        _last_checked.pop(key, None)
+        if os.path.exists(index_path(key)):
+            os.remove(index_path(key))
+
+
+def discard_class_indexes(user_name):
+    """Drop every class index of a user, e.g. after library-wide chunks were added."""
+    prefix = partition_key(user_name, "")
+    with _indexes_lock:
+        keys = {key for key in _indexes if key.startswith(prefix)}
+        if os.path.isdir(INDEX_DIR):
+            keys |= {name[:-len(".ivf.npz")] for name in os.listdir(INDEX_DIR)
+                     if name.startswith(prefix) and name.endswith(".ivf.npz")}
+        for key in keys:
+            _indexes.pop(key, None)
+            _last_saved.pop(key, None)
+            _last_checked.pop(key, None)
+            if os.path.exists(index_path(key)):
+                os.remove(index_path(key))
+
+
+def save_user_index(key, force=False):
+    index = _indexes.get(key)
+    if index is None or not index.dirty:
+        return
+    if not force and time.monotonic() - _last_saved.get(key, 0) < SAVE_INTERVAL_SECONDS:
+        return
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    index.save(index_path(key))
+    _last_saved[key] = time.monotonic()
+
+
+@atexit.register
+def save_all_indexes():
+    for key in list(_indexes):
+        try:
+            save_user_index(key, force=True)
+        except Exception as e:
+            print(f"Could not save vector index for {key}: {e}")
@@ -1,129 +1,430 @@
 import os 
 import time
-import tempfile
-import multiprocessing as mp
-from openai import OpenAI
-from tqdm import tqdm
-from pydub import AudioSegment 
+import subprocess
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 from pathlib import Path
 from dotenv import load_dotenv
+from concurrency import retry_with_backoff
+from transcript_cache import transcript_cache, audio_fingerprint
+from transcript_format import Transcript
+from metrics import span
 
 load_dotenv()
+
+# Audio is decoded once to 16 kHz mono 16-bit PCM (what Whisper uses internally)
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+BYTES_PER_MS = SAMPLE_RATE * SAMPLE_WIDTH // 1000
+# How much PCM to pull from ffmpeg per read
+READ_BLOCK_MS = 1000
+# Whisper calls in flight at once. Transcription is network-bound, so this is
+# limited by the API rate limit rather than by CPU count.
+MAX_IN_FLIGHT = int(os.getenv("OMNIS_WHISPER_CONCURRENCY", "8"))
+# Text recorded for a segment that still fails after all retries
+FAILED_SEGMENT_PLACEHOLDER = "[inaudible]"
+
+# "silence" packs speech between pauses into ~TARGET_SEGMENT_MS segments;
+# "fixed" cuts every FIXED_SEGMENT_MS regardless of content.
+SEGMENTATION = os.getenv("OMNIS_SEGMENTATION", "silence")
+FIXED_SEGMENT_MS = 6000
+TARGET_SEGMENT_MS = 45000
+MAX_SEGMENT_MS = 60000
+# Silence detection works on short frames; anything quieter than the threshold is silence
+FRAME_MS = 30
+SILENCE_THRESHOLD_DBFS = -40.0
+# A pause at least this long is a good place to cut
+MIN_PAUSE_MS = 300
+# Silences longer than this end the current segment and are not sent to Whisper
+MAX_SILENCE_MS = 2000
+# Segments shorter than this are dropped (Whisper rejects < 0.1 s of audio)
+MIN_SEGMENT_MS = 100
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_whisper_client():
+    """One OpenAI client (and connection pool) shared by every transcription thread."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries are handled by retry_with_backoff so they can be jittered
+                from openai import OpenAI
+                _client = OpenAI(api_key=os.getenv("OPENAI_APIKEY"), max_retries=0)
+    return _client
+
+
+def read_pcm_blocks(filepath, block_ms=READ_BLOCK_MS):
+    """
+    Decode the audio track with ffmpeg and yield raw PCM a block at a time,
+    so the whole soundtrack is never held in memory.
+    """
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", str(filepath),
+         "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    block_size = block_ms * BYTES_PER_MS
+    try:
+        while True:
+            block = process.stdout.read(block_size)
+            if not block:
+                break
+            yield block
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {filepath}: {process.stderr.read().decode(errors='replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def probe_duration_ms(filepath):
+    """Duration of the media file in ms according to ffprobe, or None if unknown."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(filepath)],
+            capture_output=True, text=True, check=True,
+        )
+        return int(float(result.stdout.strip()) * 1000)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def encode_segment(pcm, fmt="mp3", bitrate="32k"):
+    """Compress one PCM segment in memory (~10x smaller than WAV)."""
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error",
+         "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+         "-b:a", bitrate, "-f", fmt, "pipe:1"],
+        input=pcm,
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def fixed_segments(pcm_blocks, chunk_length_ms=FIXED_SEGMENT_MS):
+    """Yield (start_ms, end_ms, pcm) every chunk_length_ms of audio."""
+    segment_size = chunk_length_ms * BYTES_PER_MS
+    buffer = bytearray()
+    start = 0
+    for block in pcm_blocks:
+        buffer.extend(block)
+        while len(buffer) >= segment_size:
+            yield start, start + chunk_length_ms, bytes(buffer[:segment_size])
+            del buffer[:segment_size]
+            start += chunk_length_ms
+
+    tail_ms = len(buffer) // BYTES_PER_MS
+    if tail_ms >= MIN_SEGMENT_MS:
+        yield start, start + tail_ms, bytes(buffer)
+
+
+def frame_levels(pcm):
+    """Loudness of each FRAME_MS frame of 16-bit PCM, in dBFS."""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame_len = SAMPLE_RATE * FRAME_MS // 1000
+    frames = samples[:len(samples) // frame_len * frame_len].reshape(-1, frame_len).astype(np.float32)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+
+def silence_segments(pcm_blocks, target_ms=TARGET_SEGMENT_MS, max_ms=MAX_SEGMENT_MS,
+                     threshold_dbfs=SILENCE_THRESHOLD_DBFS, min_pause_ms=MIN_PAUSE_MS,
+                     max_silence_ms=MAX_SILENCE_MS):
+    """
+    Yield (start_ms, end_ms, pcm) segments cut at pauses in speech.
+
+    Speech accumulates until the segment reaches target_ms and a pause of at
+    least min_pause_ms follows; a segment is force-cut at its last pause (or
+    at max_ms if there was none). Silences longer than max_silence_ms end the
+    segment and are skipped entirely. Offsets are positions in the original
+    audio, so timestamps stay exact even though silence is dropped.
+    """
+    frame_bytes = FRAME_MS * BYTES_PER_MS
+    buffer = bytearray()    # audio of the current segment
+    segment_start = 0       # where buffer[0] sits in the original audio (ms)
+    position = 0            # ms of audio consumed so far
+    silence_run = 0         # ms of consecutive silence at the end of buffer
+    last_pause_end = None   # ms into buffer where the most recent long-enough pause ended
+    pending = bytearray()
+
+    def cut(cut_ms):
+        nonlocal buffer, segment_start, last_pause_end
+        cut_bytes = cut_ms * BYTES_PER_MS
+        segment = bytes(buffer[:cut_bytes])
+        start = segment_start
+        del buffer[:cut_bytes]
+        segment_start += cut_ms
+        last_pause_end = None
+        if cut_ms >= MIN_SEGMENT_MS:
+            return start, start + cut_ms, segment
+        return None
+
+    for block in pcm_blocks:
+        pending.extend(block)
+        usable = len(pending) // frame_bytes * frame_bytes
+        if not usable:
+            continue
+        levels = frame_levels(bytes(pending[:usable]))
+        for n, level in enumerate(levels):
+            frame = pending[n * frame_bytes:(n + 1) * frame_bytes]
+            position += FRAME_MS
+            if level < threshold_dbfs:
+                if not buffer:
+                    # Leading silence: don't start a segment yet
+                    segment_start = position
+                    continue
+                silence_run += FRAME_MS
+                buffer.extend(frame)
+                buffer_ms = len(buffer) // BYTES_PER_MS
+                if silence_run >= max_silence_ms:
+                    # Long silence: end the segment where the silence began and drop the rest
+                    segment = cut(buffer_ms - silence_run)
+                    if segment:
+                        yield segment
+                    buffer.clear()
+                    segment_start = position
+                    silence_run = 0
+                elif silence_run >= min_pause_ms and buffer_ms - silence_run >= target_ms:
+                    # Keep a little of the pause so the last word isn't clipped
+                    segment = cut(buffer_ms - silence_run // 2)
+                    if segment:
+                        yield segment
+                    buffer.clear()
+                    segment_start = position
+                    silence_run = 0
+            else:
+                if silence_run >= min_pause_ms:
+                    last_pause_end = len(buffer) // BYTES_PER_MS - silence_run // 2
+                silence_run = 0
+                buffer.extend(frame)
+                if len(buffer) // BYTES_PER_MS >= max_ms:
+                    # No natural break before max_ms: cut at the latest pause if it leaves a
+                    # reasonably long segment, otherwise cut right here
+                    use_pause = last_pause_end is not None and last_pause_end >= target_ms // 2
+                    segment = cut(last_pause_end if use_pause else max_ms)
+                    if segment:
+                        yield segment
+        del pending[:usable]
+
+    # Whatever is left (minus trailing silence) is the last segment
+    buffer.extend(pending)
+    buffer_ms = len(buffer) // BYTES_PER_MS
+    if buffer_ms - silence_run >= MIN_SEGMENT_MS:
+        segment = cut(buffer_ms - silence_run)
+        if segment:
+            yield segment
+
+
 class AudioHandler: 
-    def __init__(self, filepath: str | Path): 
+    def __init__(self, filepath: str | Path, max_in_flight: int = MAX_IN_FLIGHT,
+                 segmentation: str = SEGMENTATION, cache=transcript_cache): 
         if isinstance(filepath, Path): 
             filepath = str(filepath)
         self.fp = str(filepath) if isinstance(filepath, Path) else filepath
+        self.max_in_flight = max_in_flight
+        self.segmentation = segmentation
+        self.cache = cache
     
+    def _segmentation_params(self, chunk_length_ms=FIXED_SEGMENT_MS):
+        """Everything that decides where segments fall; part of the cache key."""
+        params = {"model": "whisper-1", "segmentation": self.segmentation, "sample_rate": SAMPLE_RATE}
+        if self.segmentation == "silence":
+            params.update(target_ms=TARGET_SEGMENT_MS, max_ms=MAX_SEGMENT_MS, frame_ms=FRAME_MS,
+                          threshold_dbfs=SILENCE_THRESHOLD_DBFS, min_pause_ms=MIN_PAUSE_MS,
+                          max_silence_ms=MAX_SILENCE_MS)
+        else:
+            params.update(chunk_length_ms=chunk_length_ms)
+        return params
     
-    def _split_audio(self, chunk_length_ms=6000) -> list:
-        print(f"Loading audio file: {self.fp}")
-        audio = AudioSegment.from_file(self.fp)
-        print("done loading")
-
-        chunks = []
-        temp_dir = tempfile.mkdtemp()
-        print(f"Temporary directory created at: {temp_dir}")
-
+    def _split_audio(self, chunk_length_ms=FIXED_SEGMENT_MS, skip=()):
+        """
+        Yield (index, start_ms, end_ms, mp3_bytes) segments as they are cut
+        from the decoded stream. Segments whose index is in skip (already
+        transcribed) are yielded with None instead of being encoded.
+        """
+        print(f"Streaming audio from: {self.fp} ({self.segmentation} segmentation)")
+        pcm_blocks = read_pcm_blocks(self.fp)
+        if self.segmentation == "silence":
+            segments = silence_segments(pcm_blocks)
+        else:
+            segments = fixed_segments(pcm_blocks, chunk_length_ms)
 
-        print("num aydios", len(audio))
-        for i, start in tqdm(enumerate(range(0, len(audio), chunk_length_ms))):
-            end = start + chunk_length_ms
-            chunk = audio[start:end]
-
-            if len(chunk) < 100:  # Check for chunks less than 0.1 second
-                print(f"Skipping chunk {i} as it is too short: {len(chunk)} ms")
-                continue
-
-            chunk_path = os.path.join(temp_dir, f"chunk_{i}.wav")
-            chunk.export(chunk_path, format="wav")
-            chunks.append((i, start, end, chunk_path))
-    
-        print(f"Split audio into {len(chunks)} chunks")
-        return chunks
+        i = 0
+        for start, end, pcm in segments:
+            yield i, start, end, (None if i in skip else encode_segment(pcm))
+            i += 1
+        print(f"Split audio into {i} chunks")
     
     def _transcribe_chunk(self, args: tuple) -> tuple: 
-        chunk_index, chunk_start, chunk_end, chunk_path = args
+        chunk_index, chunk_start, chunk_end, chunk_audio = args
+        client = get_whisper_client()
         try:
-            open_ai_key = os.getenv("OPENAI_APIKEY")
-            client = OpenAI(
-                api_key=open_ai_key,
-            )
-            audio_file = open(chunk_path, "rb")
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1", 
-                file=audio_file
-            )
+            with span("whisper"):
+                transcription = retry_with_backoff(lambda: client.audio.transcriptions.create(
+                    model="whisper-1", 
+                    file=(f"chunk_{chunk_index}.mp3", chunk_audio)
+                ))
             return chunk_index, chunk_start, chunk_end, transcription.text
         except Exception as e:
             print(f"Error processing chunk {chunk_index}: {str(e)}")
-            return chunk_index, ""
+            return chunk_index, chunk_start, chunk_end, FAILED_SEGMENT_PLACEHOLDER
+
+    def _transcribe_segments(self, segments, progress_callback=None, check_cancelled=None,
+                             cached=None, on_result=None):
+        """
+        Transcribe segments on a thread pool as they arrive, with at most
+        max_in_flight calls outstanding. Pulling the next segment only when a
+        slot frees up keeps the splitter from running ahead of transcription.
+
+        progress_callback(done, total) is called as segments finish; total is
+        an estimate (from the audio duration) until splitting is complete.
+        check_cancelled() is called between segments and may raise to stop.
+        cached maps segment index -> (start_ms, end_ms, text) for segments that
+        are already done; on_result(result) is called as each new one finishes.
+        """
+        cached = cached or {}
+        duration_ms = probe_duration_ms(self.fp)
+        results = []
+        cut = 0
+        cut_until_ms = 0
+
+        def report(splitting_done=False):
+            if progress_callback is None:
+                return
+            if splitting_done or not duration_ms or not cut_until_ms:
+                total = cut if splitting_done else None
+            else:
+                total = max(cut, round(cut * duration_ms / cut_until_ms))
+            progress_callback(len(results), total)
+
+        from tqdm import tqdm
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        try:
+            with tqdm(desc="Transcribing chunks") as progress:
+                in_flight = set()
+                for segment in segments:
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    cut += 1
+                    if segment[0] in cached:
+                        results.append((segment[0], *cached[segment[0]]))
+                        progress.update(1)
+                        cut_until_ms = segment[2]
+                        report()
+                        continue
+                    if len(in_flight) >= self.max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        results.extend(future.result() for future in done)
+                        progress.update(len(done))
+                    future = executor.submit(contextvars.copy_context().run, self._transcribe_chunk, segment)
+                    if on_result is not None:
+                        # Checkpoint as soon as the call returns, even if the job is cancelled later
+                        future.add_done_callback(lambda f: f.cancelled() or on_result(f.result()))
+                    in_flight.add(future)
+                    cut_until_ms = segment[2]
+                    report()
+                report(splitting_done=True)
+                for future in in_flight:
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    results.append(future.result())
+                    progress.update(1)
+                    report(splitting_done=True)
+        finally:
+            # On cancellation or error, drop queued calls and stop decoding
+            executor.shutdown(wait=False, cancel_futures=True)
+            if hasattr(segments, "close"):
+                segments.close()
+        return results
+
+    def _transcribe_with_cache(self, progress_callback=None, check_cancelled=None):
+        """
+        Transcribe, reusing checkpointed segments for this exact audio and
+        segmentation. A fully cached file returns without decoding anything.
+        """
+        if self.cache is None:
+            return self._transcribe_segments(self._split_audio(), progress_callback, check_cancelled)
+
+        key = audio_fingerprint(self.fp, self._segmentation_params())
+        cached, complete = self.cache.load(key)
+        if complete:
+            print(f"Transcript found in cache ({len(cached)} chunks)")
+            if progress_callback is not None:
+                progress_callback(len(cached), len(cached))
+            return [(i, *cached[i]) for i in sorted(cached)]
+        if cached:
+            print(f"Resuming transcription: {len(cached)} chunks already done")
+
+        def checkpoint(result):
+            index, start, end, text = result
+            if text != FAILED_SEGMENT_PLACEHOLDER:
+                self.cache.append(key, index, start, end, text)
+
+        self.cache.begin(key)
+        try:
+            results = self._transcribe_segments(
+                self._split_audio(skip=cached), progress_callback, check_cancelled,
+                cached=cached, on_result=checkpoint)
+            # Only a transcript with no failed segments is final; otherwise retry those next time
+            if all(text != FAILED_SEGMENT_PLACEHOLDER for *_, text in results):
+                self.cache.mark_complete(key, len(results))
+            return results
         finally:
-            try:
-                os.remove(chunk_path)
-            except:
-                pass
+            self.cache.end(key)
 
-    def process_audio(self): 
+    def process_audio(self, progress_callback=None, check_cancelled=None): 
         try:
             print("in here")
             start_time = time.time()
             
-            chunks = self._split_audio()
-            process_args = [(i, start, end, path) for i, start, end, path in chunks]
-            num_processes = max(1, mp.cpu_count() - 1)
-
-            print(f"Starting parallel transcription with {num_processes} processes...")
-            with mp.Pool(num_processes) as pool:
-                results = list(tqdm(
-                    pool.imap(self._transcribe_chunk, process_args),
-                    total=len(process_args),
-                    desc="Transcribing chunks"
-                ))
-
-            def format_time(ms):
-                minutes, seconds = divmod(ms // 1000, 60)
-                return f"{minutes:02}:{seconds:02}"
+            # Segments are transcribed as they are cut, so transcription of early
+            # segments overlaps with decoding later ones.
+            print(f"Starting transcription with up to {self.max_in_flight} requests in flight...")
+            with span("transcription"):
+                results = self._transcribe_with_cache(progress_callback, check_cancelled)
+            failed = sum(1 for *_, text in results if text == FAILED_SEGMENT_PLACEHOLDER)
+            if failed:
+                print(f"{failed} of {len(results)} chunks could not be transcribed")
 
-            
             results.sort(key=lambda x: x[0])
-            full_transcript_with_timestamps = ""
-            full_transcript = ""
-            for _, start, end, text in results:
-                #make it in 00:00 format
-                start = format_time(start)
-                end = format_time(end)
-
-                
-
-                full_transcript_with_timestamps += f"{start} - {end}: {text}\n"
-                full_transcript += f"{text}\n"
+            transcript = Transcript(
+                [start for _, start, _, _ in results],
+                [end for _, _, end, _ in results],
+                [text for *_, text in results],
+            )
 
             print("finished transcribing")
-            # print(full_transcript)
             
             print(self.fp)
             raw_fp = self.fp.replace(".mp3", "")
             raw_fp += "_timestamps.mp3"
             output_path_timestamps = Path(raw_fp).with_suffix('.txt')
             with open(output_path_timestamps, "w", encoding="utf-8") as f:
-                f.write(full_transcript_with_timestamps)
+                f.write(transcript.to_legacy())
+
+            # Same transcript in structured form, for consumers that don't want to re-parse
+            self.transcript_json_path = Path(self.fp).with_suffix('.transcript.json')
+            with open(self.transcript_json_path, "w", encoding="utf-8") as f:
+                f.write(transcript.to_json())
 
             output_path = Path(self.fp).with_suffix('.txt')
             with open(output_path, "w", encoding="utf-8") as f:
-                f.write(full_transcript)
+                f.write(transcript.plain_text() + "\n" if len(transcript) else "")
             print("finished writing")
             
             end_time = time.time()
             duration = end_time - start_time
 
-            #delete the temp directory now
-            # temp_dir = os.path.dirname(chunks[0][1])
-            # for _, _, files in os.walk(temp_dir):
-            #     for file in files:
-            #         os.remove(os.path.join(temp_dir, file))
-            # print("deleted the temp dir")
-        
             print(f"\nTranscription completed in {duration:.2f} seconds")
             # print(f"Transcript saved to: {output_path}")
         
@@ -132,13 +433,6 @@ class AudioHandler:
         except Exception as e:
             print(f"An error occurred: {str(e)}")
             raise
-        finally:
-            for _, start, end, chunk_path in chunks:
-                try:
-                    if os.path.exists(chunk_path):
-                        os.remove(chunk_path)
-                except:
-                    pass
 
 
 # if __name__ == "__main__":